@@ -20,6 +20,7 @@ from .dialogs import SettingsDialog, SingleResultDialog, TypingDialog
 from .menus import TypingMenuBar
 from .panels import ResultsPanel, TestsPanel, UsersPanel
 from .database import session_scope, Sentences, Results
+from .session import TypingSession
 
 # __all__ = ["main", "TypingDialog", "ResultsDatabase", "TypingMenuBar"]
 __version__ = "1.0"
\ No newline at end of file
@@ -0,0 +1,445 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Command line tools for looking after typing test databases.
+
+Run ``accessible_typing_test_admin --help`` for a list of commands.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+
+
+def simulate(args: argparse.Namespace) -> int:
+	"""Runs simulated stations against a database and reports the load."""
+	from .simulator import runStations
+	report = runStations(
+		args.stations,
+		args.database,
+		seed=args.seed,
+		tests=args.tests,
+		typists=args.typists,
+		wpm=args.wpm,
+		wpm_spread=args.wpm_spread,
+		error_rate=args.error_rate,
+		pause_mean=args.pause_mean,
+		pause_distribution=args.pause_distribution,
+		word_count=args.words,
+		)
+	print(
+		f"{report['stored']} tests stored by {report['stations']} stations "
+		f"in {report['seconds']:.1f} seconds "
+		f"({report['tests_per_second']:.1f} tests per second), "
+		f"{report['failed']} failed."
+		)
+	print(
+		"Write latency: "
+		f"mean {report['write_mean'] * 1000:.1f} ms, "
+		f"p50 {report['write_p50'] * 1000:.1f} ms, "
+		f"p95 {report['write_p95'] * 1000:.1f} ms, "
+		f"p99 {report['write_p99'] * 1000:.1f} ms, "
+		f"max {report['write_max'] * 1000:.1f} ms."
+		)
+	return 0 if not report["failed"] else 1
+
+
+def benchmark(args: argparse.Namespace) -> int:
+	"""Runs the benchmarks, saves them as JSON and compares them with older ones."""
+	from .benchmarks import compareBenchmarks, runBenchmarks
+	report = runBenchmarks(sizes=args.sizes, seed=args.seed, directory=args.scratch)
+	with open(args.output, "w") as output:
+		json.dump(report, output, indent=2)
+	if args.compare:
+		with open(args.compare) as old:
+			lines = compareBenchmarks(json.load(old), report)
+	else:
+		lines = [
+			f"{name}: {timing['median'] * 1000:.3f} ms"
+			for name, timing in report["benchmarks"].items()
+			]
+	print("\n".join(lines))
+	return 0
+
+
+def hardest(args: argparse.Namespace) -> int:
+	"""Lists the sentences which are typed wrong most often."""
+	from .database import connect, SentenceStatistics
+	connect(args.database)
+	for row in SentenceStatistics.hardestSentences(args.limit, args.minimum_attempts):
+		print(
+			f"{row.mean_error_rate * 100:5.1f}% errors, {row.mean_wpm:5.1f} WPM, "
+			f"{row.attempts} attempts: {row.sentence}"
+			)
+	return 0
+
+
+def compact(args: argparse.Namespace) -> int:
+	"""Moves results stored by older versions to the compact form."""
+	import os
+	from .database import connect, disconnect, Results
+	engine = connect(args.database)
+	before = os.path.getsize(engine.url.database)
+	count = Results.compactResults(args.batch_size)
+	if args.vacuum:
+		with engine.connect() as connection:
+			connection.exec_driver_sql("VACUUM")
+	disconnect()
+	after = os.path.getsize(engine.url.database)
+	print(
+		f"Compacted {count} results. "
+		f"The database is {after / 1048576:.1f} MB, was {before / 1048576:.1f} MB."
+		)
+	return 0
+
+
+def confusions(args: argparse.Namespace) -> int:
+	"""Lists the characters typed in place of others most often."""
+	from .confusion import GAP
+	from .database import connect, session_scope, CharacterConfusions
+	connect(args.database)
+	if args.rebuild:
+		with session_scope() as session:
+			count = CharacterConfusions.rebuild(session)
+		print(f"Lined up {count} results.")
+	matrix = CharacterConfusions.matrix(args.user)
+
+	def name(character):
+		return "nothing" if character == GAP else repr(character)
+
+	print(f"Commonest mistakes of {args.user or 'everyone'}:")
+	for expected, typed, count in matrix.confusions(args.limit):
+		print(f"{count:8} {name(typed)} typed for {name(expected)}")
+	return 0
+
+
+def date(text: str) -> datetime.datetime:
+	"""Reads a date given on the command line as YYYY-MM-DD."""
+	try:
+		return datetime.datetime.strptime(text, "%Y-%m-%d")
+	except ValueError:
+		raise argparse.ArgumentTypeError(f"{text} is not a date like 2019-12-31.")
+
+
+def rollover(args: argparse.Namespace) -> int:
+	"""Moves old results into archives, one for each year."""
+	from .database import archiveFileName, connect, rolloverResults
+	connect(args.database)
+	if args.before is not None:
+		cutoff = args.before
+	else:
+		cutoff = datetime.datetime.now() - datetime.timedelta(days=args.keep_days)
+	moved = rolloverResults(cutoff)
+	for year, count in moved.items():
+		print(f"{count} results from {year} moved to {archiveFileName(year)}.")
+	if not moved:
+		print(f"There are no results from before {cutoff:%Y-%m-%d} to move.")
+	return 0
+
+
+def export(args: argparse.Namespace) -> int:
+	"""Exports results to an Excel workbook, reading archives if needed."""
+	from .database import connect, Results
+	from .export import exportResults, formatResult
+	connect(args.database)
+	rows = Results.listResults(since=args.since, until=args.until)
+	count = exportResults(args.output, (formatResult(row) for row in rows))
+	print(f"Exported {count} results to {args.output}.")
+	return 0
+
+
+def reports(args: argparse.Namespace) -> int:
+	"""Writes a workbook of results and statistics for every user."""
+	from .database import connect
+	from .reports import writeReports
+	connect(args.database)
+	written = writeReports(args.directory, args.since, args.until, args.processes)
+	print(
+		f"Wrote {len(written)} reports listing {sum(count for user, path, count in written)} "
+		f"results to {args.directory}."
+		)
+	return 0
+
+
+def merge(args: argparse.Namespace) -> int:
+	"""Merges the results of station databases into one database."""
+	from .merge import mergeDatabases
+	counts = mergeDatabases(
+		args.target,
+		args.sources,
+		batch_size=args.batch_size,
+		weaknesses=not args.skip_weaknesses,
+		)
+	for count in counts:
+		print(
+			f"{count.source}: {count.read} results read, {count.inserted} added, "
+			f"{count.duplicates} already stored, in {count.seconds:.1f} seconds."
+			)
+	print(
+		f"Added {sum(count.inserted for count in counts)} results "
+		f"from {len(counts)} databases to {args.target}."
+		)
+	return 0
+
+
+def collect(args: argparse.Namespace) -> int:
+	"""Runs a collector which stores the results stations send to it."""
+	from .collector import ResultsCollector
+	from .database import connect
+	connect(args.database)
+	collector = ResultsCollector(args.host, args.port, batch_size=args.batch_size)
+	print(f"Collecting results at {collector.url}. Press Ctrl+C to stop.")
+	try:
+		collector.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		collector.server_close()
+	return 0
+
+
+def backup(args: argparse.Namespace) -> int:
+	"""Backs a database up while it is in use and removes old backups."""
+	import os
+	from .backup import backupDatabase, rotateBackups
+	from .database import connect
+	path = connect(args.database).url.database
+	directory = args.directory or os.path.join(os.path.dirname(os.path.abspath(path)), "backups")
+	destination = backupDatabase(path, directory)
+	removed = rotateBackups(path, directory, args.keep)
+	print(f"Backed up {path} to {destination}. Removed {len(removed)} old backups.")
+	return 0
+
+
+def maintain(args: argparse.Namespace) -> int:
+	"""Checks, vacuums and analyzes a database straight away."""
+	from .database import connect, disconnect
+	from .maintenance import runMaintenance
+	path = connect(args.database).url.database
+	disconnect()
+	tasks = runMaintenance(path, full=args.full)
+	for task in tasks:
+		print(f"{task.name}: {task.detail} ({task.seconds:.2f} seconds)")
+	return 0 if tasks[0].detail == "ok" else 1
+
+
+def parser() -> argparse.ArgumentParser:
+	"""Builds the parser for the command line."""
+	from .benchmarks import DEFAULT_SIZES
+	from .collector import DEFAULT_PORT
+	from .simulator import PAUSE_DISTRIBUTIONS
+	top = argparse.ArgumentParser(
+		prog="accessible_typing_test_admin",
+		description="Tools for looking after typing test databases.",
+		)
+	top.add_argument("-v", "--verbose", action="store_true", help="Log debug messages.")
+	commands = top.add_subparsers(dest="command", required=True)
+
+	command = commands.add_parser(
+		"simulate",
+		help="Generate load with simulated typists on many stations.",
+		)
+	command.add_argument("database", help="The database file to write to.")
+	command.add_argument("--stations", type=int, default=4)
+	command.add_argument("--tests", type=int, default=100, help="Tests per station.")
+	command.add_argument("--typists", type=int, default=5, help="Typists per station.")
+	command.add_argument("--wpm", type=float, default=40)
+	command.add_argument("--wpm-spread", type=float, default=10)
+	command.add_argument("--error-rate", type=float, default=0.02)
+	command.add_argument("--pause-mean", type=float, default=1.5)
+	command.add_argument(
+		"--pause-distribution",
+		choices=PAUSE_DISTRIBUTIONS,
+		default="lognormal",
+		)
+	command.add_argument("--words", type=int, default=10, help="Words per test.")
+	command.add_argument("--seed", type=int, default=None)
+	command.set_defaults(function=simulate)
+
+	command = commands.add_parser(
+		"benchmark",
+		help="Time scoring, storage, listing and export of results.",
+		)
+	command.add_argument(
+		"-o",
+		"--output",
+		default="benchmarks.json",
+		help="The JSON file to save timings to.",
+		)
+	command.add_argument("--compare", help="A JSON file of earlier timings to compare with.")
+	command.add_argument(
+		"--sizes",
+		type=int,
+		nargs="+",
+		default=list(DEFAULT_SIZES),
+		help="Numbers of stored results to benchmark at.",
+		)
+	command.add_argument("--seed", type=int, default=0)
+	command.add_argument("--scratch", help="Where to put scratch databases.")
+	command.set_defaults(function=benchmark)
+
+	command = commands.add_parser(
+		"hardest",
+		help="List the sentences which are typed wrong most often.",
+		)
+	command.add_argument("database", nargs="?", help="The database file to read.")
+	command.add_argument("--limit", type=int, default=20)
+	command.add_argument("--minimum-attempts", type=int, default=5)
+	command.set_defaults(function=hardest)
+
+	command = commands.add_parser(
+		"confusions",
+		help="List the characters typed in place of others most often.",
+		)
+	command.add_argument("database", nargs="?", help="The database file to read.")
+	command.add_argument("--user", help="Only list the mistakes of this user.")
+	command.add_argument("--limit", type=int, default=20)
+	command.add_argument(
+		"--rebuild",
+		action="store_true",
+		help="Line up every stored result again first, as databases from older versions need.",
+		)
+	command.set_defaults(function=confusions)
+
+	command = commands.add_parser(
+		"compact",
+		help="Store the text of old results as sentence ids and compressed text.",
+		)
+	command.add_argument("database", nargs="?", help="The database file to compact.")
+	command.add_argument("--batch-size", type=int, default=500)
+	command.add_argument(
+		"--vacuum",
+		action="store_true",
+		help="Give the space saved back to the file system afterwards.",
+		)
+	command.set_defaults(function=compact)
+
+	command = commands.add_parser(
+		"rollover",
+		help="Move old results into an archive database for each year.",
+		)
+	command.add_argument("database", nargs="?", help="The database file to move results from.")
+	cutoff = command.add_mutually_exclusive_group()
+	cutoff.add_argument("--before", type=date, help="Move results started before this date.")
+	cutoff.add_argument(
+		"--keep-days",
+		type=int,
+		default=365,
+		help="Move results older than this many days.",
+		)
+	command.set_defaults(function=rollover)
+
+	command = commands.add_parser(
+		"export",
+		help="Export results to an Excel workbook.",
+		)
+	command.add_argument("database", help="The database file to read.")
+	command.add_argument("output", help="The workbook to write.")
+	command.add_argument(
+		"--since",
+		type=date,
+		help="Leave out results before this date. Archives are read when needed.",
+		)
+	command.add_argument("--until", type=date, help="Leave out results from this date on.")
+	command.set_defaults(function=export)
+
+	command = commands.add_parser(
+		"reports",
+		help="Write a workbook of results and statistics for every user.",
+		)
+	command.add_argument("database", help="The database file to read.")
+	command.add_argument("directory", help="Where to write the workbooks.")
+	command.add_argument(
+		"--since",
+		type=date,
+		help="Leave out results before this date. Archives are read when needed.",
+		)
+	command.add_argument("--until", type=date, help="Leave out results from this date on.")
+	command.add_argument(
+		"--processes",
+		type=int,
+		help="How many workbooks to write at once. Defaults to one for each processor.",
+		)
+	command.set_defaults(function=reports)
+
+	command = commands.add_parser(
+		"merge",
+		help="Add the results of station databases to one database.",
+		)
+	command.add_argument("target", help="The database file to merge into.")
+	command.add_argument("sources", nargs="+", help="The database files to merge from.")
+	command.add_argument("--batch-size", type=int, default=10000)
+	command.add_argument(
+		"--skip-weaknesses",
+		action="store_true",
+		help="Do not add the merged results to each user's weaknesses.",
+		)
+	command.set_defaults(function=merge)
+
+	command = commands.add_parser(
+		"collect",
+		help="Store results which stations send over the network.",
+		)
+	command.add_argument("database", nargs="?", help="The database file to store results in.")
+	command.add_argument(
+		"--host",
+		default="127.0.0.1",
+		help="The address to listen on. Use 0.0.0.0 to accept results from other machines.",
+		)
+	command.add_argument("--port", type=int, default=DEFAULT_PORT)
+	command.add_argument("--batch-size", type=int, default=500)
+	command.set_defaults(function=collect)
+
+	command = commands.add_parser(
+		"backup",
+		help="Back a database up safely, even while stations are using it.",
+		)
+	command.add_argument("database", nargs="?", help="The database file to back up.")
+	command.add_argument(
+		"--directory",
+		help="Where to keep backups. Defaults to backups next to the database.",
+		)
+	command.add_argument("--keep", type=int, default=7, help="How many backups to keep.")
+	command.set_defaults(function=backup)
+
+	command = commands.add_parser(
+		"maintain",
+		help="Check a database, give its free space back and update its statistics.",
+		)
+	command.add_argument("database", nargs="?", help="The database file to maintain.")
+	command.add_argument(
+		"--full",
+		action="store_true",
+		help="Vacuum in full, which locks the database until done.",
+		)
+	command.set_defaults(function=maintain)
+	return top
+
+
+def main(argv: list = None) -> int:
+	"""Runs the command given on the command line."""
+	args = parser().parse_args(argv)
+	logging.basicConfig(
+		format="%(asctime)s: %(levelname)s: %(message)s",
+		datefmt="%Y-%m-%d %I:%M:%S %p",
+		level=logging.DEBUG if args.verbose else logging.INFO
+		)
+	return args.function(args)
+
+
+if __name__ == "__main__":
+	raise SystemExit(main())
@@ -0,0 +1,205 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Backups of the results database which are safe to take while tests run.
+
+Copying the database file while a station writes to it can give a corrupt
+copy. Backups are made with SQLite's online backup API instead, a few pages
+at a time with a pause between steps, so a station never waits long for the
+database. Each backup is checked before it replaces anything, and only the
+newest few are kept.
+"""
+
+import datetime
+import glob
+import logging
+import os
+import sqlite3
+import threading
+from .metrics import timer
+
+# Pages copied in each step. With SQLite's usual 4 KB pages a step takes a
+# millisecond or so.
+STEP_PAGES = 64
+# Seconds to pause between steps, leaving the database free for stations.
+STEP_PAUSE = 0.005
+# SQLite starts a backup again whenever another connection writes to the
+# database. After this many restarts the rest is copied in one step, which
+# holds a read lock for as long as copying the file takes.
+MAX_RESTARTS = 3
+BACKUP_SUFFIX = ".bak"
+
+
+class _Restarted(Exception):
+	"""Raised to give up on copying a busy database in steps."""
+
+
+def _copyDatabase(
+	source: sqlite3.Connection,
+	target: sqlite3.Connection,
+	pages: int,
+	pause: float,
+	) -> None:
+	"""Copies a database in steps, or in one step if writes keep restarting it."""
+	remaining = None
+	restarts = 0
+
+	def progress(status, left, total):
+		nonlocal remaining, restarts
+		if remaining is not None and left > remaining:
+			restarts += 1
+			if restarts > MAX_RESTARTS:
+				raise _Restarted()
+		remaining = left
+
+	try:
+		source.backup(target, pages=pages, progress=progress, sleep=pause)
+	except _Restarted:
+		logging.info("The database is busy, so it is being backed up in one step.")
+		source.backup(target)
+
+
+def backupFileName(path: str, directory: str, when: datetime.datetime = None) -> str:
+	"""Returns the file a backup of a database made at a time is kept in."""
+	when = when or datetime.datetime.now()
+	root = os.path.splitext(os.path.basename(path))[0]
+	return os.path.join(directory, f"{root}-{when:%Y%m%d-%H%M%S}{BACKUP_SUFFIX}")
+
+
+def backupDatabase(
+	path: str,
+	directory: str,
+	pages: int = STEP_PAGES,
+	pause: float = STEP_PAUSE,
+	) -> str:
+	"""Copies a database into a new backup file, however busy the database is.
+
+	The copy is written under a temporary name and checked with SQLite's
+	quick_check before it is given its real name, so a backup file is always
+	complete.
+
+	Args:
+		path: The database file to back up.
+		directory: Where to keep backups, which is created if needed.
+		pages: How many pages to copy in each step.
+		pause: How many seconds to pause between steps.
+
+	Returns:
+		str: The backup file.
+
+	Raises:
+		sqlite3.DatabaseError: The backup could not be made or failed its check.
+	"""
+	os.makedirs(directory, exist_ok=True)
+	destination = backupFileName(path, directory)
+	temporary = destination + ".tmp"
+	with timer("backupDatabase"):
+		source = sqlite3.connect(path, timeout=30)
+		target = sqlite3.connect(temporary)
+		try:
+			_copyDatabase(source, target, pages, pause)
+			result = target.execute("PRAGMA quick_check").fetchone()[0]
+		finally:
+			target.close()
+			source.close()
+	if result != "ok":
+		os.remove(temporary)
+		raise sqlite3.DatabaseError(f"The backup of {path} failed its check: {result}")
+	os.replace(temporary, destination)
+	logging.info(
+		"Backed up %s to %s (%.1f MB).",
+		path,
+		destination,
+		os.path.getsize(destination) / 1048576,
+		)
+	return destination
+
+
+def listBackups(path: str, directory: str) -> list:
+	"""Returns the backups of a database, oldest first."""
+	root = os.path.splitext(os.path.basename(path))[0]
+	pattern = os.path.join(glob.escape(directory), f"{glob.escape(root)}-*{BACKUP_SUFFIX}")
+	return sorted(glob.glob(pattern))
+
+
+def rotateBackups(path: str, directory: str, keep: int) -> list:
+	"""Deletes all but the newest backups of a database.
+
+	Args:
+		path: The database file the backups are of.
+		directory: Where the backups are kept.
+		keep: How many backups to keep.
+
+	Returns:
+		list: The backup files deleted.
+	"""
+	backups = listBackups(path, directory)
+	removed = backups[:max(len(backups) - keep, 0)]
+	for backup in removed:
+		os.remove(backup)
+		logging.info("Removed the old backup %s.", backup)
+	return removed
+
+
+class BackupScheduler(threading.Thread):
+	"""A background thread which backs a database up at regular intervals."""
+
+	def __init__(
+		self,
+		path: str,
+		directory: str,
+		interval: float = 24 * 60 * 60,
+		keep: int = 7,
+		) -> None:
+		"""Initialize a BackupScheduler.
+
+		Args:
+			path: The database file to back up.
+			directory: Where to keep backups.
+			interval: How many seconds to leave between backups.
+			keep: How many backups to keep.
+		"""
+		super().__init__(name="BackupScheduler", daemon=True)
+		self.path = path
+		self.directory = directory
+		self.interval = interval
+		self.keep = keep
+		self._stopping = threading.Event()
+
+	def due(self) -> float:
+		"""Returns how many seconds are left until the next backup is due."""
+		backups = listBackups(self.path, self.directory)
+		if not backups:
+			return 0
+		age = datetime.datetime.now().timestamp() - os.path.getmtime(backups[-1])
+		return max(self.interval - age, 0)
+
+	def stop(self, timeout: float = None) -> None:
+		"""Stops the thread, waiting for a backup in progress to finish."""
+		self._stopping.set()
+		self.join(timeout)
+
+	def run(self) -> None:
+		"""Makes a backup whenever one is due until stopped."""
+		while not self._stopping.wait(self.due()):
+			try:
+				backupDatabase(self.path, self.directory)
+				rotateBackups(self.path, self.directory, self.keep)
+			except (OSError, sqlite3.Error):
+				logging.exception("Could not back up %s.", self.path)
+				# Try again after a while rather than straight away.
+				if self._stopping.wait(min(self.interval, 60 * 60)):
+					break
@@ -0,0 +1,287 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Reproducible benchmarks of scoring, storage and listing of results.
+
+Every benchmark works on generated data from a fixed random seed, in scratch
+databases which are thrown away afterwards. The timings are saved as JSON so
+that two versions of the program can be compared with compareBenchmarks.
+"""
+
+import datetime
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from pkg_resources import resource_filename
+from . import __version__
+from .database import (
+	clearQueryCache,
+	compressText,
+	connect,
+	disconnect,
+	encodeIds,
+	session_scope,
+	Sentences,
+	SentenceFeatures,
+	Results,
+	UserBests,
+	)
+from .export import exportResults, formatResult
+from .lev import levenshteinDistance
+from .simulator import SimulatedTypist
+from .weakness import errorCounts, AdaptiveSelector, WeaknessProfile
+
+DEFAULT_SIZES = (1000, 100000, 1000000)
+
+
+def measure(function, repeat: int = 5) -> dict:
+	"""Times a function.
+
+	Args:
+		function: Called with no arguments repeat times.
+		repeat: How many times to call the function.
+
+	Returns:
+		dict: The fastest, median and mean times in seconds.
+	"""
+	times = []
+	for run in range(repeat):
+		began = time.perf_counter()
+		function()
+		times.append(time.perf_counter() - began)
+	return {
+		"runs": repeat,
+		"min": min(times),
+		"median": statistics.median(times),
+		"mean": statistics.mean(times),
+		}
+
+
+def uncached(function):
+	"""Wraps a function so each call reads the database rather than the query cache."""
+	def call():
+		clearQueryCache()
+		return function()
+	return call
+
+
+def corpus() -> list:
+	"""Returns the stock sentences which ship with the program."""
+	with open(resource_filename(__name__, "data/sentences.txt")) as sentence_file:
+		return [line.strip() for line in sentence_file if line.strip()]
+
+
+def seedResults(count: int, sentences: list, chooser: random.Random) -> None:
+	"""Bulk inserts generated results into the connected database.
+
+	The sentences are added to the database too if it has none, and the users'
+	bests are worked out once the results are in.
+
+	Args:
+		count: How many results to insert.
+		sentences: The sentences to make given and typed text from.
+		chooser: The source of random numbers.
+	"""
+	users = [f"User {number}" for number in range(max(1, count // 20))]
+	start = datetime.datetime(2019, 1, 1)
+	batch = []
+	with session_scope() as session:
+		if not session.query(Sentences).count():
+			session.execute(
+				Sentences.__table__.insert(),
+				[{"id": id, "sentence": sentence} for id, sentence in enumerate(sentences, 1)],
+				)
+		for number in range(count):
+			start_time = start + datetime.timedelta(minutes=number)
+			duration = chooser.randint(20, 120)
+			given_ids = chooser.sample(range(1, len(sentences) + 1), 2)
+			given = "\n".join(sentences[id - 1] for id in given_ids)
+			batch.append({
+				"user_name": chooser.choice(users),
+				"start_time": start_time,
+				"end_time": start_time + datetime.timedelta(seconds=duration),
+				"duration": duration,
+				"accuracy": chooser.randint(70, 100),
+				"edit_distance": chooser.randint(0, 20),
+				"speed": chooser.randint(10, 90),
+				"words": chooser.randint(10, 40),
+				"timestamp": start_time.strftime("%m/%d/%y %I:%M %p"),
+				"given_ids": encodeIds(given_ids),
+				"typed_data": compressText(given),
+				})
+			if len(batch) == 10000:
+				session.execute(Results.__table__.insert(), batch)
+				batch = []
+		if batch:
+			session.execute(Results.__table__.insert(), batch)
+		UserBests.rebuild(session)
+
+
+def benchmarkEditDistance(sentences: list, chooser: random.Random) -> dict:
+	"""Times edit distances between given and mistyped text of several lengths."""
+	typist = SimulatedTypist("Benchmark", error_rate=0.05, seed=chooser.randrange(2 ** 32))
+	timings = {}
+	for sentence_count in (1, 4, 16):
+		given = "\n".join(chooser.sample(sentences, sentence_count))
+		typed = typist.mistype(given)
+		timing = measure(lambda: levenshteinDistance(given, typed))
+		timing["characters"] = len(given)
+		timings[f"edit_distance/{sentence_count}_sentences"] = timing
+	return timings
+
+
+def benchmarkSentences(directory: str) -> dict:
+	"""Times importing the stock sentences and drawing unused sentences.
+
+	Sentences are drawn straight from the database, from a SentenceIndex and by an
+	AdaptiveSelector, and a test of 50 words is planned.
+	"""
+	timings = {}
+	path = os.path.join(directory, "sentences.dat")
+	connect(path)
+	timings["sentence_import"] = measure(lambda: Sentences.fillSentences(), repeat=1)
+	used = set()
+
+	def draw():
+		used.add(Sentences.unusedSentence(used).id)
+
+	timings["sentence_sampling"] = measure(draw, repeat=50)
+	timings["sentence_index_load"] = measure(lambda: SentenceFeatures.loadIndex())
+	index = SentenceFeatures.loadIndex(random.Random(0))
+	indexed = set()
+
+	def drawIndexed():
+		indexed.add(index.draw(indexed, level=3).id)
+
+	timings["sentence_index_draw"] = measure(drawIndexed, repeat=50)
+	typist = SimulatedTypist("Benchmark", error_rate=0.05, seed=0)
+	profile = WeaknessProfile()
+	for entry in list(index.entries.values())[:100]:
+		profile.add(errorCounts(entry.sentence, typist.mistype(entry.sentence)))
+	selector = AdaptiveSelector(index, profile, chooser=random.Random(0))
+	adapted = set()
+
+	def drawAdapted():
+		adapted.add(selector.draw(adapted).id)
+
+	timings["sentence_adaptive_draw"] = measure(drawAdapted, repeat=50)
+	timings["sentence_plan/50_words"] = measure(lambda: index.planTest(50, draw=selector.draw))
+	return timings
+
+
+def benchmarkSize(directory: str, size: int, sentences: list, chooser: random.Random) -> dict:
+	"""Times the operations which depend on the number of stored results.
+
+	Args:
+		directory: Where to put the scratch database and workbook.
+		size: How many results to generate before timing.
+		sentences: The sentences to generate results from.
+		chooser: The source of random numbers.
+
+	Returns:
+		dict: Timings keyed by benchmark name and size.
+	"""
+	timings = {}
+	connect(os.path.join(directory, f"results-{size}.dat"))
+	seedResults(size, sentences, chooser)
+	typist = SimulatedTypist("Benchmark", seed=chooser.randrange(2 ** 32))
+	results_dict = typist.takeTest(
+		lambda used: Sentences(id=len(used), sentence=chooser.choice(sentences))
+		)
+
+	def insert():
+		Results.storeResults([results_dict])
+
+	timings[f"result_insert/{size}"] = measure(insert, repeat=20)
+	user = f"User {chooser.randrange(max(1, size // 20))}"
+	timings[f"user_statistics/{size}"] = measure(uncached(lambda: Results.userStatistics(user)))
+	timings[f"all_user_statistics/{size}"] = measure(
+		uncached(Results.allUserStatistics),
+		repeat=3,
+		)
+	timings[f"leaders/{size}"] = measure(uncached(lambda: Results.leaders("speed")))
+	timings[f"results_list/{size}"] = measure(
+		uncached(lambda: [formatResult(row) for row in Results.listResults()]),
+		repeat=3,
+		)
+	path = os.path.join(directory, f"export-{size}.xlsx")
+	timings[f"export/{size}"] = measure(
+		uncached(lambda: exportResults(path, (formatResult(row) for row in Results.listResults()))),
+		repeat=1,
+		)
+	return timings
+
+
+def runBenchmarks(sizes=DEFAULT_SIZES, seed: int = 0, directory: str = None) -> dict:
+	"""Runs every benchmark.
+
+	Args:
+		sizes: The numbers of stored results to time storage and listing at.
+		seed: Seeds the random numbers so runs can be repeated.
+		directory: Where to keep scratch files. Defaults to a temporary directory
+			which is removed afterwards.
+
+	Returns:
+		dict: A description of the environment and the timings of each benchmark.
+	"""
+	chooser = random.Random(seed)
+	sentences = corpus()
+	report = {
+		"version": __version__,
+		"python": platform.python_version(),
+		"sqlite": sqlite3.sqlite_version,
+		"platform": platform.platform(),
+		"created": datetime.datetime.now().isoformat(timespec="seconds"),
+		"seed": seed,
+		"benchmarks": {},
+		}
+	with tempfile.TemporaryDirectory(dir=directory) as scratch:
+		report["benchmarks"].update(benchmarkEditDistance(sentences, chooser))
+		report["benchmarks"].update(benchmarkSentences(scratch))
+		for size in sizes:
+			report["benchmarks"].update(benchmarkSize(scratch, size, sentences, chooser))
+		# Let go of the scratch databases before their directory is removed.
+		disconnect()
+	return report
+
+
+def compareBenchmarks(old: dict, new: dict) -> list:
+	"""Compares the median times of two benchmark reports.
+
+	Args:
+		old: The report to compare against.
+		new: The report to compare.
+
+	Returns:
+		list: Lines giving each benchmark's old and new median and how many times
+		faster or slower the new one is.
+	"""
+	lines = []
+	for name, timing in new["benchmarks"].items():
+		before = old["benchmarks"].get(name)
+		if before is None:
+			lines.append(f"{name}: {timing['median'] * 1000:.3f} ms (new)")
+			continue
+		ratio = before["median"] / timing["median"] if timing["median"] else float("inf")
+		lines.append(
+			f"{name}: {before['median'] * 1000:.3f} ms -> "
+			f"{timing['median'] * 1000:.3f} ms ({ratio:.2f}x)"
+			)
+	return lines
@@ -0,0 +1,372 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A small service which collects results from stations over HTTP.
+
+Rather than sharing one database file over a network drive, one machine can run
+a ResultsCollector with ``accessible_typing_test_admin collect`` and stations
+can send their results to it by setting collectorUrl. Stations still spool
+every result with a ResultsWriter, so they keep working while the collector
+cannot be reached and send what they have stored up once it can.
+
+The collector queues the uploads of every station and stores them together,
+so when many stations send results at once the database sees a few large
+transactions rather than many small ones. Results are stored idempotently, so
+an upload which is sent again after a lost reply is not stored twice.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import queue
+import socket
+import threading
+import time
+import urllib.request
+from .database import Results, Sentences, session_scope
+from .metrics import timer
+from .writer import decodeResults, encodeResults
+
+# The port a collector listens on unless told otherwise.
+DEFAULT_PORT = 8470
+# How many replies a collector remembers for uploads which are sent again.
+REMEMBERED_REPLIES = 1000
+# Marks the end of the queue when the collector is stopped.
+_STOP = object()
+
+
+class CollectorSink:
+	"""Stores results by sending them to a collector.
+
+	A CollectorSink can be given to a ResultsWriter in place of
+	Results.storeResults.
+	"""
+
+	def __init__(self, url: str, timeout: float = 30) -> None:
+		"""Initialize a CollectorSink.
+
+		Args:
+			url: The address of the collector, such as http://proctor:8470.
+			timeout: How many seconds to wait for the collector to reply.
+		"""
+		self.url = url.rstrip("/")
+		self.timeout = timeout
+
+	def __call__(self, results_dicts: list) -> list:
+		"""Sends results to the collector.
+
+		Args:
+			results_dicts: Results as calculated by a TypingSession.
+
+		Returns:
+			list: The ids the collector stored the results under.
+
+		Raises:
+			OSError: The collector could not be reached or did not store the results.
+		"""
+		request = urllib.request.Request(
+			f"{self.url}/results",
+			data=encodeResults({"results": results_dicts}).encode("utf-8"),
+			headers={"Content-Type": "application/json"},
+			method="POST",
+			)
+		with urllib.request.urlopen(request, timeout=self.timeout) as response:
+			return json.load(response)["ids"]
+
+
+def matchSentences(results_dicts: list) -> list:
+	"""Points the sentences of results from a station at this database's sentences.
+
+	Stations number their sentences themselves, so each sentence is found again
+	by its text, which is the line of the given text at its position. A sentence
+	which is not found is given no id, so the result keeps its given text.
+
+	Args:
+		results_dicts: Results as sent by stations, which are changed in place.
+
+	Returns:
+		list: The results.
+	"""
+	lines = [(results_dict.get("given_text") or "").split("\n") for results_dict in results_dicts]
+	with session_scope() as session:
+		ids = Sentences.matchTexts(session, [line for given in lines for line in given])
+	for given, results_dict in zip(lines, results_dicts):
+		for sentence in results_dict.get("sentences", []):
+			position = sentence.get("position")
+			if isinstance(position, int) and 0 <= position < len(given):
+				sentence["sentence_id"] = ids.get(given[position])
+			else:
+				sentence["sentence_id"] = None
+	return results_dicts
+
+
+def storeUploads(results_dicts: list) -> list:
+	"""Stores results sent by stations once their sentences are matched."""
+	return Results.storeResults(matchSentences(results_dicts))
+
+
+def resultsSink(url: str = None):
+	"""Returns where a station should store its results.
+
+	Args:
+		url: The address of a collector, or None or "" to use the database.
+
+	Returns:
+		A function which stores a list of results dictionaries and returns their ids.
+	"""
+	if url:
+		return CollectorSink(url)
+	return Results.storeResults
+
+
+class UploadQueue(threading.Thread):
+	"""A thread which stores the uploads of many stations in shared batches."""
+
+	def __init__(
+		self,
+		store=storeUploads,
+		batch_size: int = 500,
+		batch_delay: float = 0.05,
+		) -> None:
+		"""Initialize an UploadQueue.
+
+		Args:
+			store: Stores a list of results dictionaries and returns their ids.
+			batch_size: The most results to store in one transaction.
+			batch_delay: How many seconds to wait for more uploads to store along
+				with the first one.
+		"""
+		super().__init__(name="UploadQueue", daemon=True)
+		self._store = store
+		self.batch_size = batch_size
+		self.batch_delay = batch_delay
+		self._queue = queue.Queue()
+
+	def submit(self, results_dicts: list) -> Future:
+		"""Queues an upload to be stored.
+
+		Returns:
+			Future: Gives the ids of the stored results, in the same order.
+		"""
+		future = Future()
+		self._queue.put((results_dicts, future))
+		return future
+
+	def queued(self) -> int:
+		"""Returns roughly how many uploads are waiting to be stored."""
+		return self._queue.qsize()
+
+	def stop(self, timeout: float = None) -> None:
+		"""Stores everything already queued and then stops the thread."""
+		self._queue.put(_STOP)
+		self.join(timeout)
+
+	def _nextBatch(self) -> tuple:
+		"""Waits for an upload and gathers as many more as fit in one batch.
+
+		Returns:
+			tuple: The uploads, and True if the queue has been asked to stop.
+		"""
+		item = self._queue.get()
+		if item is _STOP:
+			return [], True
+		batch = [item]
+		size = len(item[0])
+		deadline = time.monotonic() + self.batch_delay
+		while size < self.batch_size:
+			try:
+				item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+			except queue.Empty:
+				break
+			if item is _STOP:
+				return batch, True
+			batch.append(item)
+			size += len(item[0])
+		return batch, False
+
+	def _write(self, batch: list) -> None:
+		"""Stores a batch of uploads and gives each one its own ids.
+
+		The whole batch is stored in one transaction. If that fails, each upload
+		is stored in a transaction of its own, so only the uploads which fail
+		again are told so.
+		"""
+		try:
+			with timer("UploadQueue.store"):
+				ids = self._store([
+					results_dict
+					for results_dicts, future in batch
+					for results_dict in results_dicts
+					])
+		except Exception as error:
+			if len(batch) == 1:
+				logging.exception("Could not store an upload of %d results.", len(batch[0][0]))
+				batch[0][1].set_exception(error)
+				return
+			logging.warning(
+				"Could not store uploads from %d stations together; storing them one at a time.",
+				len(batch),
+				exc_info=True,
+				)
+			for results_dicts, future in batch:
+				self._writeOne(results_dicts, future)
+			return
+		start = 0
+		for results_dicts, future in batch:
+			future.set_result(ids[start:start + len(results_dicts)])
+			start += len(results_dicts)
+
+	def _writeOne(self, results_dicts: list, future: Future) -> None:
+		"""Stores one upload by itself and gives it its ids or its error."""
+		try:
+			with timer("UploadQueue.store"):
+				future.set_result(self._store(results_dicts))
+		except Exception as error:
+			logging.exception("Could not store an upload of %d results.", len(results_dicts))
+			future.set_exception(error)
+
+	def run(self) -> None:
+		"""Stores batches of uploads until the queue is stopped."""
+		stopping = False
+		while not stopping:
+			batch, stopping = self._nextBatch()
+			if batch:
+				self._write(batch)
+
+
+class CollectorHandler(BaseHTTPRequestHandler):
+	"""Answers the requests of stations.
+
+	POST /results stores a JSON object whose results member lists results
+	dictionaries as encoded by encodeResults, and replies with their ids once
+	they are committed. If the request has an Idempotency-Key header, the reply
+	is remembered and given again to an upload sent again with the same key.
+	GET /health replies whether the collector is running.
+	"""
+
+	# Stations keep their connections open between uploads.
+	protocol_version = "HTTP/1.1"
+
+	def do_GET(self) -> None:
+		if self.path != "/health":
+			self._reply(404, {"error": f"{self.path} not found."})
+			return
+		self._reply(200, {"status": "ok", "queued": self.server.uploads.queued()})
+
+	def do_POST(self) -> None:
+		if self.path != "/results":
+			self._reply(404, {"error": f"{self.path} not found."})
+			return
+		try:
+			length = int(self.headers.get("Content-Length", 0))
+		except ValueError:
+			self._reply(400, {"error": "The Content-Length header is not a number."})
+			self.close_connection = True
+			return
+		# The body is always read, even for an upload which was sent before, or it
+		# would be taken for the next request on the connection.
+		body = self.rfile.read(length)
+		key = self.headers.get("Idempotency-Key")
+		if key:
+			ids = self.server.rememberedReply(key)
+			if ids is not None:
+				self._reply(200, {"ids": ids})
+				return
+		try:
+			results_dicts = decodeResults(body.decode("utf-8"))["results"]
+		except (ValueError, KeyError, TypeError) as error:
+			self._reply(400, {"error": f"Could not read the results: {error}"})
+			return
+		try:
+			ids = self.server.uploads.submit(results_dicts).result(self.server.timeout_seconds)
+		except Exception as error:
+			# The station keeps the results in its spool and tries again later.
+			self._reply(503, {"error": f"Could not store the results: {error}"})
+			return
+		if key:
+			self.server.rememberReply(key, ids)
+		self._reply(200, {"ids": ids})
+
+	def _reply(self, status: int, body: dict) -> None:
+		"""Sends a JSON reply."""
+		data = json.dumps(body).encode("utf-8")
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def log_message(self, format: str, *args) -> None:
+		logging.debug("%s: %s", self.address_string(), format % args)
+
+
+class ResultsCollector(ThreadingHTTPServer):
+	"""An HTTP server which stores the results sent by stations."""
+
+	daemon_threads = True
+	# A whole room of stations may send results the moment a timed test ends.
+	request_queue_size = 128
+
+	def __init__(
+		self,
+		host: str = "127.0.0.1",
+		port: int = DEFAULT_PORT,
+		store=storeUploads,
+		batch_size: int = 500,
+		timeout: float = 60,
+		) -> None:
+		"""Initialize a ResultsCollector.
+
+		Args:
+			host: The address to listen on. Use "" to listen on every network.
+			port: The port to listen on, or 0 for any free port.
+			store: Stores a list of results dictionaries and returns their ids.
+			batch_size: The most results to store in one transaction.
+			timeout: How many seconds an upload may wait to be stored.
+		"""
+		super().__init__((host, port), CollectorHandler)
+		self.timeout_seconds = timeout
+		self._replies = OrderedDict()
+		self._replies_lock = threading.Lock()
+		self.uploads = UploadQueue(store, batch_size=batch_size)
+		self.uploads.start()
+
+	@property
+	def url(self) -> str:
+		"""The address stations should send results to."""
+		host, port = self.server_address[:2]
+		if host in ("", "0.0.0.0"):
+			host = socket.gethostname()
+		return f"http://{host}:{port}"
+
+	def rememberReply(self, key: str, ids: list) -> None:
+		"""Remembers the ids given for an upload, forgetting the oldest if needed."""
+		with self._replies_lock:
+			self._replies[key] = ids
+			if len(self._replies) > REMEMBERED_REPLIES:
+				self._replies.popitem(last=False)
+
+	def rememberedReply(self, key: str) -> list:
+		"""Returns the ids given for an upload with a key, or None."""
+		with self._replies_lock:
+			return self._replies.get(key)
+
+	def server_close(self) -> None:
+		"""Stores what is still queued and stops listening."""
+		super().server_close()
+		self.uploads.stop(timeout=self.timeout_seconds)
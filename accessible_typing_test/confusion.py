@@ -0,0 +1,167 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Which characters are typed in place of which, for trainers' reports.
+
+Each result's sentences are lined up with what was typed using alignStrings,
+and every pair of expected and typed characters is counted. The counts are
+kept in the database for each user as results are stored, so a report never
+has to line up old results again. A ConfusionMatrix holds the counts of a
+user, or of everyone, in one flat array of whole numbers for reporting.
+"""
+
+from array import array
+from .lev import alignStrings
+
+# Stands for a missing character: the expected character of an inserted
+# character, or the typed character of a dropped one.
+GAP = ""
+
+
+def confusionCounts(given: str, typed: str) -> dict:
+	"""Counts each pair of expected and typed characters in a sentence.
+
+	Characters typed correctly are counted as the character paired with itself.
+
+	Args:
+		given: The sentence which should have been typed.
+		typed: What was typed.
+
+	Returns:
+		dict: Counts keyed by (expected, typed) character, where either may be GAP.
+	"""
+	counts = {}
+	for pair in alignStrings(given, typed):
+		counts[pair] = counts.get(pair, 0) + 1
+	return counts
+
+
+def textConfusions(given_text: str, typed_text: str) -> dict:
+	"""Counts the character pairs of every sentence of a result.
+
+	Args:
+		given_text: The given sentences, one to a line.
+		typed_text: What was typed for each sentence, one to a line.
+
+	Returns:
+		dict: Counts keyed by (expected, typed) character.
+	"""
+	counts = {}
+	for given, typed in zip((given_text or "").split("\n"), (typed_text or "").split("\n")):
+		if given:
+			mergeConfusions(counts, confusionCounts(given, typed))
+	return counts
+
+
+def mergeConfusions(total: dict, counts: dict, sign: int = 1) -> dict:
+	"""Adds counts made by confusionCounts to a running total.
+
+	Args:
+		total: The counts to add to, which are changed in place.
+		counts: The counts to add.
+		sign: 1 to add the counts or -1 to take them away.
+
+	Returns:
+		dict: The total.
+	"""
+	for pair, count in counts.items():
+		total[pair] = total.get(pair, 0) + sign * count
+	return total
+
+
+class ConfusionMatrix:
+	"""Counts of each typed character against each expected character.
+
+	The counts are kept in one flat array with a row for each expected
+	character and a column for each typed character. GAP is the first row and
+	column, so dropped characters are counted in the first column and inserted
+	characters in the first row.
+	"""
+
+	def __init__(self, counts: dict = None) -> None:
+		"""Initialize a ConfusionMatrix.
+
+		Args:
+			counts: Counts keyed by (expected, typed) character.
+		"""
+		counts = counts or {}
+		characters = {character for pair in counts for character in pair} - {GAP}
+		self.characters = [GAP] + sorted(characters)
+		self.positions = {character: position for position, character in enumerate(self.characters)}
+		size = len(self.characters)
+		self.counts = array("q", bytes(8 * size * size))
+		for (expected, typed), count in counts.items():
+			self.counts[self.positions[expected] * size + self.positions[typed]] += count
+
+	def count(self, expected: str, typed: str) -> int:
+		"""Returns how often a character was typed where another was expected."""
+		row = self.positions.get(expected)
+		column = self.positions.get(typed)
+		if row is None or column is None:
+			return 0
+		return self.counts[row * len(self.characters) + column]
+
+	def row(self, expected: str) -> dict:
+		"""Returns what was typed where a character was expected, with counts."""
+		position = self.positions.get(expected)
+		if position is None:
+			return {}
+		size = len(self.characters)
+		return {
+			self.characters[column]: count
+			for column, count in enumerate(self.counts[position * size:(position + 1) * size])
+			if count
+			}
+
+	def attempts(self, expected: str) -> int:
+		"""Returns how often a character was expected."""
+		return sum(self.row(expected).values())
+
+	def errorRate(self, expected: str) -> float:
+		"""Returns the share of the times a character was expected that it was typed wrong."""
+		attempts = self.attempts(expected)
+		if not attempts:
+			return 0.0
+		return 1 - self.count(expected, expected) / attempts
+
+	def confusions(self, limit: int = 20) -> list:
+		"""Returns the commonest mistakes, including drops and insertions.
+
+		Returns:
+			list: (expected, typed, count) tuples, commonest first. A drop has GAP
+			as its typed character and an insertion has GAP as its expected one.
+		"""
+		size = len(self.characters)
+		mistakes = [
+			(self.characters[position // size], self.characters[position % size], count)
+			for position, count in enumerate(self.counts)
+			if count and position // size != position % size
+			]
+		mistakes.sort(key=lambda mistake: (-mistake[2], mistake[0], mistake[1]))
+		return mistakes[:limit]
+
+	def drops(self) -> dict:
+		"""Returns how often each expected character was left out."""
+		size = len(self.characters)
+		return {
+			self.characters[row]: self.counts[row * size]
+			for row in range(1, size)
+			if self.counts[row * size]
+			}
+
+	def insertions(self) -> dict:
+		"""Returns how often each character was typed where nothing was expected."""
+		return {character: count for character, count in self.row(GAP).items() if character != GAP}
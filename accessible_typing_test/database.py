@@ -16,15 +16,30 @@
 
 """Database including typing test results and sentences for typing."""
 
+from collections import OrderedDict
 from contextlib import contextmanager
+import datetime
+import functools
+import glob
 import logging
 import os
+import sqlite3
+import threading
+import time
+import zlib
 from pkg_resources import resource_filename
-from sqlalchemy import create_engine, func
-from sqlalchemy import Boolean, Column, DateTime, Integer, String
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import bindparam, case, create_engine, event, func, inspect, literal, select, union_all
+from sqlalchemy import Index, MetaData, tuple_, update
+from sqlalchemy import Boolean, Column, DateTime, Float, ForeignKey, Integer, LargeBinary, String
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import declarative_base, object_session, relationship, selectinload, sessionmaker
 import wx
+from .confusion import mergeConfusions, textConfusions, ConfusionMatrix
+from .features import difficultyLevels, sentenceFeatures, IndexedSentence, SentenceIndex
+from .metrics import timed
+from .percentiles import binCounts, ALL_RESULTS, QuantileSketch
+from .weakness import errorCounts, mergeCounts, WeaknessProfile
 
 _config = wx.Config("typing_test")
 _db_path = _config.Read(
@@ -36,14 +51,114 @@ _db_url = f"sqlite:///{_db_path}"
 _engine = create_engine(_db_url, echo=False)
 Base = declarative_base()
 Session = sessionmaker(bind=_engine)
+# Upserts (INSERT ... ON CONFLICT DO UPDATE) need SQLite 3.24 and window
+# functions, used for medians and trends, need this library or newer.
+SQLITE_VERSION = (3, 25, 0)
+# Copies of tables which refer to them in attached databases.
+_attached_metadata = MetaData()
+_attached_tables = {}
+# Weakness profiles which have been loaded, keyed by user name.
+_profiles = {}
+_profiles_lock = threading.Lock()
+# Changes to each user's weaknesses in transactions which have not ended, and
+# how many changes have been committed, so that a profile which was read while
+# one was made is not kept.
+_profile_writes = {}
+_profile_changes = {}
+# Rows inserted, updated or deleted since the program started.
+_writes = 0
+_writes_lock = threading.Lock()
+# Results of read queries kept by cachedQuery, least recently used first.
+_query_cache = OrderedDict()
+_query_cache_lock = threading.Lock()
+# How many committed transactions have changed each table, keyed by table name.
+_generations = {}
+# The most query results kept in memory.
+QUERY_CACHE_SIZE = 128
+# The most seconds a query result is kept. Only this program's own commits
+# are seen, so this bounds how long results stored by other stations sharing
+# the database file can go unseen.
+QUERY_CACHE_SECONDS = 30
+
+
+def encodeIds(ids: list) -> str:
+	"""Joins a list of ids into the text kept in the database."""
+	return ",".join(str(id) for id in ids)
+
+
+def decodeIds(text: str) -> list:
+	"""Splits text made by encodeIds back into a list of ids."""
+	return [int(id) for id in text.split(",")] if text else []
+
+
+def compressText(text: str) -> bytes:
+	"""Compresses text to keep in the database."""
+	return zlib.compress(text.encode("utf-8"), 9)
+
+
+def decompressText(data: bytes) -> str:
+	"""Decompresses text made by compressText."""
+	return zlib.decompress(data).decode("utf-8") if data else ""
+
+
+def tableGenerations(tables) -> tuple:
+	"""Returns how many committed transactions have changed each of some tables."""
+	return tuple(_generations.get(table, 0) for table in tables)
+
+
+def cachedQuery(*tables):
+	"""Keeps the results of a read query in memory until one of its tables changes.
+
+	Results are kept for each set of arguments, which must be hashable, and the
+	same object is given to every caller, so callers must not change it. A
+	result is used again until a session commits a change to one of the tables,
+	it is pushed out by newer results or it is QUERY_CACHE_SECONDS old.
+
+	Args:
+		tables: The names of the tables the query reads.
+	"""
+	def decorator(function):
+		@functools.wraps(function)
+		def wrapper(*args, **kwargs):
+			key = (function.__qualname__, args, tuple(sorted(kwargs.items())))
+			now = time.monotonic()
+			with _query_cache_lock:
+				# Taken before the query runs, so a result read while another thread
+				# commits is not used again once that commit is counted.
+				generations = tableGenerations(tables)
+				entry = _query_cache.get(key)
+				if entry is not None and entry[0] == generations and now - entry[1] < QUERY_CACHE_SECONDS:
+					_query_cache.move_to_end(key)
+					return entry[2]
+			value = function(*args, **kwargs)
+			with _query_cache_lock:
+				_query_cache[key] = (generations, now, value)
+				_query_cache.move_to_end(key)
+				while len(_query_cache) > QUERY_CACHE_SIZE:
+					_query_cache.popitem(last=False)
+			return value
+		return wrapper
+	return decorator
+
+
+def clearQueryCache() -> None:
+	"""Forgets every query result kept by cachedQuery."""
+	with _query_cache_lock:
+		_query_cache.clear()
+
 
 class Sentences(Base):
-	"""Represents the sentences database table as a class."""
+	"""Represents the sentences database table as a class.
+
+	Results refer to the sentences they were given by id, so a sentence which
+	has been used in a test is retired rather than changed or deleted.
+	"""
 
 	__tablename__ = "sentences"
 
 	id = Column(Integer, primary_key=True)
 	sentence = Column(String)
+	retired = Column(Boolean, default=False)
 
 	def __repr__(self) -> str:
 		return f"{self.__class__.__name__}(sentence={repr(self.sentence)})"
@@ -52,13 +167,38 @@ class Sentences(Base):
 		"""Returns the sentence as a string."""
 		return self.sentence
 
+	@timed("Sentences.randomSentence")
 	def randomSentence() -> "Sentences":
 		"""Get a random sentence from the database.
 		
 		Returns:
 			Sentences: A Sentences object representing 1 randomly chosen sentence.
 		"""
-		return Session().query(Sentences).order_by(func.random()).first()
+		with session_scope() as session:
+			record = session.query(Sentences).filter(
+				Sentences.retired.isnot(True)
+				).order_by(func.random()).first()
+			# Detach the record so it can still be read once the session is closed.
+			session.expunge_all()
+			return record
+
+	@timed("Sentences.unusedSentence")
+	def unusedSentence(used: set) -> "Sentences":
+		"""Get a random sentence which is not among those already used.
+
+		Args:
+			used: The ids of sentences which should not be chosen.
+
+		Returns:
+			Sentences: A randomly chosen sentence, or None if every sentence is used.
+		"""
+		with session_scope() as session:
+			query = session.query(Sentences).filter(Sentences.retired.isnot(True))
+			if used:
+				query = query.filter(Sentences.id.notin_(used))
+			record = query.order_by(func.random()).first()
+			session.expunge_all()
+			return record
 
 	def fillSentences(filename: str = None) -> int:
 		"""Populates the sentences table.
@@ -71,7 +211,7 @@ class Sentences(Base):
 		Returns:
 			int: The count of sentences in the table.
 		"""
-		if os.path.isfile(filename):
+		if filename and os.path.isfile(filename):
 			sentence_filename = filename
 		else:
 			sentence_filename = os.path.join(
@@ -79,23 +219,150 @@ class Sentences(Base):
 				"data",
 				"sentences.txt"
 				)
-		logging.debug(f"Loading sentences from {sentence_filename}...")
+		logging.debug("Loading sentences from %s...", sentence_filename)
 		with session_scope() as session:
+			existing = {
+				sentence
+				for sentence, in session.query(Sentences.sentence).filter(
+					Sentences.retired.isnot(True)
+					)
+				}
+			added = []
 			with open(sentence_filename) as sentence_file:
 				for s in sentence_file:
 					s=s.strip()
-					if not session.query(Sentences).filter(Sentences.sentence == s).first():
-						session.add(Sentences(sentence=s))
-						logging.debug(f"Added {repr(s)} to database.")
-			return session.query(Sentences).count()
+					if s not in existing:
+						existing.add(s)
+						added.append(Sentences(sentence=s))
+						logging.debug("Added %r to database.", s)
+			session.add_all(added)
+			session.flush()
+			SentenceFeatures.indexSentences(session, added)
+			return session.query(Sentences).filter(Sentences.retired.isnot(True)).count()
+
+	def sentenceTexts(ids: list, session: Session = None) -> dict:
+		"""Get the text of sentences, including retired ones.
+
+		Args:
+			ids: The ids of the sentences.
+			session: The session to read them in. Defaults to a new session.
+
+		Returns:
+			dict: Sentence text keyed by id.
+		"""
+		if session is None:
+			with session_scope() as session:
+				return Sentences.sentenceTexts(ids, session)
+		return dict(
+			session.query(Sentences.id, Sentences.sentence).filter(Sentences.id.in_(set(ids)))
+			)
+
+	@cachedQuery("sentences")
+	def activeSentences() -> list:
+		"""Get the sentences which are not retired, as shown on the TestsPanel.
+
+		Returns:
+			list: Rows of id and sentence, in the order the sentences were added.
+		"""
+		with session_scope() as session:
+			return session.query(Sentences.id, Sentences.sentence).filter(
+				Sentences.retired.isnot(True)
+				).order_by(Sentences.id).all()
+
+	def matchTexts(session: Session, texts: list) -> dict:
+		"""Finds the sentences with the given texts, preferring ones not retired.
+
+		Args:
+			session: The session to look in.
+			texts: The sentence texts to look for.
+
+		Returns:
+			dict: Sentence ids keyed by text. Texts which are not found are left out.
+		"""
+		texts = list(set(texts))
+		found = {}
+		for start in range(0, len(texts), 500):
+			for id, sentence, retired in session.query(
+				Sentences.id,
+				Sentences.sentence,
+				Sentences.retired,
+				).filter(Sentences.sentence.in_(texts[start:start + 500])).order_by(
+				Sentences.retired.desc(),
+				):
+				# Active sentences come last so they win.
+				found[sentence] = id
+		return found
+
+	def inResults(session: Session, id: int) -> bool:
+		"""Tells whether any result was given a sentence.
+
+		Args:
+			session: The session to look in.
+			id: The id of the sentence.
+		"""
+		pattern = f"%,{id},%"
+		return session.query(
+			session.query(Results.id).filter(
+				(literal(",") + Results.given_ids + literal(",")).like(pattern)
+				).exists()
+			).scalar()
+
+	def retireSentence(session: Session, record: "Sentences") -> None:
+		"""Takes a sentence out of use, deleting it if no result refers to it.
+
+		Args:
+			session: The session the sentence belongs to.
+			record: The sentence to take out of use.
+		"""
+		session.query(SentenceFeatures).filter(
+			SentenceFeatures.sentence_id == record.id
+			).delete()
+		if Sentences.inResults(session, record.id):
+			record.retired = True
+		else:
+			session.delete(record)
+		session.flush()
+		SentenceFeatures.assignLevels(session)
+
+	def changeSentence(session: Session, record: "Sentences", sentence: str) -> "Sentences":
+		"""Changes the text of a sentence.
+
+		A sentence which results refer to is retired and replaced with a new one, so
+		those results still show the sentence they were given.
+
+		Args:
+			session: The session the sentence belongs to.
+			record: The sentence to change.
+			sentence: The new text.
+
+		Returns:
+			Sentences: The changed or new sentence.
+		"""
+		if Sentences.inResults(session, record.id):
+			Sentences.retireSentence(session, record)
+			record = Sentences(sentence=sentence)
+			session.add(record)
+			session.flush()
+		else:
+			record.sentence = sentence
+		SentenceFeatures.indexSentences(session, [record])
+		return record
 
 
 class Results(Base):
 	"""Represents the results database table."""
 
 	__tablename__ = "results"
+	# A station never starts two tests for one user at the same moment, so this
+	# identifies a result across merged databases.
+	__table_args__ = (
+		Index("ix_results_station_user_start", "station", "user_name", "start_time", unique=True),
+		# Reads a user's results in order without going through anyone else's.
+		Index("ix_results_user_start", "user_name", "start_time"),
+		)
 
 	id = Column(Integer, primary_key=True)
+	station = Column(String)
 	user_name = Column(String)
 	start_time = Column(DateTime)
 	end_time = Column(DateTime)
@@ -105,8 +372,19 @@ class Results(Base):
 	speed = Column(Integer)
 	words = Column(Integer)
 	timestamp = Column(String)
-	given_text = Column(String)
-	typed_text = Column(String)
+	# When the result was copied to a collector by a SyncClient.
+	synced = Column(DateTime, index=True)
+	# The ids of the given sentences and the compressed typed text.
+	given_ids = Column(String)
+	typed_data = Column(LargeBinary)
+	# Text kept by older versions, until compactResults moves it.
+	stored_given_text = Column("given_text", String)
+	stored_typed_text = Column("typed_text", String)
+	sentence_results = relationship(
+		"SentenceResults",
+		cascade="all, delete-orphan",
+		order_by="SentenceResults.position",
+		)
 
 	def __repr__(self) -> str:
 		return f"{self.__class__.__name__}(id={repr(self.id)})"
@@ -128,6 +406,1555 @@ Typed text:
 """
 		return results_string
 
+	@property
+	def given_text(self) -> str:
+		"""The sentences the user was given, one to a line."""
+		if self.stored_given_text is not None:
+			return self.stored_given_text
+		ids = decodeIds(self.given_ids)
+		texts = Sentences.sentenceTexts(ids, object_session(self))
+		return "\n".join(texts.get(id, "") for id in ids)
+
+	@given_text.setter
+	def given_text(self, text: str) -> None:
+		self.stored_given_text = text
+		self.given_ids = None
+
+	def setGivenSentences(self, ids: list) -> None:
+		"""Keeps the given text as the ids of the sentences it is made of."""
+		self.given_ids = encodeIds(ids)
+		self.stored_given_text = None
+
+	@property
+	def typed_text(self) -> str:
+		"""What the user typed for each sentence, one to a line."""
+		if self.stored_typed_text is not None:
+			return self.stored_typed_text
+		return decompressText(self.typed_data)
+
+	@typed_text.setter
+	def typed_text(self, text: str) -> None:
+		self.typed_data = compressText(text or "")
+		self.stored_typed_text = None
+
+	def resultsDict(self) -> dict:
+		"""Returns the result as a results dictionary like a TypingSession makes."""
+		typed_lines = self.typed_text.split("\n")
+		results_dict = {
+			name: getattr(self, name)
+			for name in (
+				"station",
+				"user_name",
+				"start_time",
+				"end_time",
+				"duration",
+				"accuracy",
+				"edit_distance",
+				"speed",
+				"words",
+				"timestamp",
+				)
+			}
+		results_dict["given_text"] = self.given_text
+		results_dict["typed_text"] = self.typed_text
+		results_dict["sentences"] = [
+			{
+				"position": sentence.position,
+				"sentence_id": sentence.sentence_id,
+				"typed_text": typed_lines[sentence.position]
+					if 0 <= sentence.position < len(typed_lines) else "",
+				"edit_distance": sentence.edit_distance,
+				"characters": sentence.characters,
+				"seconds": sentence.seconds,
+				}
+			for sentence in self.sentence_results
+			]
+		return results_dict
+
+	def unsyncedResults(limit: int) -> list:
+		"""Get the oldest results which have not been copied to a collector.
+
+		Args:
+			limit: The most results to get.
+
+		Returns:
+			list: (id, results dictionary) tuples.
+		"""
+		with session_scope() as session:
+			return [
+				(record.id, record.resultsDict())
+				for record in session.query(Results).options(
+					selectinload(Results.sentence_results),
+					).filter(Results.synced.is_(None)).order_by(Results.id).limit(limit)
+				]
+
+	def markSynced(ids: list) -> None:
+		"""Records that results have been copied to a collector."""
+		with session_scope() as session:
+			session.execute(
+				update(Results).where(Results.id.in_(ids)).values(synced=datetime.datetime.now())
+				)
+
+	def addResults(session: Session, results_dict: dict) -> "Results":
+		"""Adds a results dictionary to a session.
+
+		Args:
+			session: The session to add the results to.
+			results_dict: Results as calculated by a TypingSession.
+
+		Returns:
+			Results: The new record.
+		"""
+		results_dict = dict(results_dict)
+		sentences = results_dict.pop("sentences", [])
+		given_text = results_dict.get("given_text") or ""
+		typed_text = results_dict.get("typed_text") or ""
+		results = Results(**results_dict)
+		ids = [sentence.get("sentence_id") for sentence in sentences]
+		if ids and None not in ids and len(ids) == len(given_text.split("\n")):
+			results.setGivenSentences(ids)
+		results.sentence_results = [
+			SentenceResults.fromSentence(sentence) for sentence in sentences
+			]
+		session.add(results)
+		SentenceStatistics.addAttempts(session, results.sentence_results)
+		MetricBins.addValues(session, [(results.accuracy, results.speed, results.start_time)])
+		UserBests.addValues(session, [(results.user_name, results.accuracy, results.speed)])
+		UserWeaknesses.addTexts(session, results.user_name, given_text, typed_text)
+		CharacterConfusions.addTexts(session, results.user_name, given_text, typed_text)
+		return results
+
+	def removeResults(session: Session, results: "Results") -> None:
+		"""Deletes a result and takes it out of the statistics.
+
+		Args:
+			session: The session the result belongs to.
+			results: The result to delete.
+		"""
+		SentenceStatistics.addAttempts(session, results.sentence_results, sign=-1)
+		MetricBins.addValues(
+			session,
+			[(results.accuracy, results.speed, results.start_time)],
+			sign=-1,
+			)
+		given_text = results.given_text
+		typed_text = results.typed_text
+		UserWeaknesses.addTexts(session, results.user_name, given_text, typed_text, sign=-1)
+		CharacterConfusions.addTexts(session, results.user_name, given_text, typed_text, sign=-1)
+		session.delete(results)
+		session.flush()
+		UserBests.refresh(session, [results.user_name])
+
+	def storeResults(results_dicts: list) -> list:
+		"""Stores several results dictionaries in one transaction.
+
+		A result from a station which is already stored is not stored again, so
+		storing the same results twice is harmless.
+
+		Args:
+			results_dicts: Results as calculated by a TypingSession.
+
+		Returns:
+			list: The ids of the new or already stored records.
+		"""
+		with session_scope() as session:
+			keys = [
+				(results_dict.get("station"), results_dict.get("user_name"), results_dict.get("start_time"))
+				for results_dict in results_dicts
+				]
+			stored = Results.storedKeys(session, [key for key in keys if key[0] is not None])
+			records = []
+			for key, results_dict in zip(keys, results_dicts):
+				record = stored.get(key) if key[0] is not None else None
+				if record is None:
+					record = Results.addResults(session, results_dict)
+					if key[0] is not None:
+						stored[key] = record
+				records.append(record)
+			session.flush()
+			return [record if isinstance(record, int) else record.id for record in records]
+
+	def storedKeys(session: Session, keys: list) -> dict:
+		"""Finds which of a list of results are already stored.
+
+		Args:
+			session: The session to look in.
+			keys: (station, user_name, start_time) tuples.
+
+		Returns:
+			dict: The ids of the stored results keyed by their tuple.
+		"""
+		stored = {}
+		key_columns = tuple_(Results.station, Results.user_name, Results.start_time)
+		for start in range(0, len(keys), 300):
+			batch = keys[start:start + 300]
+			for id, station, user_name, start_time in session.query(
+				Results.id,
+				Results.station,
+				Results.user_name,
+				Results.start_time,
+				).filter(key_columns.in_(batch)):
+				stored[(station, user_name, start_time)] = id
+		return stored
+
+	def compactResults(batch_size: int = 500) -> int:
+		"""Moves the text of results stored by older versions to the compact form.
+
+		Given text becomes sentence ids, adding a retired sentence for any line
+		which is no longer among the sentences, and typed text is compressed. Each
+		batch is committed on its own, so the work can be stopped and started
+		again.
+
+		Args:
+			batch_size: How many results to change in each transaction.
+
+		Returns:
+			int: The count of results changed.
+		"""
+		count = 0
+		with session_scope() as session:
+			# Later rows win, so where the same text appears twice the sentence still
+			# in use is preferred.
+			sentence_ids = {
+				sentence: id
+				for id, sentence in session.query(Sentences.id, Sentences.sentence).order_by(
+					Sentences.retired.is_(True).desc(),
+					Sentences.id,
+					)
+				}
+		while True:
+			with session_scope() as session:
+				batch = session.query(Results).filter(
+					(Results.stored_given_text.isnot(None))
+					| (Results.stored_typed_text.isnot(None))
+					).limit(batch_size).all()
+				for results in batch:
+					if results.stored_typed_text is not None:
+						results.typed_text = results.stored_typed_text
+					if results.stored_given_text is not None:
+						ids = []
+						for line in results.stored_given_text.split("\n"):
+							if line not in sentence_ids:
+								record = Sentences(sentence=line, retired=True)
+								session.add(record)
+								session.flush()
+								sentence_ids[line] = record.id
+							ids.append(sentence_ids[line])
+						results.setGivenSentences(ids)
+			if not batch:
+				return count
+			count += len(batch)
+			logging.debug("Compacted %d results.", count)
+
+	@cachedQuery("results")
+	def listResults(since: datetime.datetime = None, until: datetime.datetime = None) -> list:
+		"""Get the columns shown in the results list for every result.
+
+		Only the listed columns are read, which avoids loading the given and typed
+		text of every result. Without since only the current database is read;
+		with it any archives covering the range are read as well.
+
+		Args:
+			since: Leave out results started before this.
+			until: Leave out results started at or after this.
+
+		Returns:
+			list: Rows of id, accuracy, speed, duration, words, user_name and
+			timestamp.
+		"""
+		with session_scope() as session:
+			if since is None and until is None:
+				return session.query(
+					Results.id,
+					Results.accuracy,
+					Results.speed,
+					Results.duration,
+					Results.words,
+					Results.user_name,
+					Results.timestamp,
+					).order_by(Results.id).all()
+			rows = union_all(*[
+				select(
+					table.c.id,
+					table.c.accuracy,
+					table.c.speed,
+					table.c.duration,
+					table.c.words,
+					table.c.user_name,
+					table.c.timestamp,
+					table.c.start_time,
+					).where(*_startedBetween(table, since, until))
+				for table in _resultsTables(session, since, until)
+				]).subquery()
+			return session.execute(
+				select(
+					rows.c.id,
+					rows.c.accuracy,
+					rows.c.speed,
+					rows.c.duration,
+					rows.c.words,
+					rows.c.user_name,
+					rows.c.timestamp,
+					).order_by(rows.c.start_time, rows.c.id)
+				).all()
+
+	@cachedQuery("results")
+	def userNames() -> list:
+		"""Get the name of every user with results, in alphabetical order."""
+		with session_scope() as session:
+			return [
+				user_name
+				for user_name, in session.query(Results.user_name).distinct().order_by(Results.user_name)
+				]
+
+	@cachedQuery("results")
+	def userStatistics(
+		user_name: str,
+		since: datetime.datetime = None,
+		until: datetime.datetime = None,
+		) -> tuple:
+		"""Get the statistics shown for a user on the UsersPanel.
+
+		Args:
+			user_name: The user to get statistics for.
+			since: Leave out results started before this, reading any archives
+				covering the range.
+			until: Leave out results started at or after this.
+
+		Returns:
+			tuple: The count of tests, average accuracy and average speed.
+		"""
+		with session_scope() as session:
+			if since is None and until is None:
+				return session.query(
+					func.count(Results.id),
+					func.avg(Results.accuracy),
+					func.avg(Results.speed),
+					).filter(Results.user_name == user_name).one()
+			rows = union_all(*[
+				select(table.c.accuracy, table.c.speed).where(
+					table.c.user_name == user_name,
+					*_startedBetween(table, since, until),
+					)
+				for table in _resultsTables(session, since, until)
+				]).subquery()
+			return session.execute(
+				select(func.count(), func.avg(rows.c.accuracy), func.avg(rows.c.speed))
+				).one()
+
+	@cachedQuery("results")
+	@timed("Results.allUserStatistics")
+	def allUserStatistics(
+		since: datetime.datetime = None,
+		until: datetime.datetime = None,
+		) -> list:
+		"""Get the statistics of every user in one query.
+
+		Each user's results are ranked by accuracy and by speed with window
+		functions, so the medians are found in the same pass as the other
+		statistics.
+
+		Args:
+			since: Leave out results started before this, reading any archives
+				covering the range.
+			until: Leave out results started at or after this.
+
+		Returns:
+			list: Rows of user_name, tests, mean_accuracy, median_accuracy,
+			best_accuracy, mean_speed, median_speed, best_speed and last_test, in
+			order of user name.
+		"""
+		with session_scope() as session:
+			if since is None and until is None:
+				tables = [Results.__table__]
+			else:
+				tables = _resultsTables(session, since, until)
+			rows = union_all(*[
+				select(
+					table.c.user_name,
+					table.c.accuracy,
+					table.c.speed,
+					table.c.start_time,
+					).where(*_startedBetween(table, since, until))
+				for table in tables
+				]).subquery()
+			by_user = {"partition_by": rows.c.user_name}
+			ranked = select(
+				rows.c.user_name,
+				rows.c.accuracy,
+				rows.c.speed,
+				rows.c.start_time,
+				func.count().over(**by_user).label("tests"),
+				func.row_number().over(order_by=rows.c.accuracy, **by_user).label("accuracy_rank"),
+				func.row_number().over(order_by=rows.c.speed, **by_user).label("speed_rank"),
+				).subquery()
+			# The middle rank, or the two middle ranks when there is an even number.
+			middle = ((ranked.c.tests + 1) // 2, (ranked.c.tests + 2) // 2)
+			return session.execute(
+				select(
+					ranked.c.user_name,
+					func.count().label("tests"),
+					func.avg(ranked.c.accuracy).label("mean_accuracy"),
+					func.avg(
+						case((ranked.c.accuracy_rank.in_(middle), ranked.c.accuracy))
+						).label("median_accuracy"),
+					func.max(ranked.c.accuracy).label("best_accuracy"),
+					func.avg(ranked.c.speed).label("mean_speed"),
+					func.avg(
+						case((ranked.c.speed_rank.in_(middle), ranked.c.speed))
+						).label("median_speed"),
+					func.max(ranked.c.speed).label("best_speed"),
+					func.max(ranked.c.start_time).label("last_test"),
+					).group_by(ranked.c.user_name).order_by(ranked.c.user_name)
+				).all()
+
+	@cachedQuery("results")
+	@timed("Results.userTrend")
+	def userTrend(
+		user_name: str,
+		window: int = 10,
+		since: datetime.datetime = None,
+		until: datetime.datetime = None,
+		) -> list:
+		"""Get a user's results in order with rolling averages of speed and accuracy.
+
+		The averages are worked out by SQLite's window functions as the results are
+		read, however many results the user has.
+
+		Args:
+			user_name: The user to get the results of.
+			window: How many tests each average covers, ending with the test itself.
+			since: Leave out results started before this, reading any archives
+				covering the range.
+			until: Leave out results started at or after this.
+
+		Returns:
+			list: Rows of id, start_time, speed, accuracy, rolling_speed and
+			rolling_accuracy, oldest first.
+		"""
+		with session_scope() as session:
+			rows = Results._userRows(session, user_name, since, until)
+			frame = {"order_by": (rows.c.start_time, rows.c.id), "rows": (-(window - 1), 0)}
+			return session.execute(
+				select(
+					rows.c.id,
+					rows.c.start_time,
+					rows.c.speed,
+					rows.c.accuracy,
+					func.avg(rows.c.speed).over(**frame).label("rolling_speed"),
+					func.avg(rows.c.accuracy).over(**frame).label("rolling_accuracy"),
+					).order_by(rows.c.start_time, rows.c.id)
+				).all()
+
+	@cachedQuery("results")
+	@timed("Results.userWeeks")
+	def userWeeks(
+		user_name: str,
+		since: datetime.datetime = None,
+		until: datetime.datetime = None,
+		) -> list:
+		"""Get a user's progress week by week.
+
+		Args:
+			user_name: The user to get the progress of.
+			since: Leave out results started before this, reading any archives
+				covering the range.
+			until: Leave out results started at or after this.
+
+		Returns:
+			list: Rows of week, the Monday it starts on as text, and its tests,
+			mean_speed, mean_accuracy and best_speed, oldest first.
+		"""
+		with session_scope() as session:
+			rows = Results._userRows(session, user_name, since, until)
+			week = func.date(rows.c.start_time, "-6 days", "weekday 1").label("week")
+			return session.execute(
+				select(
+					week,
+					func.count().label("tests"),
+					func.avg(rows.c.speed).label("mean_speed"),
+					func.avg(rows.c.accuracy).label("mean_accuracy"),
+					func.max(rows.c.speed).label("best_speed"),
+					).where(rows.c.start_time.isnot(None)).group_by(week).order_by(week)
+				).all()
+
+	def _userRows(
+		session: Session,
+		user_name: str,
+		since: datetime.datetime,
+		until: datetime.datetime,
+		):
+		"""Returns a subquery of a user's results from every table covering a range."""
+		if since is None and until is None:
+			tables = [Results.__table__]
+		else:
+			tables = _resultsTables(session, since, until)
+		return union_all(*[
+			select(table.c.id, table.c.start_time, table.c.speed, table.c.accuracy).where(
+				table.c.user_name == user_name,
+				*_startedBetween(table, since, until),
+				)
+			for table in tables
+			]).subquery()
+
+	def leaders(metric: str, limit: int = 10, year: int = None) -> list:
+		"""Get the users with the best accuracy or speed.
+
+		Without a year the leaders are read from UserBests.
+
+		Args:
+			metric: "accuracy" or "speed".
+			limit: The most users to list.
+			year: Only count results started in this year, reading its archive.
+
+		Returns:
+			list: (user_name, best value) tuples, best first.
+		"""
+		if year is None:
+			return UserBests.leaders(metric, limit)
+		return Results._yearLeaders(metric, limit, year)
+
+	@cachedQuery("results")
+	def _yearLeaders(metric: str, limit: int, year: int) -> list:
+		"""Get the leaders of a year from its results, which may be archived."""
+		since, until = datetime.datetime(year, 1, 1), datetime.datetime(year + 1, 1, 1)
+		field = f"best_{metric}"
+		rows = [
+			(row.user_name, getattr(row, field))
+			for row in Results.allUserStatistics(since, until)
+			if getattr(row, field) is not None
+			]
+		rows.sort(key=lambda row: row[1], reverse=True)
+		return rows[:limit]
+
+
+class SentenceResults(Base):
+	"""The outcome of typing one sentence as part of a test."""
+
+	__tablename__ = "sentence_results"
+
+	id = Column(Integer, primary_key=True)
+	result_id = Column(Integer, ForeignKey("results.id"), index=True)
+	position = Column(Integer)
+	sentence_id = Column(Integer, ForeignKey("sentences.id"), index=True)
+	typed_words = Column(Integer)
+	edit_distance = Column(Integer)
+	characters = Column(Integer)
+	seconds = Column(Float)
+
+	def __repr__(self) -> str:
+		return (
+			f"{self.__class__.__name__}(result_id={repr(self.result_id)}, "
+			f"position={repr(self.position)})"
+			)
+
+	def fromSentence(sentence: dict) -> "SentenceResults":
+		"""Makes a record from one of the sentences of a results dictionary.
+
+		The typed text itself is kept with the result, so only its word count is
+		kept here.
+		"""
+		sentence = dict(sentence)
+		typed_text = sentence.pop("typed_text", "") or ""
+		return SentenceResults(typed_words=len(typed_text.split()), **sentence)
+
+	@property
+	def error_rate(self) -> float:
+		"""The share of the sentence's characters which were typed wrong."""
+		return self.edit_distance / self.characters if self.characters else 0.0
+
+	@property
+	def wpm(self) -> float:
+		"""How fast this sentence was typed in words per minute."""
+		if not self.seconds:
+			return 0.0
+		return (self.typed_words or 0) / (self.seconds / 60)
+
+
+class SentenceStatistics(Base):
+	"""How every sentence has fared across all tests.
+
+	Totals are kept up to date as results are stored and removed, so the means
+	can be read without going through old results.
+	"""
+
+	__tablename__ = "sentence_statistics"
+
+	sentence_id = Column(Integer, ForeignKey("sentences.id"), primary_key=True)
+	attempts = Column(Integer, default=0)
+	error_rate_total = Column(Float, default=0.0)
+	wpm_total = Column(Float, default=0.0)
+	mean_error_rate = Column(Float, index=True)
+	mean_wpm = Column(Float, index=True)
+
+	def __repr__(self) -> str:
+		return f"{self.__class__.__name__}(sentence_id={repr(self.sentence_id)})"
+
+	def addAttempts(session: Session, sentence_results: list, sign: int = 1) -> None:
+		"""Adds attempts at sentences to their statistics.
+
+		All the sentences are updated with one batch of upserts, so there is no need
+		to read the statistics first.
+
+		Args:
+			session: The session to make the changes in.
+			sentence_results: SentenceResults records to add.
+			sign: 1 to add the attempts or -1 to take them away again.
+		"""
+		table = SentenceStatistics.__table__
+		attempts = [
+			{
+				"sentence_id": sentence.sentence_id,
+				"attempts": sign,
+				"error_rate_total": sign * sentence.error_rate,
+				"wpm_total": sign * sentence.wpm,
+				"mean_error_rate": sentence.error_rate,
+				"mean_wpm": sentence.wpm,
+				}
+			for sentence in sentence_results
+			if sentence.sentence_id is not None
+			]
+		if not attempts:
+			return
+		statement = insert(table)
+		excluded = statement.excluded
+		total_attempts = table.c.attempts + excluded.attempts
+		error_rate_total = table.c.error_rate_total + excluded.error_rate_total
+		wpm_total = table.c.wpm_total + excluded.wpm_total
+		session.execute(
+			statement.on_conflict_do_update(
+				index_elements=[table.c.sentence_id],
+				set_={
+					"attempts": total_attempts,
+					"error_rate_total": error_rate_total,
+					"wpm_total": wpm_total,
+					"mean_error_rate": error_rate_total / func.nullif(total_attempts, 0),
+					"mean_wpm": wpm_total / func.nullif(total_attempts, 0),
+					},
+				),
+			attempts,
+			)
+
+	def hardestSentences(limit: int = 20, minimum_attempts: int = 1) -> list:
+		"""Get the sentences which are typed wrong most often.
+
+		Args:
+			limit: The most sentences to return.
+			minimum_attempts: Leave out sentences attempted fewer times than this.
+
+		Returns:
+			list: Rows of sentence id, sentence, attempts, mean error rate and mean
+			words per minute, hardest first.
+		"""
+		with session_scope() as session:
+			return session.query(
+				Sentences.id,
+				Sentences.sentence,
+				SentenceStatistics.attempts,
+				SentenceStatistics.mean_error_rate,
+				SentenceStatistics.mean_wpm,
+				).join(
+					SentenceStatistics,
+					SentenceStatistics.sentence_id == Sentences.id,
+				).filter(
+					SentenceStatistics.attempts >= minimum_attempts
+				).order_by(
+					SentenceStatistics.mean_error_rate.desc()
+				).limit(limit).all()
+
+
+class SentenceFeatures(Base):
+	"""The features of each sentence, worked out when the sentence is added.
+
+	Bigrams are kept as one string made by features.sentenceBigrams. Levels split
+	the sentences into groups of about the same size from easiest to hardest.
+	"""
+
+	__tablename__ = "sentence_features"
+
+	sentence_id = Column(Integer, ForeignKey("sentences.id"), primary_key=True)
+	length = Column(Integer)
+	words = Column(Integer, index=True)
+	punctuation = Column(Float)
+	capitals = Column(Float)
+	digits = Column(Float)
+	bigrams = Column(String)
+	difficulty = Column(Float)
+	level = Column(Integer, index=True)
+
+	def __repr__(self) -> str:
+		return f"{self.__class__.__name__}(sentence_id={repr(self.sentence_id)})"
+
+	def indexSentences(session: Session, records: list = None) -> int:
+		"""Works out the features of sentences and then levels every sentence again.
+
+		Args:
+			session: The session to make the changes in.
+			records: Flushed Sentences records which are new or have changed. Defaults
+				to every sentence which has no features yet.
+
+		Returns:
+			int: The count of sentences whose features were worked out.
+		"""
+		if records is None:
+			records = session.query(Sentences).outerjoin(
+				SentenceFeatures,
+				SentenceFeatures.sentence_id == Sentences.id,
+				).filter(
+					SentenceFeatures.sentence_id.is_(None),
+					Sentences.retired.isnot(True),
+				).all()
+		if not records:
+			return 0
+		table = SentenceFeatures.__table__
+		rows = []
+		for record in records:
+			features = sentenceFeatures(record.sentence)._asdict()
+			features["sentence_id"] = record.id
+			features["level"] = 0
+			rows.append(features)
+		statement = insert(table)
+		session.execute(
+			statement.on_conflict_do_update(
+				index_elements=[table.c.sentence_id],
+				set_={
+					name: statement.excluded[name]
+					for name in rows[0]
+					if name != "sentence_id"
+					},
+				),
+			rows,
+			)
+		SentenceFeatures.assignLevels(session)
+		return len(rows)
+
+	def assignLevels(session: Session) -> None:
+		"""Shares the sentences out between difficulty levels by their difficulty."""
+		rows = session.query(
+			SentenceFeatures.sentence_id,
+			SentenceFeatures.difficulty,
+			SentenceFeatures.level,
+			).all()
+		levels = difficultyLevels([row.difficulty for row in rows])
+		changed = [
+			{"id": row.sentence_id, "new_level": level}
+			for row, level in zip(rows, levels)
+			if row.level != level
+			]
+		if changed:
+			table = SentenceFeatures.__table__
+			session.execute(
+				table.update().where(
+					table.c.sentence_id == bindparam("id")
+					).values(level=bindparam("new_level")),
+				changed,
+				)
+
+	@timed("SentenceFeatures.loadIndex")
+	def loadIndex(chooser=None) -> SentenceIndex:
+		"""Loads every indexed sentence so that sentences can be drawn in memory.
+
+		Args:
+			chooser: The random.Random to draw with.
+
+		Returns:
+			SentenceIndex: The sentences grouped by difficulty level.
+		"""
+		with session_scope() as session:
+			rows = session.query(
+				Sentences.id,
+				Sentences.sentence,
+				SentenceFeatures.words,
+				SentenceFeatures.level,
+				SentenceFeatures.bigrams,
+				).join(
+					SentenceFeatures,
+					SentenceFeatures.sentence_id == Sentences.id,
+				).filter(Sentences.retired.isnot(True)).all()
+			return SentenceIndex((IndexedSentence(*row) for row in rows), chooser)
+
+
+class UserWeaknesses(Base):
+	"""How often each user has typed each character and bigram wrong."""
+
+	__tablename__ = "user_weaknesses"
+
+	user_name = Column(String, primary_key=True)
+	key = Column(String, primary_key=True)
+	attempts = Column(Integer, default=0)
+	errors = Column(Integer, default=0)
+
+	def __repr__(self) -> str:
+		return (
+			f"{self.__class__.__name__}(user_name={repr(self.user_name)}, "
+			f"key={repr(self.key)})"
+			)
+
+	def addTexts(
+		session: Session,
+		user_name: str,
+		given_text: str,
+		typed_text: str,
+		sign: int = 1,
+		) -> None:
+		"""Adds the characters and bigrams of a result to its user's counts.
+
+		Args:
+			session: The session to make the changes in.
+			user_name: The user who took the test.
+			given_text: The given sentences, one to a line.
+			typed_text: What was typed for each sentence, one to a line.
+			sign: 1 to add the result or -1 to take it away again.
+		"""
+		counts = UserWeaknesses.textCounts(given_text, typed_text)
+		UserWeaknesses.addCounts(session, user_name, counts, sign)
+
+	def textCounts(given_text: str, typed_text: str) -> dict:
+		"""Counts the attempts at and errors in every character and bigram of a result."""
+		counts = {}
+		for given, typed in zip((given_text or "").split("\n"), (typed_text or "").split("\n")):
+			if given:
+				mergeCounts(counts, errorCounts(given, typed))
+		return counts
+
+	def addCounts(session: Session, user_name: str, counts: dict, sign: int = 1) -> None:
+		"""Adds counts made by errorCounts to a user's counts.
+
+		A loaded WeaknessProfile for the user is updated as well once the session
+		is committed.
+
+		Args:
+			session: The session to make the changes in.
+			user_name: The user the counts belong to.
+			counts: [attempts, errors] keyed by character or bigram.
+			sign: 1 to add the counts or -1 to take them away again.
+		"""
+		if not counts:
+			return
+		with _profiles_lock:
+			_profile_writes[user_name] = _profile_writes.get(user_name, 0) + 1
+		session.info.setdefault("profile_writes", []).append(user_name)
+		table = UserWeaknesses.__table__
+		statement = insert(table)
+		excluded = statement.excluded
+		session.execute(
+			statement.on_conflict_do_update(
+				index_elements=[table.c.user_name, table.c.key],
+				set_={
+					"attempts": table.c.attempts + excluded.attempts,
+					"errors": table.c.errors + excluded.errors,
+					},
+				),
+			[
+				{
+					"user_name": user_name,
+					"key": key,
+					"attempts": sign * attempts,
+					"errors": sign * errors,
+					}
+				for key, (attempts, errors) in counts.items()
+				],
+			)
+
+		def updateProfile():
+			with _profiles_lock:
+				_profile_changes[user_name] = _profile_changes.get(user_name, 0) + 1
+				profile = _profiles.get(user_name)
+				if profile is not None:
+					profile.add(counts, sign)
+
+		afterCommit(session, updateProfile)
+
+	@timed("UserWeaknesses.profile")
+	def profile(user_name: str) -> WeaknessProfile:
+		"""Get the weaknesses of a user, loading them only the first time.
+
+		Args:
+			user_name: The user to get the weaknesses of.
+
+		Returns:
+			WeaknessProfile: The profile, which stays up to date as results are stored.
+		"""
+		with _profiles_lock:
+			found = _profiles.get(user_name)
+			if found is not None:
+				return found
+			writing = _profile_writes.get(user_name, 0)
+			changes = _profile_changes.get(user_name, 0)
+		with session_scope() as session:
+			rows = session.query(
+				UserWeaknesses.key,
+				UserWeaknesses.attempts,
+				UserWeaknesses.errors,
+				).filter(UserWeaknesses.user_name == user_name).all()
+		profile = WeaknessProfile({key: [attempts, errors] for key, attempts, errors in rows})
+		with _profiles_lock:
+			# A change made while the counts were read may or may not be in them, so
+			# the profile is only kept, and kept up to date, if there was none.
+			if (
+				not writing
+				and not _profile_writes.get(user_name, 0)
+				and _profile_changes.get(user_name, 0) == changes
+				):
+				return _profiles.setdefault(user_name, profile)
+			return _profiles.get(user_name, profile)
+
+
+class CharacterConfusions(Base):
+	"""How often each user has typed each character where another was expected."""
+
+	__tablename__ = "character_confusions"
+
+	user_name = Column(String, primary_key=True)
+	expected = Column(String, primary_key=True)
+	typed = Column(String, primary_key=True)
+	count = Column(Integer, default=0)
+
+	def __repr__(self) -> str:
+		return (
+			f"{self.__class__.__name__}(user_name={repr(self.user_name)}, "
+			f"expected={repr(self.expected)}, typed={repr(self.typed)})"
+			)
+
+	def addTexts(
+		session: Session,
+		user_name: str,
+		given_text: str,
+		typed_text: str,
+		sign: int = 1,
+		) -> None:
+		"""Adds the character pairs of a result to its user's counts.
+
+		Args:
+			session: The session to make the changes in.
+			user_name: The user who took the test.
+			given_text: The given sentences, one to a line.
+			typed_text: What was typed for each sentence, one to a line.
+			sign: 1 to add the result or -1 to take it away again.
+		"""
+		counts = textConfusions(given_text, typed_text)
+		CharacterConfusions.addCounts(session, user_name, counts, sign)
+
+	def addCounts(session: Session, user_name: str, counts: dict, sign: int = 1) -> None:
+		"""Adds counts made by confusionCounts to a user's counts with one batch of upserts.
+
+		Args:
+			session: The session to make the changes in.
+			user_name: The user the counts belong to.
+			counts: Counts keyed by (expected, typed) character.
+			sign: 1 to add the counts or -1 to take them away again.
+		"""
+		if not counts:
+			return
+		table = CharacterConfusions.__table__
+		statement = insert(table)
+		session.execute(
+			statement.on_conflict_do_update(
+				index_elements=[table.c.user_name, table.c.expected, table.c.typed],
+				set_={"count": table.c.count + statement.excluded.count},
+				),
+			[
+				{"user_name": user_name, "expected": expected, "typed": typed, "count": sign * count}
+				for (expected, typed), count in counts.items()
+				],
+			)
+
+	def rebuild(session: Session, batch_size: int = 1000) -> int:
+		"""Lines up every stored result again, replacing the counts.
+
+		Results are read a batch at a time and only the text columns are read, so
+		this works on databases of any size. Each user's counts are gathered in
+		memory and written once at the end.
+
+		Args:
+			session: The session to make the changes in.
+			batch_size: How many results to read at a time.
+
+		Returns:
+			int: How many results were lined up.
+		"""
+		texts = dict(session.query(Sentences.id, Sentences.sentence))
+		user_counts = {}
+		counted = 0
+		for rows in session.execute(
+			select(
+				Results.user_name,
+				Results.given_ids,
+				Results.stored_given_text,
+				Results.typed_data,
+				Results.stored_typed_text,
+				).execution_options(yield_per=batch_size)
+			).partitions():
+			for user_name, given_ids, given_text, typed_data, typed_text in rows:
+				if given_text is None:
+					given_text = "\n".join(texts.get(id, "") for id in decodeIds(given_ids))
+				if typed_text is None:
+					typed_text = decompressText(typed_data)
+				mergeConfusions(
+					user_counts.setdefault(user_name, {}),
+					textConfusions(given_text, typed_text),
+					)
+			counted += len(rows)
+			logging.debug("Lined up %d results.", counted)
+		session.execute(CharacterConfusions.__table__.delete())
+		for user_name, counts in user_counts.items():
+			CharacterConfusions.addCounts(session, user_name, counts)
+		return counted
+
+	@cachedQuery("character_confusions")
+	@timed("CharacterConfusions.matrix")
+	def matrix(user_name: str = None) -> ConfusionMatrix:
+		"""Get the confusion matrix of a user, or of everyone.
+
+		Args:
+			user_name: The user, or None to add up every user's counts.
+
+		Returns:
+			ConfusionMatrix: The counts, which are shared and must not be changed.
+		"""
+		with session_scope() as session:
+			if user_name is None:
+				rows = session.query(
+					CharacterConfusions.expected,
+					CharacterConfusions.typed,
+					func.sum(CharacterConfusions.count),
+					).group_by(CharacterConfusions.expected, CharacterConfusions.typed)
+			else:
+				rows = session.query(
+					CharacterConfusions.expected,
+					CharacterConfusions.typed,
+					CharacterConfusions.count,
+					).filter(CharacterConfusions.user_name == user_name)
+			return ConfusionMatrix({(expected, typed): count for expected, typed, count in rows})
+
+
+class MetricBins(Base):
+	"""How many results fall in each bin of each metric, for percentile ranks.
+
+	Counts are kept up to date as results are stored and removed, so a result's
+	percentile rank never needs the other results to be read.
+	"""
+
+	__tablename__ = "metric_bins"
+
+	metric = Column(String, primary_key=True)
+	cohort = Column(String, primary_key=True)
+	bin = Column(Integer, primary_key=True)
+	count = Column(Integer, default=0)
+
+	def __repr__(self) -> str:
+		return (
+			f"{self.__class__.__name__}(metric={repr(self.metric)}, "
+			f"cohort={repr(self.cohort)}, bin={repr(self.bin)})"
+			)
+
+	def addValues(session: Session, values, sign: int = 1) -> None:
+		"""Counts results in the bins of their metrics with one batch of upserts.
+
+		Args:
+			session: The session to make the changes in.
+			values: (accuracy, speed, start_time) of each result.
+			sign: 1 to add the results or -1 to take them away again.
+		"""
+		counts = binCounts(values, sign)
+		if not counts:
+			return
+		table = MetricBins.__table__
+		statement = insert(table)
+		session.execute(
+			statement.on_conflict_do_update(
+				index_elements=[table.c.metric, table.c.cohort, table.c.bin],
+				set_={"count": table.c.count + statement.excluded.count},
+				),
+			[
+				{"metric": metric, "cohort": cohort, "bin": number, "count": count}
+				for (metric, cohort, number), count in counts.items()
+				],
+			)
+
+	def rebuild(session: Session) -> int:
+		"""Counts every stored result again, replacing the bins.
+
+		Returns:
+			int: How many results were counted.
+		"""
+		session.execute(MetricBins.__table__.delete())
+		counted = 0
+		for values in session.execute(
+			select(Results.accuracy, Results.speed, Results.start_time).execution_options(
+				yield_per=10000,
+				)
+			).partitions():
+			MetricBins.addValues(session, values)
+			counted += len(values)
+		return counted
+
+	@cachedQuery("metric_bins")
+	def sketch(metric: str, cohort: str = ALL_RESULTS) -> QuantileSketch:
+		"""Get how the values of a metric are spread across a cohort.
+
+		Args:
+			metric: "accuracy" or "speed".
+			cohort: ALL_RESULTS or the year results were started in.
+
+		Returns:
+			QuantileSketch: The spread, which is shared and must not be changed.
+		"""
+		with session_scope() as session:
+			counts = dict(
+				session.query(MetricBins.bin, MetricBins.count).filter(
+					MetricBins.metric == metric,
+					MetricBins.cohort == cohort,
+					)
+				)
+		return QuantileSketch(metric, counts)
+
+	def percentileRank(metric: str, value: float, cohort: str = ALL_RESULTS) -> float:
+		"""Get the percentage of results in a cohort with a lower value of a metric.
+
+		Returns:
+			float: From 0 to 100, or None if the cohort has no results.
+		"""
+		return MetricBins.sketch(metric, cohort).rank(value)
+
+
+class UserBests(Base):
+	"""Each user's best accuracy and speed, for leaderboards.
+
+	Bests are raised as results are stored and worked out again from a user's
+	own results when one is removed, so the leaders are read from an index
+	without going through every result.
+	"""
+
+	__tablename__ = "user_bests"
+	__table_args__ = (
+		Index("ix_user_bests_accuracy", "best_accuracy"),
+		Index("ix_user_bests_speed", "best_speed"),
+		)
+
+	user_name = Column(String, primary_key=True)
+	best_accuracy = Column(Integer)
+	best_speed = Column(Integer)
+
+	def __repr__(self) -> str:
+		return f"{self.__class__.__name__}(user_name={repr(self.user_name)})"
+
+	def addValues(session: Session, values) -> None:
+		"""Raises the bests of the users who took some results with one batch of upserts.
+
+		Args:
+			session: The session to make the changes in.
+			values: (user_name, accuracy, speed) of each result.
+		"""
+		bests = {}
+		for user_name, accuracy, speed in values:
+			if user_name is None:
+				continue
+			best = bests.setdefault(
+				user_name,
+				{"user_name": user_name, "best_accuracy": None, "best_speed": None},
+				)
+			for field, value in (("best_accuracy", accuracy), ("best_speed", speed)):
+				if value is not None and (best[field] is None or value > best[field]):
+					best[field] = value
+		if not bests:
+			return
+		table = UserBests.__table__
+		statement = insert(table)
+		session.execute(
+			statement.on_conflict_do_update(
+				index_elements=[table.c.user_name],
+				set_={
+					field: func.max(
+						func.coalesce(table.c[field], statement.excluded[field]),
+						func.coalesce(statement.excluded[field], table.c[field]),
+						)
+					for field in ("best_accuracy", "best_speed")
+					},
+				),
+			list(bests.values()),
+			)
+
+	def refresh(session: Session, user_names, batch_size: int = 500) -> None:
+		"""Works out the bests of some users again from the results they have left.
+
+		Removed results must already be deleted or flushed.
+
+		Args:
+			session: The session to make the changes in.
+			user_names: The users whose results were removed.
+			batch_size: The most users to work out in one statement.
+		"""
+		table = UserBests.__table__
+		user_names = sorted(user_name for user_name in set(user_names) if user_name is not None)
+		for first in range(0, len(user_names), batch_size):
+			batch = user_names[first:first + batch_size]
+			session.execute(table.delete().where(table.c.user_name.in_(batch)))
+			session.execute(
+				table.insert().from_select(
+					["user_name", "best_accuracy", "best_speed"],
+					select(Results.user_name, func.max(Results.accuracy), func.max(Results.speed))
+					.where(Results.user_name.in_(batch))
+					.group_by(Results.user_name),
+					)
+				)
+
+	def rebuild(session: Session) -> int:
+		"""Works out every user's bests again, replacing the ones kept.
+
+		Returns:
+			int: How many users have results.
+		"""
+		table = UserBests.__table__
+		session.execute(table.delete())
+		return session.execute(
+			table.insert().from_select(
+				["user_name", "best_accuracy", "best_speed"],
+				select(Results.user_name, func.max(Results.accuracy), func.max(Results.speed))
+				.where(Results.user_name.isnot(None))
+				.group_by(Results.user_name),
+				)
+			).rowcount
+
+	@cachedQuery("user_bests")
+	def leaders(metric: str, limit: int = 10) -> list:
+		"""Get the users with the best accuracy or speed.
+
+		Args:
+			metric: "accuracy" or "speed".
+			limit: The most users to list.
+
+		Returns:
+			list: (user_name, best value) tuples, best first.
+		"""
+		best = getattr(UserBests, f"best_{metric}")
+		with session_scope() as session:
+			return [
+				tuple(row)
+				for row in session.query(UserBests.user_name, best)
+				.filter(best.isnot(None))
+				.order_by(best.desc(), UserBests.user_name)
+				.limit(limit)
+				]
+
+
+def archiveFileName(year: int) -> str:
+	"""Returns the file which results from a year are archived to.
+
+	Archives sit next to the database, named after it and the year.
+	"""
+	root, extension = os.path.splitext(_db_path)
+	return f"{root}-{year}{extension}"
+
+
+def archiveYears() -> list:
+	"""Returns the years which have an archive, oldest first."""
+	root, extension = os.path.splitext(_db_path)
+	years = []
+	for path in glob.glob(f"{glob.escape(root)}-*{extension}"):
+		year = path[len(root) + 1:len(path) - len(extension)]
+		if year.isdigit():
+			years.append(int(year))
+	return sorted(years)
+
+
+def attachedTable(table, schema: str):
+	"""Returns a copy of a table which refers to it in an attached database."""
+	found = _attached_tables.get((table.name, schema))
+	if found is None:
+		found = table.to_metadata(_attached_metadata, schema=schema)
+		_attached_tables[(table.name, schema)] = found
+	return found
+
+
+def _archiveTable(table, year: int):
+	"""Returns a copy of a table which refers to it in an attached archive."""
+	return attachedTable(table, f"archive_{year}")
+
+
+def attachDatabase(session: Session, path: str, schema: str) -> str:
+	"""Attaches another database file to the connection a session is using.
+
+	Nothing is done if a database is already attached under the schema name.
+
+	Args:
+		session: The session to attach the database to.
+		path: The database file, which is created if it does not exist.
+		schema: The name the database's tables can be reached by.
+
+	Returns:
+		str: The schema name.
+	"""
+	connection = session.connection()
+	attached = {row[1] for row in connection.exec_driver_sql("PRAGMA database_list")}
+	if schema not in attached:
+		connection.exec_driver_sql(f"ATTACH DATABASE ? AS {schema}", (path,))
+	return schema
+
+
+def detachDatabase(session: Session, schema: str) -> None:
+	"""Detaches a database attached by attachDatabase, if it is attached."""
+	connection = session.connection()
+	attached = {row[1] for row in connection.exec_driver_sql("PRAGMA database_list")}
+	if schema in attached:
+		connection.exec_driver_sql(f"DETACH DATABASE {schema}")
+
+
+def attachArchive(session: Session, year: int) -> str:
+	"""Attaches the archive for a year to the connection a session is using.
+
+	Args:
+		session: The session to attach the archive to.
+		year: The year of the archive, which is created if it does not exist.
+
+	Returns:
+		str: The schema name the archive's tables can be reached by.
+	"""
+	return attachDatabase(session, archiveFileName(year), f"archive_{year}")
+
+
+def _resultsTables(session: Session, since: datetime.datetime, until: datetime.datetime) -> list:
+	"""Returns the results tables holding results started in a range.
+
+	The archives for every year in the range are attached as needed.
+	"""
+	tables = [Results.__table__]
+	for year in archiveYears():
+		if (since is None or year >= since.year) and (until is None or year <= until.year):
+			attachArchive(session, year)
+			tables.append(_archiveTable(Results.__table__, year))
+	return tables
+
+
+def _startedBetween(table, since: datetime.datetime, until: datetime.datetime) -> list:
+	"""Returns the conditions for results in a table started in a range."""
+	conditions = []
+	if since is not None:
+		conditions.append(table.c.start_time >= since)
+	if until is not None:
+		conditions.append(table.c.start_time < until)
+	return conditions
+
+
+def _removeFromCounts(session: Session, window: list, batch_size: int = 1000) -> set:
+	"""Takes the results in a window out of the counts kept from them.
+
+	This does what removeResults does for each result, reading the results a
+	batch at a time and writing each user's counts once at the end. Bests can
+	only be worked out once the results are gone, so that is left to the caller.
+
+	Returns:
+		set: The users who took the results.
+	"""
+	texts = dict(session.query(Sentences.id, Sentences.sentence))
+	user_counts = {}
+	user_confusions = {}
+	for rows in session.execute(
+		select(
+			Results.id,
+			Results.user_name,
+			Results.accuracy,
+			Results.speed,
+			Results.start_time,
+			Results.given_ids,
+			Results.stored_given_text,
+			Results.typed_data,
+			Results.stored_typed_text,
+			).where(*window).execution_options(yield_per=batch_size)
+		).partitions():
+		MetricBins.addValues(
+			session,
+			[(row.accuracy, row.speed, row.start_time) for row in rows],
+			sign=-1,
+			)
+		SentenceStatistics.addAttempts(
+			session,
+			session.query(SentenceResults).filter(
+				SentenceResults.result_id.in_([row.id for row in rows])
+				).all(),
+			sign=-1,
+			)
+		for row in rows:
+			given_text = row.stored_given_text
+			if given_text is None:
+				given_text = "\n".join(texts.get(id, "") for id in decodeIds(row.given_ids))
+			typed_text = row.stored_typed_text
+			if typed_text is None:
+				typed_text = decompressText(row.typed_data)
+			mergeCounts(
+				user_counts.setdefault(row.user_name, {}),
+				UserWeaknesses.textCounts(given_text, typed_text),
+				)
+			mergeConfusions(
+				user_confusions.setdefault(row.user_name, {}),
+				textConfusions(given_text, typed_text),
+				)
+	for user_name, counts in user_counts.items():
+		UserWeaknesses.addCounts(session, user_name, counts, sign=-1)
+	for user_name, counts in user_confusions.items():
+		CharacterConfusions.addCounts(session, user_name, counts, sign=-1)
+	return set(user_counts)
+
+
+def syncingResults() -> bool:
+	"""Returns whether this station copies its results to a collector."""
+	return bool(_config.Read("collectorUrl", defaultVal="")) and _config.ReadBool(
+		"syncResults",
+		defaultVal=False,
+		)
+
+
+def rolloverResults(cutoff: datetime.datetime, keep_unsynced: bool = None) -> dict:
+	"""Moves results started before a cutoff into archives, one for each year.
+
+	Each result's sentence results go with it and every sentence is copied, so an
+	archive can be read on its own. Each year is moved in one transaction. The
+	newest result always stays, so that its id is not used again. Moved results
+	are taken out of the metric bins, sentence statistics, weaknesses, character
+	confusions and bests, which only count the results in the database.
+
+	Args:
+		cutoff: Results started before this are moved.
+		keep_unsynced: Whether to leave results which have not been sent to the
+			collector yet, so that they still are. Defaults to whether this station
+			syncs its results.
+
+	Returns:
+		dict: The count of results moved, keyed by year.
+	"""
+	if keep_unsynced is None:
+		keep_unsynced = syncingResults()
+	# Only results which have reached the collector may leave, if it is used.
+	synced = [Results.synced.isnot(None)] if keep_unsynced else []
+	with session_scope() as session:
+		newest = session.query(func.max(Results.id)).scalar()
+		years = sorted({
+			start_time.year
+			for start_time, in session.query(Results.start_time).filter(
+				Results.start_time < cutoff,
+				Results.id < newest,
+				*synced,
+				)
+			})
+	moved = {}
+	for year in years:
+		archive_engine = create_engine(f"sqlite:///{archiveFileName(year)}")
+		Base.metadata.create_all(archive_engine)
+		_addMissingColumns(archive_engine)
+		archive_engine.dispose()
+		window = [
+			Results.start_time >= datetime.datetime(year, 1, 1),
+			Results.start_time < min(cutoff, datetime.datetime(year + 1, 1, 1)),
+			Results.id < newest,
+			*synced,
+			]
+		with session_scope() as session:
+			attachArchive(session, year)
+			ids = select(Results.id).where(*window)
+			for table, condition in (
+				(Sentences.__table__, None),
+				(Results.__table__, window),
+				(SentenceResults.__table__, [SentenceResults.result_id.in_(ids)]),
+				):
+				archive_table = _archiveTable(table, year)
+				columns = [column.name for column in table.columns]
+				query = select(*[table.c[name] for name in columns])
+				if condition is not None:
+					query = query.where(*condition)
+				insert_statement = archive_table.insert().from_select(columns, query)
+				if table is Sentences.__table__:
+					insert_statement = insert_statement.prefix_with("OR REPLACE")
+				session.execute(insert_statement)
+			user_names = _removeFromCounts(session, window)
+			session.execute(
+				SentenceResults.__table__.delete().where(SentenceResults.result_id.in_(ids))
+				)
+			moved[year] = session.execute(Results.__table__.delete().where(*window)).rowcount
+			UserBests.refresh(session, user_names)
+		logging.info("Moved %d results to %s.", moved[year], archiveFileName(year))
+	return moved
+
+
+def afterCommit(session: Session, callback) -> None:
+	"""Calls a function once a session's changes are committed.
+
+	This keeps things held in memory from running ahead of the database if the
+	transaction is rolled back. The callback must not use the session.
+	"""
+	session.info.setdefault("after_commit", []).append(callback)
+
+
+@event.listens_for(Session, "after_commit")
+def _runAfterCommit(session: Session) -> None:
+	for callback in session.info.pop("after_commit", []):
+		callback()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discardAfterCommit(session: Session) -> None:
+	session.info.pop("after_commit", None)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _endProfileWrites(session: Session, transaction) -> None:
+	# Ends on commit, rollback or close, after any after_commit callbacks.
+	if transaction.parent is not None:
+		return
+	user_names = session.info.pop("profile_writes", None)
+	if user_names:
+		with _profiles_lock:
+			for user_name in user_names:
+				_profile_writes[user_name] -= 1
+
+
+@event.listens_for(Session, "after_begin")
+def _watchConnection(session: Session, transaction, connection) -> None:
+	session.info.setdefault("connections", []).append(connection)
+
+
+@event.listens_for(Session, "after_commit")
+def _countCommit(session: Session) -> None:
+	tables = set()
+	for connection in session.info.pop("connections", []):
+		tables |= connection.info.pop("written_tables", set())
+	if tables:
+		with _query_cache_lock:
+			for table in tables:
+				if table is None:
+					# A statement whose table is not known may have changed any of them.
+					_query_cache.clear()
+				else:
+					_generations[table] = _generations.get(table, 0) + 1
+
+
+@event.listens_for(Session, "after_rollback")
+def _forgetWrites(session: Session) -> None:
+	for connection in session.info.pop("connections", []):
+		connection.info.pop("written_tables", None)
+
+
+@event.listens_for(Engine, "connect")
+def _vacuumIncrementally(dbapi_connection, connection_record) -> None:
+	# Only takes effect in a new database, which then never needs a full vacuum
+	# to give free pages back.
+	dbapi_connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _countWrites(connection, cursor, statement, parameters, context, executemany) -> None:
+	global _writes
+	if context is not None and (context.isinsert or context.isupdate or context.isdelete):
+		with _writes_lock:
+			_writes += max(cursor.rowcount, 0)
+		# Counted against the table once the session's transaction is committed.
+		table = getattr(getattr(context.compiled, "statement", None), "table", None)
+		connection.info.setdefault("written_tables", set()).add(getattr(table, "name", None))
+
+
+def writeCount() -> int:
+	"""Returns how many rows have been inserted, updated or deleted so far."""
+	return _writes
+
 
 @contextmanager
 def session_scope() -> Session:
@@ -148,6 +1975,99 @@ def session_scope() -> Session:
 		session.close()
 
 
-if __name__ == "__main__":
+def connect(path: str = None) -> Engine:
+	"""Binds all following sessions to a database file.
+
+	Any tables which are missing from the database are created.
+
+	Args:
+		path: The SQLite database file to use. Defaults to the databaseFileName
+			setting.
+
+	Returns:
+		Engine: The engine connected to the database.
+
+	Raises:
+		RuntimeError: If the SQLite library is older than SQLITE_VERSION.
+	"""
+	global _db_path, _engine
+	if sqlite3.sqlite_version_info < SQLITE_VERSION:
+		raise RuntimeError(
+			f"SQLite {sqlite3.sqlite_version} is too old; "
+			f"version {'.'.join(map(str, SQLITE_VERSION))} or newer is needed."
+			)
+	if path is not None:
+		_db_path = path
+	_engine.dispose()
+	# Several stations may write to the same file, so wait for locks to clear
+	# rather than failing straight away.
+	_engine = create_engine(
+		f"sqlite:///{_db_path}",
+		echo=False,
+		connect_args={"timeout": 30},
+		)
+	Session.configure(bind=_engine)
 	Base.metadata.create_all(_engine)
-	Sentence.fillSentences()
+	_addMissingColumns(_engine)
+	_fillMetricBins()
+	_fillUserBests()
+	with _profiles_lock:
+		_profiles.clear()
+	clearQueryCache()
+	return _engine
+
+
+def _addMissingColumns(engine: Engine) -> None:
+	"""Adds columns which are newer than a database's tables, with their indexes."""
+	inspector = inspect(engine)
+	with engine.begin() as connection:
+		for table in Base.metadata.sorted_tables:
+			existing = {column["name"] for column in inspector.get_columns(table.name)}
+			missing = [column for column in table.columns if column.name not in existing]
+			for column in missing:
+				logging.info("Adding %s.%s to the database.", table.name, column.name)
+				connection.exec_driver_sql(
+					f"ALTER TABLE {table.name} ADD COLUMN {column.name} "
+					f"{column.type.compile(engine.dialect)}"
+					)
+			# Indexes can be newer than their tables too.
+			existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+			for index in table.indexes:
+				if index.name not in existing_indexes:
+					index.create(connection)
+
+
+def _fillMetricBins() -> None:
+	"""Counts the results of a database which has results but no metric bins."""
+	with session_scope() as session:
+		if session.query(MetricBins.metric).first() is not None:
+			return
+		if session.query(Results.id).first() is None:
+			return
+		logging.info("Counted %d results for percentile ranks.", MetricBins.rebuild(session))
+
+
+def _fillUserBests() -> None:
+	"""Works out the bests of a database which has results but no bests."""
+	with session_scope() as session:
+		if session.query(UserBests.user_name).first() is not None:
+			return
+		if session.query(Results.id).first() is None:
+			return
+		logging.info("Found the bests of %d users for leaderboards.", UserBests.rebuild(session))
+
+
+def databasePath() -> str:
+	"""Returns the database file sessions are bound to."""
+	return _db_path
+
+
+def disconnect() -> None:
+	"""Closes every pooled connection to the current database."""
+	_engine.dispose()
+	clearQueryCache()
+
+
+if __name__ == "__main__":
+	connect()
+	Sentences.fillSentences()
@@ -14,17 +14,23 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-"""Includes the SettingsDialog, SingleResultDialog, and TypingDialog classes."""
+"""Includes the SettingsDialog, SingleResultDialog, DiagnosticsDialog, and TypingDialog classes."""
 
 import datetime
 import logging
+import socket
 import threading
 from time import sleep
 import pyttsx3
 from pkg_resources import resource_filename
 import wx
-from .lev import levenshteinDistance
-from .database import session_scope, Sentences, Results
+from .database import session_scope, MetricBins, Sentences, SentenceFeatures, Results, UserWeaknesses
+from .features import DIFFICULTY_LEVELS
+from .logs import setLevel
+from .metrics import summary, timed, timer
+from .percentiles import resultCohorts, ALL_RESULTS
+from .session import SentencePrefetcher, TypingSession
+from .weakness import AdaptiveSelector
 
 class SettingsDialog(wx.Dialog):
 	"""Settings which apply across all tests.
@@ -66,7 +72,7 @@ class SettingsDialog(wx.Dialog):
 			name="loggingLevel"
 			)
 		self.logging_choice.SetStringSelection(
-			config.Read("loggingLevel", defaultVal="info")
+			config.Read("loggingLevel", defaultVal="INFO").upper()
 			)
 		self.speech_group = wx.StaticBox(
 			self,
@@ -152,6 +158,17 @@ class SettingsDialog(wx.Dialog):
 			name="wordCount",
 			value=str(config.ReadInt("wordCount", defaultVal=10))
 			)
+		self.testing_word_count_tolerance_label = wx.StaticText(
+			self.testing_group,
+			id=wx.ID_ANY,
+			label="How many words over or under?"
+			)
+		self.testing_word_count_tolerance = wx.TextCtrl(
+			self.testing_group,
+			id=wx.ID_ANY,
+			name="wordCountTolerance",
+			value=str(config.ReadInt("wordCountTolerance", defaultVal=0))
+			)
 		# self.Bind(wx.EVT_TEXT, self.onText, self.word_count)
 		self.testing_time_limit_label = wx.StaticText(
 			self.testing_group,
@@ -167,6 +184,31 @@ class SettingsDialog(wx.Dialog):
 			)
 		self.testing_time_limit.Hide()
 		# self.Bind(wx.EVT_TEXT, self.onText, self.time_limit)
+		self.testing_difficulty_label = wx.StaticText(
+			self.testing_group,
+			id=wx.ID_ANY,
+			label="Sentence difficulty"
+			)
+		self.testing_difficulty = wx.Choice(
+			self.testing_group,
+			id=wx.ID_ANY,
+			choices=["Any"] + [
+				f"Level {level}" for level in range(1, DIFFICULTY_LEVELS + 1)
+				],
+			name="difficultyLevel"
+			)
+		self.testing_difficulty.SetSelection(
+			config.ReadInt("difficultyLevel", defaultVal=0)
+			)
+		self.testing_adaptive = wx.CheckBox(
+			self.testing_group,
+			id=wx.ID_ANY,
+			label="Practise &weak characters",
+			name="adaptiveSentences"
+			)
+		self.testing_adaptive.SetValue(
+			config.ReadBool("adaptiveSentences", defaultVal=True)
+			)
 		self.database_file = wx.FilePickerCtrl(
 			self,
 			id=wx.ID_ANY,
@@ -175,6 +217,24 @@ class SettingsDialog(wx.Dialog):
 				defaultVal=resource_filename(__name__, "data/test_results.dat"),
 				),
 			)
+		self.collector_url_label = wx.StaticText(
+			self,
+			id=wx.ID_ANY,
+			label="Collector address (leave empty to use the database file)"
+			)
+		self.collector_url = wx.TextCtrl(
+			self,
+			id=wx.ID_ANY,
+			name="collectorUrl",
+			value=config.Read("collectorUrl", defaultVal="")
+			)
+		self.sync_results = wx.CheckBox(
+			self,
+			id=wx.ID_ANY,
+			label="&Keep results on this station and copy them to the collector",
+			name="syncResults"
+			)
+		self.sync_results.SetValue(config.ReadBool("syncResults", defaultVal=False))
 		self.ok_button = wx.Button(self, wx.ID_OK, label="OK")
 		self.Bind(wx.EVT_BUTTON, self.onOK, self.ok_button)
 		self.ok_button.SetDefault()
@@ -210,10 +270,20 @@ class SettingsDialog(wx.Dialog):
 		testing_sizer.Add(self.testing_choose_time)
 		testing_sizer.Add(self.testing_word_count_label)
 		testing_sizer.Add(self.testing_word_count)
+		testing_sizer.Add(self.testing_word_count_tolerance_label)
+		testing_sizer.Add(self.testing_word_count_tolerance)
 		testing_sizer.Add(self.testing_time_limit_label)
 		testing_sizer.Add(self.testing_time_limit)
+		testing_sizer.Add(self.testing_difficulty_label)
+		testing_sizer.Add(self.testing_difficulty)
+		testing_sizer.Add(self.testing_adaptive)
 		control_sizer.Add(testing_sizer, proportion=0, flag=wx.EXPAND|wx.ALL, border=5)
 		control_sizer.Add(self.database_file)
+		collector_sizer = wx.BoxSizer(wx.VERTICAL)
+		collector_sizer.Add(self.collector_url_label)
+		collector_sizer.Add(self.collector_url, flag=wx.EXPAND)
+		collector_sizer.Add(self.sync_results)
+		control_sizer.Add(collector_sizer, flag=wx.EXPAND)
 		button_sizer.Add(self.ok_button)
 		button_sizer.Add(self.cancel_button)
 		top_sizer.Add(control_sizer, flag=wx.EXPAND)
@@ -227,13 +297,22 @@ class SettingsDialog(wx.Dialog):
 		"""Writes settings to the configuration when OK is pressed."""
 		config = self._config
 		config.Write("loggingLevel", self.logging_choice.GetStringSelection())
+		setLevel(self.logging_choice.GetStringSelection())
 		config.WriteBool("speechEnabled", self.speech_enabled.GetValue())
 		config.Write("speechVoice", self.speech_voice.GetStringSelection())
 		config.WriteInt("speechRate", int(self.speech_rate.GetValue()))
 		config.WriteInt("speechVolume", int(self.speech_volume.GetValue()))
 		config.WriteInt("wordCount", int(self.testing_word_count.GetValue()))
+		config.WriteInt(
+			"wordCountTolerance",
+			int(self.testing_word_count_tolerance.GetValue())
+			)
 		config.WriteInt("timeLimit", int(self.testing_time_limit.GetValue()))
+		config.WriteInt("difficultyLevel", self.testing_difficulty.GetSelection())
+		config.WriteBool("adaptiveSentences", self.testing_adaptive.GetValue())
 		config.Write("databaseFileName", self.database_file.GetPath())
+		config.Write("collectorUrl", self.collector_url.GetValue().strip())
+		config.WriteBool("syncResults", self.sync_results.GetValue())
 		event.Skip()
 
 	def onRadioButton(self, event: wx.CommandEvent) -> None:
@@ -250,6 +329,8 @@ class SettingsDialog(wx.Dialog):
 			self.testing_time_limit.Hide()
 			self.testing_word_count_label.Show()
 			self.testing_word_count.Show()
+			self.testing_word_count_tolerance_label.Show()
+			self.testing_word_count_tolerance.Show()
 			self._config.WriteBool("wordsRadioButton", value=True)
 			self._config.WriteBool("timeRadioButton", value=False)
 		elif obj.GetName() == "timeRadioButton" and obj.GetValue():
@@ -257,11 +338,40 @@ class SettingsDialog(wx.Dialog):
 			self.testing_time_limit.Show()
 			self.testing_word_count_label.Hide()
 			self.testing_word_count.Hide()
+			self.testing_word_count_tolerance_label.Hide()
+			self.testing_word_count_tolerance.Hide()
 			self._config.WriteBool("wordsRadioButton", value=False)
 			self._config.WriteBool("timeRadioButton", value=True)
 		self.Layout()
 
 
+def percentileText(metric: str, value: float, start_time: datetime.datetime = None) -> str:
+	"""Describes where a value of a metric ranks among stored results.
+
+	Args:
+		metric: "accuracy" or "speed".
+		value: The value to rank.
+		start_time: When the result was started, which ranks it among results
+			from the same year as well.
+
+	Returns:
+		str: Such as "Faster than 82% of all results and 75% of results from
+		2019.", or "" if there is nothing to rank against.
+	"""
+	if value is None:
+		return ""
+	ranks = []
+	for cohort in resultCohorts(start_time):
+		rank = MetricBins.percentileRank(metric, value, cohort)
+		if rank is not None:
+			group = "all results" if cohort == ALL_RESULTS else f"results from {cohort}"
+			ranks.append(f"{rank:.0f}% of {group}")
+	if not ranks:
+		return ""
+	comparison = "Faster" if metric == "speed" else "More accurate"
+	return f"{comparison} than {' and '.join(ranks)}."
+
+
 class SingleResultDialog(wx.Dialog):
 	"""Display the details of a single test result."""
 
@@ -282,7 +392,15 @@ class SingleResultDialog(wx.Dialog):
 			id=wx.ID_ANY,
 			name="testResult",
 			style=wx.TE_READONLY | wx.TE_MULTILINE,
-			value=str(result)
+			value="\n".join(
+				line
+				for line in [
+					str(result),
+					percentileText("speed", result.speed, result.start_time),
+					percentileText("accuracy", result.accuracy, result.start_time),
+					]
+				if line
+				),
 			)
 		sizer.Add(self.label)
 		sizer.Add(self.text, flag=wx.EXPAND)
@@ -291,8 +409,53 @@ class SingleResultDialog(wx.Dialog):
 		self.text.SetFocus()
 
 
+class DiagnosticsDialog(wx.Dialog):
+	"""Shows how long the program's hot paths have been taking."""
+
+	def __init__(self, parent: wx.Window) -> None:
+		"""Initialize the dialog with a table of timings."""
+		super().__init__(
+			parent=parent,
+			size=(600, 450),
+			title="Diagnostics",
+			)
+		sizer = wx.BoxSizer(wx.VERTICAL)
+		self.label = wx.StaticText(
+			self,
+			label="Timings in milliseconds"
+			)
+		self.metrics_list = wx.ListCtrl(
+			self,
+			id=wx.ID_ANY,
+			name="metrics",
+			style=wx.LC_REPORT
+			)
+		for column, heading in enumerate(
+			["Name", "Count", "Mean", "50%", "95%", "99%", "Max"]
+			):
+			self.metrics_list.InsertColumn(column, heading)
+		for index, (name, timing) in enumerate(summary().items()):
+			self.metrics_list.InsertItem(index, name)
+			self.metrics_list.SetItem(index, 1, str(timing["count"]))
+			for column, key in enumerate(["mean", "p50", "p95", "p99", "max"], 2):
+				self.metrics_list.SetItem(index, column, f"{timing[key] * 1000:.1f}")
+		for column in range(self.metrics_list.GetColumnCount()):
+			self.metrics_list.SetColumnWidth(column, wx.LIST_AUTOSIZE_USEHEADER)
+		self.close_button = wx.Button(self, wx.ID_CANCEL, label="Close")
+		sizer.Add(self.label)
+		sizer.Add(self.metrics_list, proportion=1, flag=wx.EXPAND)
+		sizer.Add(self.close_button, flag=wx.ALIGN_CENTER_HORIZONTAL)
+		self.SetSizer(sizer)
+		self.Center()
+		self.metrics_list.SetFocus()
+
+
 class TypingDialog(wx.Dialog):
-	"""Dialog box for testing typing."""
+	"""Dialog box for testing typing.
+
+	The test itself is run by a TypingSession. This dialog only shows the
+	sentences the session gives it and passes along what is typed.
+	"""
 
 	def __init__(self, parent: wx.Frame) -> None:
 		"""Initialize a TypingDialog.
@@ -307,12 +470,22 @@ class TypingDialog(wx.Dialog):
 		self.user_name = parent.user_name.GetValue()
 		self.word_count = self._config.ReadInt("wordCount", defaultVal=10)
 		self.time_limit = self._config.ReadInt("timeLimit", defaultVal=30)
-		self.typed_count = 0
+		self.difficulty_level = self._config.ReadInt("difficultyLevel", defaultVal=0)
+		self.word_count_tolerance = self._config.ReadInt("wordCountTolerance", defaultVal=0)
 		self.setupSpeech()
-		self.used_sentences = set()
-		record = Sentences.randomSentence()
-		sentence = record.sentence
-		self.used_sentences.add(record.id)
+		# The next few sentences are drawn while the current one is typed.
+		self.prefetcher = SentencePrefetcher(
+			self.sentenceSource(),
+			size=self._config.ReadInt("prefetchSentences", defaultVal=3),
+			)
+		self.prefetcher.start()
+		self.session = TypingSession(
+			self.user_name,
+			sentence_source=self.prefetcher,
+			word_count=self.word_count,
+			station=self._config.Read("stationName", defaultVal=socket.gethostname()),
+			)
+		sentence = self.session.start()
 		self.given_label = wx.StaticText(
 			self,
 			id=wx.ID_ANY,
@@ -326,7 +499,6 @@ class TypingDialog(wx.Dialog):
 			name="GivenText",
 			label=sentence
 			)
-		self.given_list = [sentence]
 		self.typed_text = wx.TextCtrl(self, wx.ID_ANY,
 			name="typedText", style=wx.TE_MULTILINE|wx.TE_PROCESS_ENTER
 			)
@@ -334,11 +506,12 @@ class TypingDialog(wx.Dialog):
 		self.typed_text.Bind(wx.EVT_TEXT_ENTER, self.onEnter, source=self.typed_text)
 		self.typed_text.Bind(wx.EVT_CHAR, self.onTyping, source=self.typed_text)
 		self.typed_text.SetFocus()
-		self.typed_list = []
-		self.start_time = datetime.datetime.now()
 		self.timer = wx.Timer(self)
 		self.gauge_timer = wx.Timer(self)
 		self.Bind(wx.EVT_TIMER, self.onTimer)
+		# Escape and the close button end the test as well as finishing it does.
+		self.Bind(wx.EVT_CLOSE, self.onClose)
+		self.Bind(wx.EVT_BUTTON, self.onClose, id=wx.ID_CANCEL)
 		self.__do_layout()
 		if self.speech_enabled:
 			self.speaker.say(sentence)
@@ -358,6 +531,45 @@ class TypingDialog(wx.Dialog):
 		self.SetSizer(sizer)
 		self.Fit()
 
+	def sentenceSource(self):
+		"""Chooses where the sentences of this test come from.
+
+		Sentences are drawn from an index loaded once here rather than from the
+		database every time enter is pressed. When the test stops after a word
+		count, every sentence is planned now so the test has that many words.
+
+		Returns:
+			A sentence source for the TypingSession.
+		"""
+		sentence_index = SentenceFeatures.loadIndex()
+		if not len(sentence_index):
+			return Sentences.unusedSentence
+		if self._config.ReadBool("adaptiveSentences", defaultVal=True):
+			draw = AdaptiveSelector(
+				sentence_index,
+				UserWeaknesses.profile(self.user_name),
+				level=self.difficulty_level,
+				)
+		else:
+			draw = sentence_index.source(self.difficulty_level)
+		if not self._config.ReadBool("wordsRadioButton", defaultVal=True):
+			return draw
+		with timer("TypingDialog.planTest"):
+			plan = sentence_index.planTest(
+				self.word_count,
+				tolerance=self.word_count_tolerance,
+				level=self.difficulty_level,
+				draw=draw,
+				)
+		if abs(plan.words - self.word_count) > self.word_count_tolerance:
+			logging.info(
+				"Planned a test of %d words as no sentences add up to %d.",
+				plan.words,
+				self.word_count,
+				)
+		return plan if len(plan) else draw
+
+	@timed("TypingDialog.setupSpeech")
 	def setupSpeech(self)-> bool:
 		"""Initialize and configure the speech engine.
 		
@@ -384,20 +596,22 @@ class TypingDialog(wx.Dialog):
 			self.speaker_thread.start()
 		return self.speech_enabled
 
+	def onClose(self, event: wx.Event) -> None:
+		"""Stops the timers and the prefetcher however the dialog is closed."""
+		# If we don't explicitly stop this timer it runs even after the dialog is
+		# closed.
+		self.gauge_timer.Stop()
+		self.timer.Stop()
+		self.prefetcher.stop()
+		event.Skip()
+
+	@timed("TypingDialog.onEnter")
 	def onEnter(self, event: wx.CommandEvent = None) -> None:
 		"""Handles enter when pressed in typed_text."""
-		# WHY(self.time = int((datetime.datetime.now()-self.start_time).seconds))
-		self.typed_list.append(self.typed_text.GetValue().strip())
-		self.typed_count += len(self.typed_list[-1].split())
+		sentence = self.session.enter(self.typed_text.GetValue())
 		self.typed_text.Clear()
-		if self.typed_count <= self.word_count:
-			record = Sentences.randomSentence()
-			while record.id in self.used_sentences:
-				record = Sentences.randomSentence()
-			self.used_sentences.add(record.id)
-			sentence = record.sentence
+		if sentence is not None:
 			self.given_text.SetLabel(sentence)
-			self.given_list.append(sentence)
 			self.Refresh()
 			if self.speech_enabled: self.speaker.say(sentence)
 			event.Skip()
@@ -405,8 +619,8 @@ class TypingDialog(wx.Dialog):
 			self.storeResults(self.calculateResults())
 			if self.speech_enabled: self.speaker.endLoop()
 			wx.MessageBox("Test completed.", caption="Done")
-		self.end_time = datetime.datetime.now()
 
+	@timed("TypingDialog.onTyping")
 	def onTyping(self, event: wx.KeyEvent) -> None:
 		"""Tracks the count of typed printable characters.
 
@@ -414,14 +628,7 @@ class TypingDialog(wx.Dialog):
 			event (wx.KeyEvent): Using event.GetUnicodeKey(() will provide the key which
 			was pressed.
 		"""
-		key = event.GetUnicodeKey()
-		ignored_keys = [0, 8, 9, 13]
-		if hasattr(self, "typed_character_count") and key not in ignored_keys:
-			self.typed_character_count += 1
-		elif key not in ignored_keys:
-			self.typed_character_count = 1
-		# logging.debug(f"In onTyping key={repr(chr(key))}, "
-			# f"typed_text={repr(self.typed_text.GetValue())}")
+		self.session.keyPressed(event.GetUnicodeKey())
 		# Pass this event along.
 		event.Skip()
 
@@ -436,72 +643,51 @@ class TypingDialog(wx.Dialog):
 		"""
 		timer = event.GetTimer()
 		if timer == self.gauge_timer:
-			self.time_gauge.SetValue((datetime.datetime.now() - self.start_time).seconds)
+			self.time_gauge.SetValue(
+				(datetime.datetime.now() - self.session.start_time).seconds
+				)
 		else:
 			# Stop the speaker if time runs out.
 			if self.speech_enabled: self.speaker.endLoop()
+			self.session.finish()
 			self.storeResults(self.calculateResults())
 			# If we stop because of the timer we need to keep extra keys from taking
 			# action in the TypingFrame.
 			wx.MessageBox("Time is up.", caption="Done")
 			sleep(1)
 
-	def storeResults(self, results_dict: dict) -> Results:
+	@timed("TypingDialog.storeResults")
+	def storeResults(self, results_dict: dict) -> str:
 		"""Stores the results of the typing test.
 		
-		Results are stored in the database and the test_list from our parent
-		frame is updated with the results.
+		Results are handed to the ResultsWriter of our parent frame, which stores
+		them in the database in the background and then updates the test_list.
 		
 		Args:
 			results_dict (dict): Results dictionary to be stored to the database.
 
 		Returns:
-			accessible_typing_test.Results: The database object storing the test
-			results.
+			str: The spool file holding the results until they are stored, or None
+			if there was nothing to store.
 		"""
-		with session_scope() as session:
-			results = Results(**results_dict)
-			session.add(results)
-		self.GetParent().results_panel.fillTestList()
-		# If we don't explicitly stop this timer it runs even after the dialog is
-		# closed.
-		self.gauge_timer.Stop()
-		self.timer.Stop()
+		spool_path = None
+		if results_dict:
+			parent = self.GetParent()
+			spool_path = parent.results_writer.submit(
+				results_dict,
+				callback=parent.onResultsStored,
+				)
 		self.Close()
-		return results
+		return spool_path
 
+	@timed("TypingDialog.calculateResults")
 	def calculateResults(self) -> dict:
-		"""Compares the typed and given text and returns a results dictionary.
+		"""Scores the test with the TypingSession.
 		
 		Returns:
 			dict: keys are accuracy, speed, duration, words, and timestamp.
 		"""
-		if not hasattr(self, "typed_character_count"):
+		results = self.session.calculateResults()
+		if not results:
 			wx.MessageBox("Nothing typed. Cancelled test.")
-			return {}
-		results = {}
-		typed = "\n".join(self.typed_list)
-		given = "\n".join(self.given_list[0:len(self.typed_list)])
-		count = self.typed_character_count
-		for given_sentence, typed_sentence in zip(self.given_list, self.typed_list):
-			logging.debug(f"given_sentence={repr(given_sentence)}, typed_sentence={repr(typed_sentence)}")
-			# given += f"{given_sentence}\n"
-		results['user_name'] = self.user_name
-		results["start_time"] = self.start_time
-		results['end_time'] = self.end_time
-		results['edit_distance'] = levenshteinDistance(given[0:count], typed)
-		results['accuracy'] = \
-			int((count - results['edit_distance']) /  count * 100)
-		logging.debug(f"In calculateResults "
-			f"given[0:{count}]={repr(given[0:count])}, "
-			f"typed={repr(typed)}, "
-			f"edit distance={results['edit_distance']}"
-		)
-		duration = results['end_time'] - results['start_time']
-		results["duration"] = duration.seconds
-		results["words"] = len(typed.split(" "))
-		results["speed"] = int(results["words"] / (duration.total_seconds() / 60))
-		results["timestamp"] = results["end_time"].strftime("%m/%d/%y %I:%M %p")
-		results['given_text'] = given
-		results['typed_text'] = typed
 		return results
@@ -0,0 +1,69 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Formats typing test results for the results list and Excel workbooks."""
+
+import openpyxl
+from .metrics import timed
+
+# The columns of the results list and of exported workbooks.
+RESULT_COLUMNS = ["Accuracy", "Speed", "Duration", "Words", "User", "Timestamp"]
+
+
+def formatResult(row: tuple) -> list:
+	"""Formats a row from Results.listResults for display.
+
+	Args:
+		row: The id, accuracy, speed, duration, words, user_name and timestamp of a
+			result.
+
+	Returns:
+		list: One string for each of the RESULT_COLUMNS.
+	"""
+	id, accuracy, speed, duration, words, user_name, timestamp = row
+	return [
+		f"{accuracy}%",
+		f"{speed} WPM",
+		f"{duration} seconds",
+		f"{words}",
+		f"{user_name}",
+		str(timestamp),
+		]
+
+
+@timed("exportResults")
+def exportResults(path: str, records) -> int:
+	"""Writes results to an Excel workbook.
+
+	The workbook is written in openpyxl's write only mode, so rows are streamed to
+	the file rather than all being kept in memory.
+
+	Args:
+		path: The file name of the workbook.
+		records: Lists of strings, one for each of the RESULT_COLUMNS.
+
+	Returns:
+		int: The number of results written.
+	"""
+	wb = openpyxl.Workbook(write_only=True)
+	ws = wb.create_sheet()
+	ws.append(RESULT_COLUMNS)
+	count = 0
+	for record in records:
+		ws.append(record)
+		count += 1
+	wb.save(path)
+	return count
@@ -0,0 +1,306 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Features of sentences which make them easier or harder to type.
+
+Features are worked out once, when a sentence is added, and kept in the
+sentence_features table. A SentenceIndex built from that table groups sentences
+by difficulty level, so a sentence of any level can be drawn in constant time.
+"""
+
+from collections import namedtuple
+import random
+import string
+
+# Sentences are split into this many difficulty levels of about the same size.
+DIFFICULTY_LEVELS = 5
+# How many sentences are drawn to be tried first when the end of a test is planned.
+PREFERRED_DRAWS = 10
+
+Features = namedtuple(
+	"Features",
+	["length", "words", "punctuation", "capitals", "digits", "bigrams", "difficulty"],
+	)
+
+# An entry in a SentenceIndex, which can be used as a sentence source record.
+IndexedSentence = namedtuple(
+	"IndexedSentence",
+	["id", "sentence", "words", "level", "bigrams"],
+	)
+
+_punctuation = set(string.punctuation)
+
+
+def sentenceBigrams(sentence: str) -> str:
+	"""Returns every distinct pair of neighbouring characters in a sentence.
+
+	The pairs are sorted and joined into one string, so the string's length is
+	always even and pair n is at [2 * n:2 * n + 2].
+	"""
+	return "".join(sorted({sentence[index:index + 2] for index in range(len(sentence) - 1)}))
+
+
+def splitBigrams(bigrams: str) -> list:
+	"""Splits a string made by sentenceBigrams back into pairs."""
+	return [bigrams[index:index + 2] for index in range(0, len(bigrams), 2)]
+
+
+def sentenceFeatures(sentence: str) -> Features:
+	"""Works out the features of a sentence.
+
+	Punctuation, capitals and digits are given as the share of the sentence's
+	characters they make up.
+
+	Args:
+		sentence: The sentence to describe.
+
+	Returns:
+		Features: The features, including an overall difficulty score.
+	"""
+	length = len(sentence)
+	words = len(sentence.split())
+	characters = max(length, 1)
+	punctuation = sum(character in _punctuation for character in sentence) / characters
+	capitals = sum(character.isupper() for character in sentence) / characters
+	digits = sum(character.isdigit() for character in sentence) / characters
+	mean_word_length = sum(len(word) for word in sentence.split()) / max(words, 1)
+	# Long sentences, long words and characters which need the shift key or the
+	# number row are all harder to type accurately.
+	difficulty = length / 50 + mean_word_length / 5 \
+		+ 10 * punctuation + 8 * capitals + 15 * digits
+	return Features(
+		length,
+		words,
+		punctuation,
+		capitals,
+		digits,
+		sentenceBigrams(sentence),
+		difficulty,
+		)
+
+
+def difficultyLevels(difficulties: list, levels: int = DIFFICULTY_LEVELS) -> list:
+	"""Splits difficulty scores into levels which hold about as many sentences.
+
+	Args:
+		difficulties: The difficulty score of every sentence.
+		levels: How many levels to make.
+
+	Returns:
+		list: The level, from 1 for the easiest to levels, of each score.
+	"""
+	order = sorted(range(len(difficulties)), key=difficulties.__getitem__)
+	assigned = [0] * len(difficulties)
+	for rank, index in enumerate(order):
+		assigned[index] = rank * levels // len(difficulties) + 1
+	return assigned
+
+
+class SentenceIndex:
+	"""Sentences grouped by difficulty level for drawing at random.
+
+	The index also lists the sentences containing each character and bigram, so
+	sentences which practise a particular one can be found straight away, and
+	the sentences with each word count, so tests of an exact length can be planned.
+	"""
+
+	def __init__(self, entries, chooser: random.Random = None) -> None:
+		"""Initialize a SentenceIndex.
+
+		Args:
+			entries: IndexedSentence tuples for every sentence to draw from.
+			chooser: The source of random numbers.
+		"""
+		self.random = chooser or random.Random()
+		self.entries = {}
+		self.levels = {}
+		self.containing = {}
+		self.word_counts = {}
+		for entry in entries:
+			self.entries[entry.id] = entry
+			self.levels.setdefault(entry.level, []).append(entry)
+			self.word_counts.setdefault(entry.words, []).append(entry)
+			for key in set(entry.sentence).union(splitBigrams(entry.bigrams)):
+				self.containing.setdefault(key, []).append(entry)
+		self._all = list(self.entries.values())
+
+	def __len__(self) -> int:
+		return len(self._all)
+
+	def draw(self, used: set, level: int = 0) -> IndexedSentence:
+		"""Draws a random sentence which has not been used.
+
+		Args:
+			used: The ids of sentences which should not be chosen.
+			level: The difficulty level to draw from, or 0 for any level.
+
+		Returns:
+			IndexedSentence: The sentence, or None if every sentence of the level is
+			used.
+		"""
+		candidates = self.levels.get(level, []) if level else self._all
+		if not candidates:
+			return None
+		# While most sentences are unused a few random tries find one.
+		for attempt in range(8):
+			entry = candidates[self.random.randrange(len(candidates))]
+			if entry.id not in used:
+				return entry
+		unused = [entry for entry in candidates if entry.id not in used]
+		return self.random.choice(unused) if unused else None
+
+	def source(self, level: int = 0):
+		"""Returns a sentence source for a TypingSession drawing from one level."""
+		return lambda used: self.draw(used, level)
+
+	def planTest(
+		self,
+		word_count: int,
+		tolerance: int = 0,
+		level: int = 0,
+		used: set = (),
+		draw=None,
+		) -> "TestPlan":
+		"""Chooses unused sentences which add up to a number of words.
+
+		Sentences are drawn at random until the words left to plan could be made
+		up by a couple of sentences. The rest of the test is then made up of
+		sentences chosen from the word count index so that the total is within
+		tolerance of word_count, or as close as the sentences allow. Sentences
+		which draw gives are tried first, so a short test is still made of them
+		where the word counts allow.
+
+		Args:
+			word_count: How many words the test should have.
+			tolerance: How many words over or under word_count will do.
+			level: The difficulty level to keep to, or 0 for any level.
+			used: The ids of sentences which should not be chosen.
+			draw: Called with the set of used ids to draw each random sentence.
+				Defaults to draw from this index at the given level.
+
+		Returns:
+			TestPlan: The planned sentences.
+		"""
+		draw = draw or (lambda used: self.draw(used, level))
+		used = set(used)
+		plan = []
+		remaining = word_count
+		longest = max(self.word_counts, default=0)
+		while remaining > 2 * longest:
+			entry = draw(used)
+			if entry is None:
+				break
+			plan.append(entry)
+			used.add(entry.id)
+			remaining -= entry.words
+		preferred = []
+		drawn = set(used)
+		for attempt in range(PREFERRED_DRAWS):
+			entry = draw(drawn)
+			if entry is None:
+				break
+			preferred.append(entry)
+			drawn.add(entry.id)
+		finish = self._finishPlan(remaining, tolerance, used, level, preferred)
+		if level and finish is None:
+			finish = self._finishPlan(remaining, tolerance, used, 0, preferred)
+		if finish is None:
+			# Settle for the closest total the sentences allow.
+			finish = self._finishPlan(remaining, max(tolerance, longest), used, level, preferred)
+		plan.extend(finish or [])
+		return TestPlan(plan)
+
+	def _finishPlan(
+		self,
+		remaining: int,
+		tolerance: int,
+		used: set,
+		level: int,
+		preferred: list = (),
+		) -> list:
+		"""Finds unused sentences whose word counts add up to remaining.
+
+		Args:
+			remaining: How many words the sentences should add up to.
+			tolerance: How many words over or under remaining will do.
+			used: The ids of sentences which should not be chosen.
+			level: The difficulty level to keep to, or 0 for any level.
+			preferred: Sentences to use before any others where a total allows.
+
+		Returns:
+			list: The sentences, or None if no sentences come within tolerance.
+		"""
+		limit = remaining + tolerance
+		preferred = [
+			entry for entry in preferred
+			if 0 < entry.words <= limit and entry.id not in used and (not level or entry.level == level)
+			]
+		skipped = set(used) | {entry.id for entry in preferred}
+		candidates = []
+		for words, entries in self.word_counts.items():
+			if words <= 0 or words > limit:
+				continue
+			unused = [
+				entry for entry in entries
+				if entry.id not in skipped and (not level or entry.level == level)
+				]
+			# No total can hold more sentences of one length than this.
+			candidates.extend(self.random.sample(unused, min(len(unused), limit // words)))
+		self.random.shuffle(candidates)
+		# Each total keeps the first way found to reach it, so preferred sentences
+		# make up every total they can.
+		candidates = preferred + candidates
+		# Every total which can be reached, with the last sentence added to reach it.
+		parents = {0: None}
+		for entry in candidates:
+			for total in sorted(parents, reverse=True):
+				reached = total + entry.words
+				if reached <= limit and reached not in parents:
+					parents[reached] = (total, entry)
+		best = min(parents, key=lambda total: (abs(total - remaining), total > remaining))
+		if abs(best - remaining) > tolerance:
+			return None
+		finish = []
+		while parents[best] is not None:
+			best, entry = parents[best]
+			finish.append(entry)
+		return finish
+
+
+class TestPlan:
+	"""A sentence source which gives out planned sentences in order."""
+
+	def __init__(self, entries) -> None:
+		"""Initialize a TestPlan.
+
+		Args:
+			entries: The IndexedSentence tuples to give out.
+		"""
+		self.entries = list(entries)
+		self.words = sum(entry.words for entry in self.entries)
+		self._position = 0
+
+	def __len__(self) -> int:
+		return len(self.entries)
+
+	def __call__(self, used: set) -> IndexedSentence:
+		"""Returns the next planned sentence, or None once they are all given out."""
+		while self._position < len(self.entries):
+			entry = self.entries[self._position]
+			self._position += 1
+			if entry.id not in used:
+				return entry
+		return None
@@ -14,12 +14,17 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-"""Standalone function to calculate the Levenshtein distance between 2 strings.
+"""Standalone functions to compare typed text with the text it should match.
+
+levenshteinDistance counts the edits between 2 strings and alignStrings shows
+which characters those edits were.
 
 For more information on the Levenshtein distance see:
 https://en.wikipedia.org/wiki/Levenshtein_distance
 """
 
+import functools
+
 def levenshteinDistance(shorter: str, longer: str) -> int:
 	"""Calculate the Levenshtein Distance aka edit distance between 2 strings.
 	
@@ -52,3 +57,63 @@ def levenshteinDistance(shorter: str, longer: str) -> int:
 					)
 		distances = distances_
 	return distances[-1]
+
+
+def alignStrings(given: str, typed: str) -> list:
+	"""Lines up the characters of typed text with those of the given text.
+
+	Uses the same edits as levenshteinDistance, choosing a substitution over an
+	insertion or deletion where the two cost the same.
+
+	Args:
+		given (str): The text which should have been typed.
+		typed (str): The text which was typed.
+
+	Returns:
+		list: A (given character, typed character) pair for each step through the
+		strings. The given character is "" where an extra character was typed and
+		the typed character is "" where a given character was left out.
+	"""
+	return list(_alignment(given, typed))
+
+
+# Storing a result aligns each of its sentences for the user's weaknesses and
+# again for their character confusions, so recent alignments are kept.
+@functools.lru_cache(maxsize=128)
+def _alignment(given: str, typed: str) -> tuple:
+	"""Does the work of alignStrings, giving a tuple which can be shared."""
+	rows = len(given) + 1
+	columns = len(typed) + 1
+	# distances[row][column] is the distance between given[:row] and typed[:column].
+	distances = [list(range(columns))]
+	for row in range(1, rows):
+		current = [row]
+		for column in range(1, columns):
+			if given[row - 1] == typed[column - 1]:
+				current.append(distances[row - 1][column - 1])
+			else:
+				current.append(1 + min(
+					distances[row - 1][column - 1],
+					distances[row - 1][column],
+					current[column - 1],
+					))
+		distances.append(current)
+	pairs = []
+	row, column = rows - 1, columns - 1
+	while row or column:
+		distance = distances[row][column]
+		if row and column and (
+			given[row - 1] == typed[column - 1] and distance == distances[row - 1][column - 1]
+			or distance == distances[row - 1][column - 1] + 1
+			):
+			pairs.append((given[row - 1], typed[column - 1]))
+			row -= 1
+			column -= 1
+		elif row and distance == distances[row - 1][column] + 1:
+			pairs.append((given[row - 1], ""))
+			row -= 1
+		else:
+			pairs.append(("", typed[column - 1]))
+			column -= 1
+	pairs.reverse()
+	return tuple(pairs)
@@ -0,0 +1,103 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Logging which never makes the user interface wait.
+
+Log records are put on a queue by the thread which logs them and written to a
+rotating log file and the console by a background thread. Messages should use
+logging's own % formatting, so that debug messages cost nothing when the
+loggingLevel setting leaves them out.
+"""
+
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import queue
+from pkg_resources import resource_filename
+import wx
+
+LOG_FORMAT = "%(asctime)s: %(levelname)s: %(threadName)s: %(message)s"
+DATE_FORMAT = "%Y-%m-%d %I:%M:%S %p"
+# Keep at most this many bytes in each log file and this many old log files.
+MAX_BYTES = 1000000
+BACKUP_COUNT = 5
+
+_listener = None
+
+
+def levelFromName(name: str) -> int:
+	"""Converts a level name such as "debug" or "INFO" to a logging level.
+
+	Unknown names give logging.INFO.
+	"""
+	level = logging.getLevelName(str(name).upper())
+	return level if isinstance(level, int) else logging.INFO
+
+
+def setLevel(name: str) -> None:
+	"""Changes which messages are logged while the program is running.
+
+	Args:
+		name: The name of the lowest level to log, such as "DEBUG".
+	"""
+	logging.getLogger().setLevel(levelFromName(name))
+
+
+def setupLogging(config: wx.Config) -> QueueListener:
+	"""Routes all logging through a queue to a background writer thread.
+
+	Args:
+		config: The application configuration. The loggingLevel setting chooses the
+			level and logFileName where the log is written.
+
+	Returns:
+		QueueListener: The background writer, which is also stopped by
+		stopLogging.
+	"""
+	global _listener
+	stopLogging()
+	formatter = logging.Formatter(LOG_FORMAT, datefmt=DATE_FORMAT)
+	file_handler = RotatingFileHandler(
+		config.Read(
+			"logFileName",
+			defaultVal=resource_filename(__name__, "data/typing_test.log"),
+			),
+		maxBytes=MAX_BYTES,
+		backupCount=BACKUP_COUNT,
+		encoding="utf-8",
+		delay=True,
+		)
+	file_handler.setFormatter(formatter)
+	console_handler = logging.StreamHandler()
+	console_handler.setFormatter(formatter)
+	log_queue = queue.SimpleQueue()
+	root = logging.getLogger()
+	for handler in root.handlers[:]:
+		root.removeHandler(handler)
+	root.addHandler(QueueHandler(log_queue))
+	setLevel(config.Read("loggingLevel", defaultVal="INFO"))
+	_listener = QueueListener(log_queue, file_handler, console_handler)
+	_listener.start()
+	return _listener
+
+
+def stopLogging() -> None:
+	"""Writes any queued messages and stops the background writer thread."""
+	global _listener
+	if _listener is not None:
+		_listener.stop()
+		for handler in _listener.handlers:
+			handler.close()
+		_listener = None
@@ -20,12 +20,21 @@
 import datetime
 import logging
 import os
-import openpyxl
+import socket
+from pkg_resources import resource_filename
 import wx
 from accessible_typing_test.menus import TypingMenuBar
 from accessible_typing_test.dialogs import *
 from accessible_typing_test.panels import *
-from accessible_typing_test.database import session_scope, Sentences, Results
+from accessible_typing_test.backup import BackupScheduler
+from accessible_typing_test.collector import resultsSink
+from accessible_typing_test.database import connect, databasePath, session_scope, Sentences, SentenceFeatures, Results
+from accessible_typing_test.export import exportResults
+from accessible_typing_test.logs import setupLogging, stopLogging
+from accessible_typing_test.maintenance import MaintenanceScheduler
+from accessible_typing_test.metrics import dumpMetrics
+from accessible_typing_test.sync import SyncClient
+from accessible_typing_test.writer import ResultsWriter
 # from accessible_typing_test.settings_dialog import SettingsDialog
 # from accessible_typing_test.typing_dialog import TypingDialog
 
@@ -38,6 +47,51 @@ class TypingFrame(wx.Frame):
 		super().__init__(None, title="Typing Test", size=(600, 800), name="typingFrame")
 		self._config = wx.Config("typing_test")
 		config = self._config
+		# Results are stored in the background so the end of a test never waits
+		# for the database, or for a collector if one is set.
+		collector_url = config.Read("collectorUrl", defaultVal="")
+		sync_results = bool(collector_url) and config.ReadBool("syncResults", defaultVal=False)
+		self.results_writer = ResultsWriter(
+			config.Read(
+				"spoolDirectory",
+				defaultVal=resource_filename(__name__, "data/spool"),
+				),
+			store=resultsSink("" if sync_results else collector_url),
+			)
+		# A station which keeps its own results copies them to the collector.
+		self.sync_client = None
+		if sync_results:
+			self.sync_client = SyncClient(
+				collector_url,
+				station=config.Read("stationName", defaultVal=socket.gethostname()),
+				batch_size=config.ReadInt("syncBatchSize", defaultVal=100),
+				)
+			self.sync_client.start()
+		# Backups are taken in small steps so they never hold up a test.
+		self.backup_scheduler = None
+		backup_hours = config.ReadInt("backupIntervalHours", defaultVal=24)
+		if backup_hours > 0:
+			self.backup_scheduler = BackupScheduler(
+				databasePath(),
+				config.Read(
+					"backupDirectory",
+					defaultVal=os.path.join(os.path.dirname(databasePath()), "backups"),
+					),
+				interval=backup_hours * 60 * 60,
+				keep=config.ReadInt("backupsKept", defaultVal=7),
+				)
+			self.backup_scheduler.start()
+		# The database is only maintained while no test is running.
+		self.testing = False
+		self.maintenance_scheduler = MaintenanceScheduler(
+			lambda: not self.testing,
+			interval=config.ReadInt("maintenanceIntervalMinutes", defaultVal=10) * 60,
+			writes=config.ReadInt("maintenanceWrites", defaultVal=1000),
+			)
+		self.maintenance_scheduler.start()
+		self.results_writer.replaySpool(callback=self.onResultsStored)
+		self.results_writer.start()
+		self.Bind(wx.EVT_CLOSE, self.onClose)
 		self.menu_bar = TypingMenuBar()
 		self.font = wx.SystemSettings.GetFont(wx.SYS_SYSTEM_FONT)
 		self.panel = wx.Panel(self)
@@ -154,12 +208,27 @@ class TypingFrame(wx.Frame):
 		TypingFrame when the test finishes.
 		"""
 		logging.debug("Starting test...")
-		dlg = TypingDialog(self)
-		dlg.ShowModal()
-		with session_scope() as session:
-			self.GetStatusBar().SetStatusText(
-				f"{self.results_panel.test_list.GetItemCount()} test results recorded."
-				)
+		self.testing = True
+		try:
+			dlg = TypingDialog(self)
+			dlg.ShowModal()
+		finally:
+			self.testing = False
+
+	def onResultsStored(self, ids: list) -> None:
+		"""Updates the results list and status bar once results are stored.
+
+		Args:
+			ids: The ids of the results which were just stored.
+		"""
+		logging.debug("Stored results %s.", ids)
+		if self.sync_client is not None:
+			self.sync_client.wake()
+		self.results_panel.fillTestList()
+		self.users_panel.fillUserList()
+		self.GetStatusBar().SetStatusText(
+			f"{self.results_panel.test_list.GetItemCount()} test results recorded."
+			)
 
 	def onSettings(self, event: wx.CommandEvent) -> None:
 		"""Opens the SettingsDialog."""
@@ -185,16 +254,17 @@ class TypingFrame(wx.Frame):
 			file_name = dlg.GetFilename()
 			directory_name = dlg.GetDirectory()
 		path = os.path.join(directory_name, file_name)
-		wb = openpyxl.workbook.Workbook()
-		ws = wb.active
-		fields = ["Accuracy", "Speed", "Duration", "Words", "User", "Timestamp"]
-		ws.append(fields)
-		for index in range(self.test_list.GetItemCount()):
-			record = []
-			for column in range(self.test_list.GetColumnCount()):
-				record.append(self.test_list.GetItem(index, column).GetText())
-			ws.append(record)
-		wb.save(path)
+		test_list = self.results_panel.test_list
+		exportResults(
+			path,
+			(
+				[
+					test_list.GetItem(index, column).GetText()
+					for column in range(test_list.GetColumnCount())
+					]
+				for index in range(test_list.GetItemCount())
+				),
+			)
 
 	def onExit(self, event: wx.CommandEvent) -> None:
 		"""Handles exiting of the application.
@@ -202,24 +272,42 @@ class TypingFrame(wx.Frame):
 		Does nothing but log a message at this time.
 		"""
 		config = self._config
-		logging.debug(f"Exiting due to {event.GetEventObject()}.")
+		logging.debug("Exiting due to %s.", event.GetEventObject())
 		config.Write("userName", self.user_name.GetValue())
 		self.Close(True)
 
+	def onClose(self, event: wx.CloseEvent) -> None:
+		"""Finishes storing results before the window closes."""
+		self.results_writer.stop(timeout=10)
+		if self.sync_client is not None:
+			self.sync_client.stop(timeout=10)
+		if self.backup_scheduler is not None:
+			self.backup_scheduler.stop(timeout=30)
+		self.maintenance_scheduler.stop(timeout=30)
+		event.Skip()
+
 
 def main():
 	"""Runs the application."""
-	logging.basicConfig(
-		format="%(asctime)s: %(levelname)s: %(message)s",
-		datefmt="%Y-%m-%d %I:%M:%S %p",
-		level=logging.DEBUG
-		)
-	logging.info("Starting up...")
-	app = wx.App(False)
-	frame = TypingFrame()
-	app.SetTopWindow(frame)
-	if not app.IsMainLoopRunning(): app.MainLoop()
-	logging.info("Shutting down.")
+	config = wx.Config("typing_test")
+	setupLogging(config)
+	try:
+		logging.info("Starting up...")
+		connect()
+		# Databases made by older versions have sentences without features.
+		with session_scope() as session:
+			SentenceFeatures.indexSentences(session)
+		app = wx.App(False)
+		frame = TypingFrame()
+		app.SetTopWindow(frame)
+		if not app.IsMainLoopRunning(): app.MainLoop()
+		metrics_file_name = config.Read("metricsFileName", defaultVal="")
+		if metrics_file_name:
+			dumpMetrics(metrics_file_name)
+			logging.info("Saved timings to %s.", metrics_file_name)
+		logging.info("Shutting down.")
+	finally:
+		stopLogging()
 	return
 
 if __name__ == "__main__":
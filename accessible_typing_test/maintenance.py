@@ -0,0 +1,163 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Keeping the results database quick and healthy while nobody is testing.
+
+Removing results and importing many at once leave the database file full of
+free pages and SQLite's query planner with out of date statistics. A
+MaintenanceScheduler watches how many rows the program has written and, once
+enough have been and no test is running, checks the database, gives free
+pages back to the file system and brings the planner's statistics up to date.
+"""
+
+from collections import namedtuple
+import logging
+import os
+import sqlite3
+import threading
+import time
+from .database import databasePath, writeCount
+from .metrics import record
+
+# Rows written before maintenance is worth doing.
+WRITES_BEFORE_MAINTENANCE = 1000
+# The auto_vacuum mode which lets free pages be given back a few at a time.
+_INCREMENTAL = 2
+
+# What one maintenance task did.
+MaintenanceTask = namedtuple("MaintenanceTask", ["name", "seconds", "detail"])
+
+
+def _timed(name: str, work) -> MaintenanceTask:
+	"""Runs a maintenance task and records how long it took."""
+	began = time.perf_counter()
+	detail = work()
+	seconds = time.perf_counter() - began
+	record(f"maintenance.{name}", seconds)
+	logging.info("Maintenance: %s took %.2f seconds: %s", name, seconds, detail)
+	return MaintenanceTask(name, seconds, detail)
+
+
+def checkIntegrity(connection: sqlite3.Connection) -> str:
+	"""Runs SQLite's quick check, logging an error if it finds a problem."""
+	problems = [row[0] for row in connection.execute("PRAGMA quick_check")]
+	if problems != ["ok"]:
+		logging.error("The database failed its check: %s", "; ".join(problems))
+	return "; ".join(problems)
+
+
+def vacuum(connection: sqlite3.Connection, path: str, full: bool = False) -> str:
+	"""Gives the database's free pages back to the file system.
+
+	A database which vacuums incrementally is vacuumed a page at a time, which
+	is quick. A full vacuum rewrites the whole file while every other station
+	waits, so it is only done if full is True. It switches the database to
+	vacuum incrementally from then on.
+
+	Returns:
+		str: How much space was given back.
+	"""
+	before = os.path.getsize(path)
+	free = connection.execute("PRAGMA freelist_count").fetchone()[0]
+	pages = connection.execute("PRAGMA page_count").fetchone()[0]
+	mode = connection.execute("PRAGMA auto_vacuum").fetchone()[0]
+	if full:
+		connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+		connection.execute("VACUUM")
+	elif mode == _INCREMENTAL:
+		# The pragma frees one page each time it is stepped. execute steps it only
+		# once, but executescript runs it to the end.
+		connection.executescript("PRAGMA incremental_vacuum;")
+	else:
+		return f"{free} of {pages} pages free, which only a full vacuum gives back"
+	after = os.path.getsize(path)
+	return f"{(before - after) / 1048576:.1f} MB given back, {after / 1048576:.1f} MB left"
+
+
+def analyze(connection: sqlite3.Connection) -> str:
+	"""Brings the statistics SQLite plans queries with up to date."""
+	connection.execute("ANALYZE")
+	return "statistics updated"
+
+
+def runMaintenance(path: str = None, full: bool = False) -> list:
+	"""Checks, vacuums and analyzes a database.
+
+	Args:
+		path: The database file. Defaults to the one sessions are bound to.
+		full: Whether to vacuum in full, which locks the database until done.
+
+	Returns:
+		list: A MaintenanceTask for each task.
+	"""
+	path = path or databasePath()
+	# Stations may be writing too, so wait for their locks to clear.
+	connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+	try:
+		return [
+			_timed("quick_check", lambda: checkIntegrity(connection)),
+			_timed("vacuum", lambda: vacuum(connection, path, full)),
+			_timed("analyze", lambda: analyze(connection)),
+			]
+	finally:
+		connection.close()
+
+
+class MaintenanceScheduler(threading.Thread):
+	"""A background thread which maintains the database while it is idle."""
+
+	def __init__(
+		self,
+		idle,
+		path: str = None,
+		interval: float = 10 * 60,
+		writes: int = WRITES_BEFORE_MAINTENANCE,
+		) -> None:
+		"""Initialize a MaintenanceScheduler.
+
+		Args:
+			idle: Returns True while no test is running, so maintenance can start.
+			path: The database file. Defaults to the one sessions are bound to.
+			interval: How many seconds to wait between looks at the write count.
+			writes: How many rows must be written before maintenance is done again.
+		"""
+		super().__init__(name="MaintenanceScheduler", daemon=True)
+		self.idle = idle
+		self.path = path
+		self.interval = interval
+		self.writes = writes
+		self._maintained_at = writeCount()
+		self._stopping = threading.Event()
+
+	def due(self) -> bool:
+		"""Returns whether enough has been written since the last maintenance."""
+		return writeCount() - self._maintained_at >= self.writes
+
+	def stop(self, timeout: float = None) -> None:
+		"""Stops the thread, waiting for maintenance in progress to finish."""
+		self._stopping.set()
+		self.join(timeout)
+
+	def run(self) -> None:
+		"""Maintains the database whenever it is due and idle until stopped."""
+		while not self._stopping.wait(self.interval):
+			if not self.due() or not self.idle():
+				continue
+			self._maintained_at = writeCount()
+			try:
+				runMaintenance(self.path)
+			except sqlite3.Error:
+				logging.exception("Could not maintain the database.")
@@ -18,6 +18,7 @@ import logging
 import os
 import wx
 from accessible_typing_test.database import Sentences
+from accessible_typing_test.dialogs import DiagnosticsDialog
 # from accessible_typing_test.main import TestsPanel
 
 class TypingMenuBar(wx.MenuBar):
@@ -96,6 +97,12 @@ class TypingMenuBar(wx.MenuBar):
 			help="Show user statistics.",
 			)
 		keys.append(wx.AcceleratorEntry(wx.ACCEL_CTRL, ord('3'), self._VIEW_USERS_ID))
+		self._DIAGNOSTICS_ID = wx.Window.NewControlId()
+		help.Append(
+			self._DIAGNOSTICS_ID,
+			item="&Diagnostics...",
+			helpString="Show how long the program has been taking to respond."
+			)
 		help.Append(wx.ID_ABOUT, "&About")
 		self.accelerator_table = wx.AcceleratorTable(keys)
 
@@ -109,11 +116,13 @@ class TypingMenuBar(wx.MenuBar):
 			event (wx.CommandEvent): The event which called this function.
 			"""
 		id = event.GetId()
-		logging.debug(f"Handling menu event {id}")
+		logging.debug("Handling menu event %d", id)
 		if id == wx.ID_EXIT:
 			self.GetParent().onExit(event)
 		elif id == wx.ID_ABOUT:
 			wx.MessageBox("Typing Test by Thomas Stivers")
+		elif id == self._DIAGNOSTICS_ID:
+			DiagnosticsDialog(self.GetParent()).ShowModal()
 		elif id == wx.ID_CLEAR:
 			pass
 		elif id == self._ADD_SENTENCES_FROM_FILE_ID:
@@ -0,0 +1,349 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Merging the databases kept by several stations into one.
+
+Each source database is attached to the target and read in batches. A result
+is identified by its station, user and start time, which the target keeps a
+unique index on, so a result already in the target is never stored twice and
+merging the same file again does nothing. Each batch of new results is inserted
+with one statement per table and committed in one transaction.
+"""
+
+from collections import namedtuple
+import logging
+import os
+import sqlite3
+import time
+from sqlalchemy import func, literal, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Engine
+from .database import (
+	attachDatabase,
+	attachedTable,
+	CharacterConfusions,
+	connect,
+	decodeIds,
+	decompressText,
+	detachDatabase,
+	encodeIds,
+	MetricBins,
+	Results,
+	SentenceResults,
+	Sentences,
+	SentenceStatistics,
+	Session,
+	UserBests,
+	UserWeaknesses,
+	)
+from .confusion import mergeConfusions, textConfusions
+from .weakness import mergeCounts
+
+# The name source databases are attached under.
+SOURCE_SCHEMA = "merge_source"
+# New result ids are read back with INSERT ... RETURNING, which needs this SQLite library.
+SQLITE_VERSION = (3, 35, 0)
+
+# What happened to the results of one source database.
+MergeCount = namedtuple("MergeCount", ["source", "read", "inserted", "duplicates", "seconds"])
+
+
+def stationName(path: str) -> str:
+	"""Returns the station results from a database are credited to if they do not say.
+
+	This is the database's file name without its extension.
+	"""
+	return os.path.splitext(os.path.basename(path))[0]
+
+
+def _sourceColumns(session: Session, table) -> list:
+	"""Returns the columns of a table which an attached source database has.
+
+	Databases from older versions lack some of the newer columns.
+	"""
+	present = {
+		row[1]
+		for row in session.connection().exec_driver_sql(
+			f"PRAGMA {SOURCE_SCHEMA}.table_info({table.name})"
+			)
+		}
+	return [column.name for column in table.columns if column.name in present]
+
+
+def _mapSentences(session: Session) -> tuple:
+	"""Finds the target sentence for every sentence of the source database.
+
+	Sentences the target does not have are added to it as retired sentences, so
+	the results which used them can still be read.
+
+	Returns:
+		tuple: The target ids keyed by source id, and the sentences keyed by
+		target id.
+	"""
+	source = attachedTable(Sentences.__table__, SOURCE_SCHEMA)
+	rows = session.execute(select(source.c.id, source.c.sentence)).all()
+	known = {sentence: id for id, sentence in session.query(Sentences.id, Sentences.sentence)}
+	missing = [
+		Sentences(sentence=sentence, retired=True)
+		for sentence in sorted({sentence for id, sentence in rows} - known.keys())
+		]
+	if missing:
+		session.add_all(missing)
+		session.flush()
+		known.update((record.sentence, record.id) for record in missing)
+	return (
+		{id: known[sentence] for id, sentence in rows},
+		{known[sentence]: sentence for id, sentence in rows},
+		)
+
+
+def _anyStored(session: Session, station: str, results_columns: list) -> bool:
+	"""Returns whether any result of the source database is stored already."""
+	source = attachedTable(Results.__table__, SOURCE_SCHEMA)
+	target = Results.__table__
+	source_station = literal(station)
+	if "station" in results_columns:
+		source_station = func.coalesce(source.c.station, station)
+	return session.execute(
+		select(target.c.id).join(
+			source,
+			(target.c.station == source_station)
+			& (target.c.user_name == source.c.user_name)
+			& (target.c.start_time == source.c.start_time),
+			).limit(1)
+		).first() is not None
+
+
+def _copyWeaknesses(session: Session) -> None:
+	"""Adds the weaknesses kept by the source database to the target's."""
+	source = attachedTable(UserWeaknesses.__table__, SOURCE_SCHEMA)
+	user_counts = {}
+	for user_name, key, attempts, errors in session.execute(
+		select(source.c.user_name, source.c.key, source.c.attempts, source.c.errors)
+		):
+		user_counts.setdefault(user_name, {})[key] = [attempts, errors]
+	for user_name, counts in user_counts.items():
+		UserWeaknesses.addCounts(session, user_name, counts)
+
+
+def _copyConfusions(session: Session) -> None:
+	"""Adds the character confusions kept by the source database to the target's."""
+	source = attachedTable(CharacterConfusions.__table__, SOURCE_SCHEMA)
+	user_counts = {}
+	for user_name, expected, typed, count in session.execute(
+		select(source.c.user_name, source.c.expected, source.c.typed, source.c.count)
+		):
+		user_counts.setdefault(user_name, {})[(expected, typed)] = count
+	for user_name, counts in user_counts.items():
+		CharacterConfusions.addCounts(session, user_name, counts)
+
+
+def mergeDatabase(
+	engine: Engine,
+	path: str,
+	batch_size: int = 10000,
+	weaknesses: bool = True,
+	) -> MergeCount:
+	"""Copies the results of one database which another does not have yet.
+
+	Args:
+		engine: The engine connected to the database to merge into.
+		path: The database file to merge from, which is not changed.
+		batch_size: The most results to insert in one transaction.
+		weaknesses: Whether to add the results to each user's weaknesses and
+			character confusions as well. If none of the source's results are
+			stored yet, the counts it keeps are added all at once, and the whole
+			merge is one transaction so that a merge which fails partway and is
+			run again cannot count them twice. Otherwise each new result is scored
+			again, which takes longest.
+
+	Returns:
+		MergeCount: How many results were read, inserted and already there.
+
+	Raises:
+		RuntimeError: If the SQLite library is older than SQLITE_VERSION.
+	"""
+	if sqlite3.sqlite_version_info < SQLITE_VERSION:
+		raise RuntimeError(
+			f"Merging needs SQLite {'.'.join(map(str, SQLITE_VERSION))} or newer, "
+			f"not {sqlite3.sqlite_version}."
+			)
+	began = time.perf_counter()
+	station = stationName(path)
+	read = inserted = duplicates = 0
+	with engine.connect() as connection:
+		session = Session(bind=connection)
+		try:
+			attachDatabase(session, path, SOURCE_SCHEMA)
+			results_columns = _sourceColumns(session, Results.__table__)
+			if not results_columns:
+				raise ValueError(f"{path} is not a typing test database.")
+			sentence_columns = _sourceColumns(session, SentenceResults.__table__)
+			sentence_ids, texts = _mapSentences(session)
+			confusions = weaknesses
+			copy_weaknesses = copy_confusions = False
+			if weaknesses and not _anyStored(session, station, results_columns):
+				copy_weaknesses = bool(_sourceColumns(session, UserWeaknesses.__table__))
+				copy_confusions = bool(_sourceColumns(session, CharacterConfusions.__table__))
+				weaknesses = not copy_weaknesses
+				confusions = not copy_confusions
+			session.commit()
+			source_results = attachedTable(Results.__table__, SOURCE_SCHEMA)
+			source_sentences = attachedTable(SentenceResults.__table__, SOURCE_SCHEMA)
+			last = 0
+			while True:
+				rows = session.execute(
+					select(*[source_results.c[name] for name in results_columns])
+					.where(source_results.c.id > last)
+					.order_by(source_results.c.id)
+					.limit(batch_size)
+					).mappings().all()
+				if not rows:
+					break
+				first, last = rows[0]["id"], rows[-1]["id"]
+				read += len(rows)
+				keys = [
+					(row.get("station") or station, row["user_name"], row["start_time"])
+					for row in rows
+					]
+				stored = Results.storedKeys(session, keys)
+				source_ids = []
+				new_rows = []
+				for key, row in zip(keys, rows):
+					if key in stored:
+						duplicates += 1
+						continue
+					# Repeats within the source count as duplicates as well.
+					stored[key] = None
+					values = dict(row)
+					source_ids.append(values.pop("id"))
+					values["station"] = key[0]
+					if values.get("given_ids"):
+						values["given_ids"] = encodeIds(
+							[sentence_ids[id] for id in decodeIds(values["given_ids"])]
+							)
+					new_rows.append(values)
+				if not new_rows:
+					continue
+				new_ids = session.execute(
+					insert(Results.__table__).returning(
+						Results.__table__.c.id,
+						sort_by_parameter_order=True,
+						),
+					new_rows,
+					).scalars().all()
+				result_ids = dict(zip(source_ids, new_ids))
+				MetricBins.addValues(
+					session,
+					[(values.get("accuracy"), values.get("speed"), values.get("start_time")) for values in new_rows],
+					)
+				UserBests.addValues(
+					session,
+					[(values["user_name"], values.get("accuracy"), values.get("speed")) for values in new_rows],
+					)
+				sentence_rows = []
+				if sentence_columns:
+					for row in session.execute(
+						select(*[source_sentences.c[name] for name in sentence_columns])
+						.where(source_sentences.c.result_id.between(first, last))
+						).mappings():
+						if row["result_id"] not in result_ids:
+							continue
+						values = dict(row)
+						values.pop("id")
+						values["result_id"] = result_ids[values["result_id"]]
+						values["sentence_id"] = sentence_ids.get(values["sentence_id"])
+						sentence_rows.append(values)
+				if sentence_rows:
+					session.execute(insert(SentenceResults.__table__), sentence_rows)
+					SentenceStatistics.addAttempts(
+						session,
+						[SentenceResults(**values) for values in sentence_rows],
+						)
+				if weaknesses or confusions:
+					user_counts = {}
+					user_confusions = {}
+					for values in new_rows:
+						if values.get("given_ids"):
+							ids = decodeIds(values["given_ids"])
+							given_text = "\n".join(texts[id] for id in ids)
+						else:
+							given_text = values.get("given_text")
+						typed_text = values.get("typed_text")
+						if typed_text is None and values.get("typed_data") is not None:
+							typed_text = decompressText(values["typed_data"])
+						if weaknesses:
+							mergeCounts(
+								user_counts.setdefault(values["user_name"], {}),
+								UserWeaknesses.textCounts(given_text, typed_text),
+								)
+						if confusions:
+							mergeConfusions(
+								user_confusions.setdefault(values["user_name"], {}),
+								textConfusions(given_text, typed_text),
+								)
+					for user_name, counts in user_counts.items():
+						UserWeaknesses.addCounts(session, user_name, counts)
+					for user_name, counts in user_confusions.items():
+						CharacterConfusions.addCounts(session, user_name, counts)
+				if not (copy_weaknesses or copy_confusions):
+					session.commit()
+				inserted += len(new_rows)
+				logging.debug("Merged %d results from %s.", inserted, path)
+			# Copied counts are only right together with every result they came
+			# from, so they are committed along with the last batch.
+			if copy_weaknesses:
+				_copyWeaknesses(session)
+			if copy_confusions:
+				_copyConfusions(session)
+			session.commit()
+		finally:
+			session.rollback()
+			detachDatabase(session, SOURCE_SCHEMA)
+			session.close()
+	return MergeCount(path, read, inserted, duplicates, time.perf_counter() - began)
+
+
+def mergeDatabases(target: str, sources: list, **options) -> list:
+	"""Merges the results of several databases into one.
+
+	Args:
+		target: The database file to merge into, which is created if needed.
+		sources: The database files to merge from. The target itself is skipped
+			if it is listed.
+		options: Passed on to mergeDatabase.
+
+	Returns:
+		list: A MergeCount for each source merged.
+	"""
+	for source in sources:
+		if not os.path.isfile(source):
+			raise FileNotFoundError(f"{source} does not exist.")
+	engine = connect(target)
+	counts = []
+	for source in sources:
+		if os.path.exists(target) and os.path.samefile(source, target):
+			logging.warning("Not merging %s into itself.", source)
+			continue
+		count = mergeDatabase(engine, source, **options)
+		logging.info(
+			"Merged %s: %d new results, %d already stored.",
+			source,
+			count.inserted,
+			count.duplicates,
+			)
+		counts.append(count)
+	return counts
@@ -0,0 +1,181 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Timing of the program's hot paths.
+
+Timings are kept in histograms with logarithmic buckets, so recording one costs
+a few arithmetic operations and memory use does not grow however long the
+program runs. Wrap a function with timed or a block of code with timer, then
+read the results with summary or save them with dumpMetrics.
+"""
+
+from contextlib import contextmanager
+import datetime
+from functools import wraps
+import json
+import math
+import threading
+import time
+
+# Each power of 2 is split into this many buckets, so percentiles are accurate
+# to within about 19%.
+BUCKETS_PER_DOUBLING = 4
+# Buckets cover 1 microsecond up to about 1 hour.
+BUCKET_COUNT = 32 * BUCKETS_PER_DOUBLING
+
+
+class Histogram:
+	"""Counts of durations in logarithmically sized buckets."""
+
+	def __init__(self) -> None:
+		"""Initialize an empty Histogram."""
+		self.counts = [0] * BUCKET_COUNT
+		self.count = 0
+		self.total = 0.0
+		self.maximum = 0.0
+		self._lock = threading.Lock()
+
+	@staticmethod
+	def bucket(seconds: float) -> int:
+		"""Returns the index of the bucket a duration belongs in."""
+		microseconds = seconds * 1000000
+		if microseconds < 1:
+			return 0
+		mantissa, exponent = math.frexp(microseconds)
+		# mantissa is in [0.5, 1), so this splits each doubling evenly.
+		index = (exponent - 1) * BUCKETS_PER_DOUBLING \
+			+ int((mantissa * 2 - 1) * BUCKETS_PER_DOUBLING)
+		return min(index, BUCKET_COUNT - 1)
+
+	@staticmethod
+	def bucketLimit(index: int) -> float:
+		"""Returns the longest duration in seconds which falls in a bucket."""
+		exponent, part = divmod(index + 1, BUCKETS_PER_DOUBLING)
+		return 2 ** exponent * (1 + part / BUCKETS_PER_DOUBLING) / 1000000
+
+	def record(self, seconds: float) -> None:
+		"""Adds a duration to the histogram."""
+		index = self.bucket(seconds)
+		with self._lock:
+			self.counts[index] += 1
+			self.count += 1
+			self.total += seconds
+			if seconds > self.maximum:
+				self.maximum = seconds
+
+	def percentile(self, fraction: float) -> float:
+		"""Estimates the duration which fraction of the recorded durations are under.
+
+		Args:
+			fraction: A number from 0 to 1, such as 0.95 for the 95th percentile.
+
+		Returns:
+			float: The upper limit of the bucket holding that percentile, in seconds.
+		"""
+		if not self.count:
+			return 0.0
+		wanted = fraction * self.count
+		seen = 0
+		for index, count in enumerate(self.counts):
+			seen += count
+			if seen >= wanted and count:
+				return min(self.bucketLimit(index), self.maximum)
+		return self.maximum
+
+	def summary(self) -> dict:
+		"""Returns the count, mean, percentiles and maximum in seconds."""
+		return {
+			"count": self.count,
+			"mean": self.total / self.count if self.count else 0.0,
+			"p50": self.percentile(0.50),
+			"p95": self.percentile(0.95),
+			"p99": self.percentile(0.99),
+			"max": self.maximum,
+			}
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def histogram(name: str) -> Histogram:
+	"""Returns the histogram with a given name, creating it if needed."""
+	found = _histograms.get(name)
+	if found is None:
+		with _histograms_lock:
+			found = _histograms.setdefault(name, Histogram())
+	return found
+
+
+def record(name: str, seconds: float) -> None:
+	"""Records a duration in the named histogram."""
+	histogram(name).record(seconds)
+
+
+@contextmanager
+def timer(name: str):
+	"""Times the enclosed block of code into the named histogram."""
+	began = time.perf_counter()
+	try:
+		yield
+	finally:
+		histogram(name).record(time.perf_counter() - began)
+
+
+def timed(name: str):
+	"""Decorates a function so every call is timed into the named histogram."""
+	def decorator(function):
+		target = histogram(name)
+
+		@wraps(function)
+		def wrapper(*args, **kwargs):
+			began = time.perf_counter()
+			try:
+				return function(*args, **kwargs)
+			finally:
+				target.record(time.perf_counter() - began)
+		return wrapper
+	return decorator
+
+
+def summary() -> dict:
+	"""Summarizes every histogram which has recorded something.
+
+	Returns:
+		dict: Histogram summaries keyed by name.
+	"""
+	return {
+		name: found.summary()
+		for name, found in sorted(_histograms.items())
+		if found.count
+		}
+
+
+def dumpMetrics(path: str) -> None:
+	"""Saves the summary of every histogram to a JSON file.
+
+	Args:
+		path: The file to write.
+	"""
+	with open(path, "w") as metrics_file:
+		json.dump(
+			{
+				"created": datetime.datetime.now().isoformat(timespec="seconds"),
+				"metrics": summary(),
+				},
+			metrics_file,
+			indent=2,
+			)
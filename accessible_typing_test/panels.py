@@ -19,7 +19,10 @@
 import logging
 import wx
 from accessible_typing_test.dialogs import *
-from accessible_typing_test.database import session_scope, Sentences, Results
+from accessible_typing_test.dialogs import percentileText
+from accessible_typing_test.database import session_scope, Sentences, SentenceFeatures, Results
+from accessible_typing_test.export import RESULT_COLUMNS, formatResult
+from accessible_typing_test.metrics import timed
 
 
 class ResultsPanel(wx.Panel):
@@ -65,27 +68,19 @@ class ResultsPanel(wx.Panel):
 		self.Center()
 
 
+	@timed("ResultsPanel.fillTestList")
 	def fillTestList(self):
 		"""Populate the test_list with results from the database."""
 		test_list = self.test_list
 		test_list.ClearAll()
-		test_list.InsertColumn(0, "Accuracy")
-		test_list.InsertColumn(1, "Speed")
-		test_list.InsertColumn(2, "Duration")
-		test_list.InsertColumn(3, "Words")
-		test_list.InsertColumn(4, "User")
-		test_list.InsertColumn(5, "Timestamp")
-		index = test_list.GetItemCount()
-		with session_scope() as session:
-			for results in session.query(Results):
-				test_list.InsertItem(index, f"{results.accuracy}%")
-				test_list.SetItem(index, 1, f"{results.speed} WPM")
-				test_list.SetItem(index, 2, f"{results.duration} seconds")
-				test_list.SetItem(index, 3, f"{results.words}")
-				test_list.SetItem(index, 4, f"{results.user_name}")
-				test_list.SetItem(index, 5, str(results.timestamp))
-				test_list.SetItemData(index, results.id)
-				index += 1
+		for column, heading in enumerate(RESULT_COLUMNS):
+			test_list.InsertColumn(column, heading)
+		for index, row in enumerate(Results.listResults()):
+			record = formatResult(row)
+			test_list.InsertItem(index, record[0])
+			for column in range(1, len(record)):
+				test_list.SetItem(index, column, record[column])
+			test_list.SetItemData(index, row.id)
 
 	def onItemActivated(self, event:wx.ListEvent) -> None:
 		"""Handles clicks on the test results list."""
@@ -107,7 +102,7 @@ class ResultsPanel(wx.Panel):
 				f"Are you sure you want to remove the result of the test taken by {record.user_name} on {record.timestamp}?",
 				style=wx.YES_NO|wx.NO_DEFAULT
 				) == wx.YES:
-				session.delete(record)
+				Results.removeResults(session, record)
 
 
 class TestsPanel(wx.Panel):
@@ -125,10 +120,9 @@ class TestsPanel(wx.Panel):
 			name="sentence_list",
 			style=wx.LC_LIST
 			)
-		with session_scope() as session:
-			for index, sentence in enumerate(session.query(Sentences)):
-				sentence_list.InsertItem(index, sentence.sentence)
-				sentence_list.SetItemData(index, sentence.id)
+		for index, (id, sentence) in enumerate(Sentences.activeSentences()):
+			sentence_list.InsertItem(index, sentence)
+			sentence_list.SetItemData(index, id)
 		sizer.Add(sentence_list, proportion=10, flag=wx.EXPAND)
 		self.sentence_list = sentence_list
 		add_button = wx.Button(self, id=wx.ID_ANY, label="&Add")
@@ -149,7 +143,7 @@ class TestsPanel(wx.Panel):
 	def onAddSentence(self, event: wx.CommandEvent = None)-> bool:
 		"""Adds a sentence to the wx.ListCtrl on the TestsPanel."""
 		with session_scope() as session:
-			query = session.query(Sentences)
+			query = session.query(Sentences).filter(Sentences.retired.isnot(True))
 			dlg = wx.TextEntryDialog(self, message="Type the sentence to add.", caption="ADD Sentence")
 			if dlg.ShowModal() == wx.ID_OK:
 				sentence = dlg.GetValue()
@@ -159,17 +153,19 @@ class TestsPanel(wx.Panel):
 				return False
 			record = Sentences(sentence=sentence)
 			session.add(record)
+			session.flush()
+			SentenceFeatures.indexSentences(session, [record])
 		return True
 
 	def onRemoveSentence(self, event: wx.CommandEvent = None) -> bool:
 		"""Removes a sentence from the wx.ListCtrl on the TestsPanel."""
 		with session_scope() as session:
-			query = session.query(Sentences)
+			query = session.query(Sentences).filter(Sentences.retired.isnot(True))
 			sentence_list = self.sentence_list
 			sentence = sentence_list.GetItem(sentence_list.GetFirstSelected()).GetText()
 			for found_record in query.filter(Sentences.sentence == sentence):
 				record = found_record
-			session.delete(record)
+			Sentences.retireSentence(session, record)
 
 	def onSearchSentence(self, event: wx.CommandEvent) -> None:
 		"""Filters the sentence list by a search phrase."""
@@ -181,7 +177,7 @@ class TestsPanel(wx.Panel):
 		if search == "":
 			return
 		with session_scope() as session:
-			search_query = session.query(Sentences)
+			search_query = session.query(Sentences).filter(Sentences.retired.isnot(True))
 			search_column = Sentences.sentence.contains(search)
 			self.sentence_list.ClearAll()
 			for index, result in enumerate(search_query.filter(search_column)):
@@ -191,7 +187,7 @@ class TestsPanel(wx.Panel):
 					)
 
 	def onEditSentence(self, event: wx.CommandEvent) -> None:
-		"""Edit the selected sentence without changing its id."""
+		"""Edit the selected sentence, keeping its id unless results refer to it."""
 		sentence_list = self.sentence_list
 		id = sentence_list.GetItemData(sentence_list.GetFirstSelected())
 		sentence = sentence_list.GetItemText(sentence_list.GetFirstSelected())
@@ -206,53 +202,190 @@ class TestsPanel(wx.Panel):
 		with session_scope() as session:
 			record = session.query(Sentences).filter(Sentences.id == id).one()
 			if record.sentence != new_sentence:
-				record.sentence = new_sentence
+				record = Sentences.changeSentence(session, record, new_sentence)
 				sentence_list.SetItemText(sentence_list.GetFirstSelected(), new_sentence)
+				sentence_list.SetItemData(sentence_list.GetFirstSelected(), record.id)
+
+
+# The columns of the users table: heading, statistics field and format.
+USER_COLUMNS = (
+	("User", "user_name", "{}"),
+	("Tests", "tests", "{}"),
+	("Mean Accuracy", "mean_accuracy", "{:.1f}%"),
+	("Median Accuracy", "median_accuracy", "{:.1f}%"),
+	("Best Accuracy", "best_accuracy", "{:.1f}%"),
+	("Mean WPM", "mean_speed", "{:.0f}"),
+	("Median WPM", "median_speed", "{:.0f}"),
+	("Best WPM", "best_speed", "{:.0f}"),
+	("Last Test", "last_test", "{:%Y-%m-%d}"),
+	)
+# The columns of a user's weekly progress: heading, field and format.
+WEEK_COLUMNS = (
+	("Week Of", "week", "{}"),
+	("Tests", "tests", "{}"),
+	("Mean WPM", "mean_speed", "{:.0f}"),
+	("Mean Accuracy", "mean_accuracy", "{:.1f}%"),
+	("Best WPM", "best_speed", "{:.0f}"),
+	)
+# How many of a user's latest tests their recent averages cover.
+TREND_WINDOW = 10
+
+
+class UserStatisticsList(wx.ListCtrl):
+	"""A table of every user's statistics which sorts by any column.
+
+	The list is virtual, so only the rows on screen are formatted however many
+	users there are.
+	"""
+
+	def __init__(self, parent: wx.Window) -> None:
+		super().__init__(
+			parent,
+			id=wx.ID_ANY,
+			name="Users",
+			style=wx.LC_REPORT|wx.LC_VIRTUAL|wx.LC_SINGLE_SEL
+			)
+		for column, (heading, field, format) in enumerate(USER_COLUMNS):
+			self.InsertColumn(column, heading)
+		self.rows = []
+		self.sort_column = 0
+		self.descending = False
+		self.Bind(wx.EVT_LIST_COL_CLICK, self.onColumnClick)
+
+	def setRows(self, rows: list) -> None:
+		"""Shows rows from Results.allUserStatistics in the current order."""
+		self.rows = list(rows)
+		self.sortRows()
+
+	def sortRows(self) -> None:
+		"""Sorts the rows by the chosen column, leaving empty values last."""
+		field = USER_COLUMNS[self.sort_column][1]
+		present = [row for row in self.rows if getattr(row, field) is not None]
+		missing = [row for row in self.rows if getattr(row, field) is None]
+		present.sort(key=lambda row: getattr(row, field), reverse=self.descending)
+		self.rows = present + missing
+		self.SetItemCount(len(self.rows))
+		self.Refresh()
+
+	def onColumnClick(self, event: wx.ListEvent) -> None:
+		"""Sorts by the clicked column, reversing the order if it is clicked again."""
+		column = event.GetColumn()
+		if column == self.sort_column:
+			self.descending = not self.descending
+		else:
+			self.sort_column = column
+			# Larger numbers are usually wanted first, names and dates from the start.
+			self.descending = USER_COLUMNS[column][1] not in ("user_name", "last_test")
+		self.sortRows()
+
+	def OnGetItemText(self, item: int, column: int) -> str:
+		heading, field, format = USER_COLUMNS[column]
+		value = getattr(self.rows[item], field)
+		return "" if value is None else format.format(value)
 
 
 class UsersPanel(wx.Panel):
 	"""Allows for viewing of user specific statistics."""
 
 	def __init__(self, parent:wx.Notebook) -> None:
-		"""Initialize the panel with a list of users and a statistics button."""
+		"""Initialize the panel with a table of users and their statistics."""
 		super().__init__(parent=parent)
-		self.user_list = wx.ListCtrl(
-			self,
-			id=wx.ID_ANY,
-			name="Users",
-			style=wx.LC_REPORT
-			)
-		self.user_list.InsertColumn(0, "Users")
-		[self.user_list.Append(user) for user in self.users]
+		self.user_list = UserStatisticsList(self)
 		self.user_list.Bind(wx.EVT_LIST_ITEM_ACTIVATED, self.onItemActivated)
 		self.user_data = wx.TextCtrl(
 			self,
 			id=wx.ID_ANY,
 			name="userData",
-			value=f"There are {len(self.users)} users.",
 			style=wx.TE_MULTILINE|wx.TE_READONLY
 			)
+		self.week_list = wx.ListCtrl(
+			self,
+			id=wx.ID_ANY,
+			name="Weekly progress",
+			style=wx.LC_REPORT|wx.LC_SINGLE_SEL
+			)
+		for column, (heading, field, format) in enumerate(WEEK_COLUMNS):
+			self.week_list.InsertColumn(column, heading)
+		self.fillUserList()
 		self.__do_layout()
 
 	@property
 	def users(self) -> list:
 		"""Lists users in the database."""
-		with session_scope() as session:
-			return [result for result in session.query(Results.user_name).distinct()]
+		return Results.userNames()
+
+	@timed("UsersPanel.fillUserList")
+	def fillUserList(self) -> None:
+		"""Reads every user's statistics into the table."""
+		self.user_list.setRows(Results.allUserStatistics())
+		for column in range(self.user_list.GetColumnCount()):
+			self.user_list.SetColumnWidth(column, wx.LIST_AUTOSIZE_USEHEADER)
+		fastest = ", ".join(
+			f"{user_name} ({speed:.0f} WPM)" for user_name, speed in Results.leaders("speed", 5)
+			)
+		most_accurate = ", ".join(
+			f"{user_name} ({accuracy:.1f}%)"
+			for user_name, accuracy in Results.leaders("accuracy", 5)
+			)
+		self.user_data.SetValue(
+			f"There are {len(self.user_list.rows)} users.\n"
+			f"Fastest: {fastest or 'none yet'}.\n"
+			f"Most accurate: {most_accurate or 'none yet'}."
+			)
 
 	def __do_layout(self):
 		"""Lays out the controls on the panel"""
-		sizer = wx.BoxSizer(wx.HORIZONTAL)
-		sizer.Add(self.user_list, proportion=1)
-		sizer.Add(self.user_data, proportion=4, flag=wx.EXPAND)
+		sizer = wx.BoxSizer(wx.VERTICAL)
+		sizer.Add(self.user_list, proportion=4, flag=wx.EXPAND)
+		sizer.Add(self.user_data, proportion=1, flag=wx.EXPAND)
+		sizer.Add(self.week_list, proportion=2, flag=wx.EXPAND)
 		self.SetSizerAndFit(sizer)
 
 	def onItemActivated(self, event: wx.ListEvent) -> None:
-		"""Updates the user data shown when a user name is activated in the list."""
-		from sqlalchemy.sql import func
-		user = self.user_list.GetItem(event.GetIndex()).GetText()
-		with session_scope() as session:
-			count = session.query(Results).filter(Results.user_name == user).count()
-			average_accuracy = session.query(func.avg(Results.accuracy)).filter(Results.user_name == user).scalar()
-			average_speed = session.query(func.avg(Results.speed)).filter(Results.user_name == user).scalar()
-		self.user_data.SetValue(f"{user} has taken {count} tests with an average accuracy of {average_accuracy:.1f}% and an average typing speed of {average_speed:.0f} words per minute")
\ No newline at end of file
+		"""Updates the user data shown when a user is activated in the table."""
+		row = self.user_list.rows[event.GetIndex()]
+		ranks = [
+			f"Their best {name} is {text[0].lower()}{text[1:]}"
+			for name, text in (
+				("speed", percentileText("speed", row.best_speed)),
+				("accuracy", percentileText("accuracy", row.best_accuracy)),
+				)
+			if text
+			]
+		self.user_data.SetValue(
+			f"{row.user_name} has taken {row.tests} tests with an average accuracy of "
+			f"{row.mean_accuracy:.1f}% and an average typing speed of "
+			f"{row.mean_speed:.0f} words per minute. Their best accuracy is "
+			f"{row.best_accuracy:.1f}% and their best speed is {row.best_speed:.0f} "
+			"words per minute.\n" + "\n".join(ranks + [self.trendText(row.user_name)])
+			)
+		self.fillWeekList(row.user_name)
+
+	def trendText(self, user_name: str) -> str:
+		"""Compares a user's latest tests with the ones before them."""
+		trend = Results.userTrend(user_name, TREND_WINDOW)
+		if len(trend) < 2 * TREND_WINDOW:
+			return ""
+		latest, before = trend[-1], trend[-1 - TREND_WINDOW]
+		return (
+			f"Over their last {TREND_WINDOW} tests they averaged "
+			f"{latest.rolling_speed:.0f} words per minute and "
+			f"{latest.rolling_accuracy:.1f}% accuracy, against "
+			f"{before.rolling_speed:.0f} words per minute and "
+			f"{before.rolling_accuracy:.1f}% over the {TREND_WINDOW} before."
+			)
+
+	@timed("UsersPanel.fillWeekList")
+	def fillWeekList(self, user_name: str) -> None:
+		"""Shows a user's progress week by week, newest first."""
+		self.week_list.DeleteAllItems()
+		for index, row in enumerate(reversed(Results.userWeeks(user_name))):
+			for column, (heading, field, format) in enumerate(WEEK_COLUMNS):
+				value = getattr(row, field)
+				text = "" if value is None else format.format(value)
+				if column:
+					self.week_list.SetItem(index, column, text)
+				else:
+					self.week_list.InsertItem(index, text)
+		for column in range(self.week_list.GetColumnCount()):
+			self.week_list.SetColumnWidth(column, wx.LIST_AUTOSIZE_USEHEADER)
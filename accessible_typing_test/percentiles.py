@@ -0,0 +1,135 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Percentile ranks of results which stay quick however many results there are.
+
+Working out that a candidate typed faster than 82% of applicants by sorting
+every result gets slower as results pile up. Instead each metric is counted in
+fixed width bins as results are stored. A QuantileSketch made from the counts
+finds a percentile rank or the value at a percentile by adding up a few
+hundred bins, whether there are a hundred results or a million. Accuracy and
+speed are stored as whole numbers, so with bins one unit wide the ranks are
+exact.
+"""
+
+from bisect import bisect_right
+from collections import Counter
+import datetime
+
+# The lowest value counted, the highest and the width of a bin for each metric.
+# Values outside the range are counted in the first or last bin.
+METRICS = {
+	"accuracy": (0, 100, 1),
+	"speed": (0, 300, 1),
+	}
+# The cohort every result belongs to.
+ALL_RESULTS = "all"
+
+
+def binNumber(metric: str, value: float) -> int:
+	"""Returns the bin a value of a metric is counted in."""
+	low, high, width = METRICS[metric]
+	return int((min(max(value, low), high) - low) // width)
+
+
+def resultCohorts(start_time: datetime.datetime) -> list:
+	"""Returns the cohorts a result is ranked in: every result and its year."""
+	if start_time is None:
+		return [ALL_RESULTS]
+	return [ALL_RESULTS, str(start_time.year)]
+
+
+def binCounts(values, sign: int = 1) -> Counter:
+	"""Counts results into the bins of each metric and cohort.
+
+	Args:
+		values: (accuracy, speed, start_time) of each result.
+		sign: 1 to count the results or -1 to take them away.
+
+	Returns:
+		Counter: Counts keyed by (metric, cohort, bin).
+	"""
+	counts = Counter()
+	for accuracy, speed, start_time in values:
+		cohorts = resultCohorts(start_time)
+		for metric, value in (("accuracy", accuracy), ("speed", speed)):
+			if value is None:
+				continue
+			number = binNumber(metric, value)
+			for cohort in cohorts:
+				counts[(metric, cohort, number)] += sign
+	return counts
+
+
+class QuantileSketch:
+	"""How the values of one metric are spread, from counts made by binCounts."""
+
+	def __init__(self, metric: str, counts: dict = None) -> None:
+		"""Initialize a QuantileSketch.
+
+		Args:
+			metric: A key of METRICS.
+			counts: Counts keyed by bin. Bins which are not given are empty.
+		"""
+		self.metric = metric
+		self.low, self.high, self.width = METRICS[metric]
+		self.bins = sorted(number for number, count in (counts or {}).items() if count > 0)
+		self.counts = [counts[number] for number in self.bins]
+		# How many values are in the bins before each bin.
+		self.below = [0]
+		for count in self.counts:
+			self.below.append(self.below[-1] + count)
+
+	@property
+	def total(self) -> int:
+		"""How many values were counted."""
+		return self.below[-1]
+
+	def rank(self, value: float) -> float:
+		"""Returns the percentage of values lower than a value.
+
+		Values in the same bin as the value count in proportion to how far
+		through the bin the value is, so with whole numbers and bins one wide
+		only lower values count.
+
+		Returns:
+			float: From 0 to 100, or None if no values were counted.
+		"""
+		if not self.total:
+			return None
+		number = binNumber(self.metric, value)
+		position = bisect_right(self.bins, number)
+		lower = self.below[position]
+		if position and self.bins[position - 1] == number:
+			lower = self.below[position - 1]
+			start = self.low + number * self.width
+			share = min(max((value - start) / self.width, 0), 1)
+			lower += self.counts[position - 1] * share
+		return 100 * lower / self.total
+
+	def quantile(self, percent: float) -> float:
+		"""Returns the value a percentage of values are lower than.
+
+		Returns:
+			float: The start of the bin the value falls in plus how far through the
+			bin it is, or None if no values were counted.
+		"""
+		if not self.total:
+			return None
+		target = min(max(percent, 0), 100) / 100 * self.total
+		position = min(max(bisect_right(self.below, target) - 1, 0), len(self.bins) - 1)
+		share = (target - self.below[position]) / self.counts[position]
+		return self.low + (self.bins[position] + min(share, 1)) * self.width
@@ -0,0 +1,205 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A workbook for every user at once, for end of term reporting.
+
+The database is read once in this process and each user's report is handed to
+a pool of worker processes, which write the workbooks in openpyxl's write
+only mode. Writing workbooks takes far longer than reading the results, so
+the work spreads over every processor while only a few reports wait in memory
+at a time.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import datetime
+import logging
+import os
+import re
+import time
+import openpyxl
+from .confusion import GAP
+from .database import CharacterConfusions, MetricBins, Results
+from .export import RESULT_COLUMNS, formatResult
+from .metrics import record
+
+# The columns of the weekly progress sheet.
+WEEK_COLUMNS = ["Week Of", "Tests", "Mean WPM", "Mean Accuracy", "Best WPM"]
+# The columns of the mistakes sheet.
+MISTAKE_COLUMNS = ["Expected", "Typed", "Times"]
+# How many of a user's commonest mistakes are listed.
+MISTAKES_LISTED = 20
+# Characters which cannot be part of a file name on Windows.
+_UNSAFE = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
+
+
+def reportFileName(directory: str, user_name: str, taken: set = None) -> str:
+	"""Returns the workbook a user's report is written to.
+
+	Args:
+		directory: Where the workbooks are written.
+		user_name: The user the report is about.
+		taken: The names already given to other users' workbooks, in lower case,
+			which the new name is added to. Users whose names only differ in
+			characters which are not allowed in file names, or in case, are given
+			a number so that neither workbook overwrites the other.
+	"""
+	name = _UNSAFE.sub("_", user_name or "Unknown").strip(" .") or "Unknown"
+	if taken is not None:
+		unique = name
+		number = 1
+		while unique.lower() in taken:
+			number += 1
+			unique = f"{name} ({number})"
+		taken.add(unique.lower())
+		name = unique
+	return os.path.join(directory, f"{name} - Typing Test Results.xlsx")
+
+
+def userReport(user_name: str, statistics, rows: list, since=None, until=None) -> dict:
+	"""Gathers everything in a user's report from the database.
+
+	Args:
+		user_name: The user to report on.
+		statistics: The user's row from Results.allUserStatistics.
+		rows: The user's rows from Results.listResults.
+		since: Leave out results started before this.
+		until: Leave out results started at or after this.
+
+	Returns:
+		dict: The report, made only of values which can be sent to another
+		process.
+	"""
+	summary = [
+		("User", user_name),
+		("Tests", statistics.tests),
+		("Mean accuracy (%)", statistics.mean_accuracy),
+		("Median accuracy (%)", statistics.median_accuracy),
+		("Best accuracy (%)", statistics.best_accuracy),
+		("Mean speed (WPM)", statistics.mean_speed),
+		("Median speed (WPM)", statistics.median_speed),
+		("Best speed (WPM)", statistics.best_speed),
+		("Last test", statistics.last_test),
+		]
+	for label, metric, value in (
+		("Best speed is faster than (% of all results)", "speed", statistics.best_speed),
+		("Best accuracy is higher than (% of all results)", "accuracy", statistics.best_accuracy),
+		):
+		if value is not None:
+			summary.append((label, MetricBins.percentileRank(metric, value)))
+	matrix = CharacterConfusions.matrix(user_name)
+	return {
+		"user_name": user_name,
+		# Confusions are only kept as running totals, so they cover every result
+		# however the rest of the report is limited.
+		"mistakes_title": "Mistakes" if since is None and until is None else "Mistakes (All Time)",
+		"summary": summary,
+		"results": [formatResult(row) for row in rows],
+		"weeks": [tuple(week) for week in Results.userWeeks(user_name, since, until)],
+		"mistakes": [
+			(
+				"(nothing)" if expected == GAP else expected,
+				"(nothing)" if typed == GAP else typed,
+				count,
+				)
+			for expected, typed, count in matrix.confusions(MISTAKES_LISTED)
+			],
+		}
+
+
+def writeUserReport(path: str, report: dict) -> tuple:
+	"""Writes a report made by userReport to a workbook.
+
+	The workbook is written in openpyxl's write only mode, so its rows are
+	streamed to the file.
+
+	Returns:
+		tuple: The user name, the workbook and how many results it lists.
+	"""
+	workbook = openpyxl.Workbook(write_only=True)
+	sheets = (
+		("Summary", ["Statistic", "Value"], report["summary"]),
+		("Results", RESULT_COLUMNS, report["results"]),
+		("Weekly Progress", WEEK_COLUMNS, report["weeks"]),
+		(report["mistakes_title"], MISTAKE_COLUMNS, report["mistakes"]),
+		)
+	for title, columns, rows in sheets:
+		sheet = workbook.create_sheet(title)
+		sheet.append(columns)
+		for row in rows:
+			sheet.append(list(row))
+	temporary = path + ".tmp"
+	workbook.save(temporary)
+	os.replace(temporary, path)
+	return report["user_name"], path, len(report["results"])
+
+
+def writeReports(
+	directory: str,
+	since: datetime.datetime = None,
+	until: datetime.datetime = None,
+	processes: int = None,
+	) -> list:
+	"""Writes a workbook for every user with results.
+
+	Args:
+		directory: Where to write the workbooks, which is created if needed.
+		since: Leave out results started before this, reading any archives
+			covering the range.
+		until: Leave out results started at or after this.
+		processes: How many worker processes write workbooks. Defaults to one for
+			each processor. With 1 the workbooks are written in this process.
+
+	Returns:
+		list: (user name, workbook, results listed) for each workbook, in order of
+		user name.
+	"""
+	began = time.perf_counter()
+	os.makedirs(directory, exist_ok=True)
+	user_rows = {}
+	for row in Results.listResults(since=since, until=until):
+		user_rows.setdefault(row.user_name, []).append(row)
+	taken = set()
+	reports = (
+		(
+			reportFileName(directory, statistics.user_name, taken),
+			userReport(
+				statistics.user_name,
+				statistics,
+				user_rows.get(statistics.user_name, []),
+				since,
+				until,
+				),
+			)
+		for statistics in Results.allUserStatistics(since, until)
+		)
+	processes = processes or os.cpu_count() or 1
+	if processes == 1:
+		written = [writeUserReport(path, report) for path, report in reports]
+	else:
+		written = []
+		with ProcessPoolExecutor(processes) as pool:
+			pending = set()
+			for path, report in reports:
+				# Only a few reports are read ahead of the workers, which bounds memory.
+				if len(pending) >= 2 * processes:
+					done, pending = wait(pending, return_when=FIRST_COMPLETED)
+					written.extend(future.result() for future in done)
+				pending.add(pool.submit(writeUserReport, path, report))
+			written.extend(future.result() for future in pending)
+		written.sort(key=lambda report: report[0] or "")
+	record("writeReports", time.perf_counter() - began)
+	logging.info("Wrote %d reports to %s.", len(written), directory)
+	return written
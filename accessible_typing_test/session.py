@@ -0,0 +1,297 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The logic of a single typing test, independent of any user interface.
+
+A TypingSession chooses sentences, counts what is typed, decides when the test
+is over and scores it. The TypingDialog only displays what the session tells it
+to, which means a test can also be driven headless by the simulator, the
+benchmarks and the unit tests. A SentencePrefetcher can stand between a session
+and a slow sentence source so the next sentence is always ready.
+"""
+
+from collections import namedtuple
+import datetime
+import logging
+import queue
+import threading
+from typing import Callable, Optional
+from .lev import levenshteinDistance
+
+# Keys which are not counted as typed characters: nothing, backspace, tab and
+# enter.
+IGNORED_KEYS = (0, 8, 9, 13)
+
+# Marks the end of the sentences in a SentencePrefetcher's queue.
+_END = object()
+
+# The score of one sentence of a test.
+SentenceScore = namedtuple(
+	"SentenceScore",
+	["sentence_id", "given", "typed", "edit_distance", "characters", "seconds"],
+	)
+
+
+class TypingSession:
+	"""Runs one typing test for one user."""
+
+	def __init__(
+		self,
+		user_name: str,
+		sentence_source: Callable[[set], object],
+		word_count: int = 10,
+		clock: Callable[[], datetime.datetime] = datetime.datetime.now,
+		station: str = None,
+		) -> None:
+		"""Initialize a TypingSession.
+
+		Args:
+			user_name: The name of the person taking the test.
+			sentence_source: Called with the set of sentence ids already used in this
+				test and returns an object with id and sentence attributes, such as a
+				Sentences record, or None when there are no sentences left.
+			word_count: The test ends once more than this many words are typed.
+			clock: Returns the current time. Simulations pass their own clock.
+			station: The name of the computer the test is taken on.
+		"""
+		self.user_name = user_name
+		self.station = station
+		self.word_count = word_count
+		self._sentence_source = sentence_source
+		self._clock = clock
+		self.used_sentences = set()
+		self.given_ids = []
+		self.given_list = []
+		self.typed_list = []
+		self.enter_times = []
+		self.scores = []
+		self.typed_count = 0
+		self.typed_character_count = 0
+		self.start_time = None
+		self.end_time = None
+		self.finished = False
+
+	@property
+	def sentence(self) -> Optional[str]:
+		"""The sentence which is currently being typed."""
+		if self.finished or not self.given_list:
+			return None
+		return self.given_list[-1]
+
+	def start(self) -> Optional[str]:
+		"""Starts the clock and returns the first sentence to type."""
+		self.start_time = self._clock()
+		return self.nextSentence()
+
+	def nextSentence(self) -> Optional[str]:
+		"""Gets the next unused sentence from the sentence source.
+
+		Returns:
+			str: The new sentence, or None if the source has run out of sentences in
+			which case the test is finished.
+		"""
+		record = self._sentence_source(self.used_sentences)
+		if record is None:
+			self.finished = True
+			return None
+		self.used_sentences.add(record.id)
+		self.given_ids.append(record.id)
+		self.given_list.append(record.sentence)
+		return record.sentence
+
+	def keyPressed(self, key: int) -> None:
+		"""Counts a key press if it produced a printable character.
+
+		Args:
+			key: The unicode key code which was pressed.
+		"""
+		if key not in IGNORED_KEYS:
+			self.typed_character_count += 1
+
+	def enter(self, typed: str) -> Optional[str]:
+		"""Submits the text typed for the current sentence.
+
+		Args:
+			typed: Everything typed since the last time enter was pressed.
+
+		Returns:
+			str: The next sentence to type, or None if the test is finished.
+		"""
+		self.typed_list.append(typed.strip())
+		self.typed_count += len(self.typed_list[-1].split())
+		self.end_time = self._clock()
+		self.enter_times.append(self.end_time)
+		if self.typed_count <= self.word_count:
+			return self.nextSentence()
+		self.finished = True
+		return None
+
+	def finish(self) -> None:
+		"""Ends the test early, for instance because time ran out."""
+		if self.end_time is None:
+			self.end_time = self._clock()
+		self.finished = True
+
+	def scoreSentences(self) -> list:
+		"""Scores each typed sentence against the sentence it was given for.
+
+		Each pair is compared on its own, so mistakes in one sentence can not shift
+		the comparison of the next and the cost grows only with the number of
+		sentences.
+
+		Returns:
+			list: A SentenceScore for each typed sentence, also kept in scores.
+		"""
+		self.scores = []
+		previous_time = self.start_time
+		for sentence_id, given, typed, enter_time in zip(
+			self.given_ids,
+			self.given_list,
+			self.typed_list,
+			self.enter_times,
+			):
+			self.scores.append(SentenceScore(
+				sentence_id,
+				given,
+				typed,
+				levenshteinDistance(given, typed),
+				max(len(given), len(typed)),
+				(enter_time - previous_time).total_seconds(),
+				))
+			previous_time = enter_time
+		return self.scores
+
+	def calculateResults(self) -> dict:
+		"""Compares the typed and given text and returns a results dictionary.
+
+		Returns:
+			dict: keys are the columns of the results table and sentences, a list
+			of the columns of the sentence_results table for each sentence. The
+			dictionary is empty if nothing was typed.
+		"""
+		if not self.typed_character_count:
+			return {}
+		results = {}
+		typed = "\n".join(self.typed_list)
+		given = "\n".join(self.given_list[0:len(self.typed_list)])
+		scores = self.scoreSentences()
+		# An edit distance is never more than the length of the longer string, so
+		# accuracy stays between 0 and 100.
+		count = sum(score.characters for score in scores)
+		results['user_name'] = self.user_name
+		results["station"] = self.station
+		results["start_time"] = self.start_time
+		results['end_time'] = self.end_time
+		results['edit_distance'] = sum(score.edit_distance for score in scores)
+		results['accuracy'] = \
+			int((count - results['edit_distance']) / count * 100) if count else 0
+		logging.debug(
+			"Scored %d sentences with an edit distance of %d in %d characters.",
+			len(scores),
+			results['edit_distance'],
+			count,
+			)
+		duration = results['end_time'] - results['start_time']
+		results["duration"] = duration.seconds
+		results["words"] = self.typed_count
+		results["speed"] = int(results["words"] / (duration.total_seconds() / 60))
+		results["timestamp"] = results["end_time"].strftime("%m/%d/%y %I:%M %p")
+		results['given_text'] = given
+		results['typed_text'] = typed
+		results["sentences"] = [
+			{
+				"position": position,
+				"sentence_id": score.sentence_id,
+				"typed_text": score.typed,
+				"edit_distance": score.edit_distance,
+				"characters": score.characters,
+				"seconds": score.seconds,
+				}
+			for position, score in enumerate(scores)
+			]
+		return results
+
+
+class SentencePrefetcher(threading.Thread):
+	"""Draws the next few sentences of a test in the background.
+
+	The prefetcher is itself a sentence source. It keeps track of every sentence
+	it has drawn, so it never draws one twice, and hands them out in order.
+	"""
+
+	def __init__(self, sentence_source: Callable[[set], object], size: int = 3) -> None:
+		"""Initialize a SentencePrefetcher.
+
+		Args:
+			sentence_source: The source to draw sentences from, as for a
+				TypingSession. It is only ever called from the prefetcher's thread.
+			size: How many sentences to keep ready.
+		"""
+		super().__init__(name="SentencePrefetcher", daemon=True)
+		self._sentence_source = sentence_source
+		self._queue = queue.Queue(maxsize=size)
+		self._drawn = set()
+		self._stopping = threading.Event()
+
+	def __call__(self, used: set):
+		"""Returns the next sentence, waiting only if none is ready yet.
+
+		Returns:
+			The next record, or None once the source has run out or the
+			prefetcher has been stopped.
+		"""
+		if self.ident is None:
+			self.start()
+		while not self._stopping.is_set():
+			try:
+				record = self._queue.get(timeout=0.1)
+			except queue.Empty:
+				if self.is_alive():
+					continue
+				# The thread may have queued its last record just before it ended.
+				try:
+					record = self._queue.get_nowait()
+				except queue.Empty:
+					return None
+			if record is _END:
+				# Leave the marker for any later call.
+				self._queue.put(_END)
+				return None
+			return record
+		return None
+
+	def run(self) -> None:
+		"""Keeps the queue full until the source runs out or the prefetcher stops."""
+		while not self._stopping.is_set():
+			try:
+				record = self._sentence_source(set(self._drawn))
+			except Exception:
+				logging.exception("Could not draw the next sentence.")
+				record = None
+			if record is not None:
+				self._drawn.add(record.id)
+			while not self._stopping.is_set():
+				try:
+					self._queue.put(_END if record is None else record, timeout=0.1)
+					break
+				except queue.Full:
+					continue
+			if record is None:
+				return
+
+	def stop(self) -> None:
+		"""Stops drawing sentences, and giving them out."""
+		self._stopping.set()
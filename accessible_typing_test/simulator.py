@@ -0,0 +1,298 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Simulated typists for generating realistic load on the results database.
+
+A SimulatedTypist types sentences at a configurable speed with configurable
+mistakes and pauses. Simulated tests are run through a TypingSession on a
+simulated clock and stored exactly the way the TypingDialog stores them, so
+runStations can show how many stations one database file can serve.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import datetime
+import logging
+import math
+import random
+import string
+import time
+from .database import connect, Sentences, Results
+from .session import TypingSession
+
+PAUSE_DISTRIBUTIONS = ("lognormal", "exponential", "none")
+
+
+class SimulatedClock:
+	"""A clock which only moves when it is told to."""
+
+	def __init__(self, now: datetime.datetime = None) -> None:
+		"""Initialize the clock.
+
+		Args:
+			now: The time to start at. Defaults to the real current time.
+		"""
+		self.now = now or datetime.datetime.now()
+
+	def __call__(self) -> datetime.datetime:
+		"""Returns the current simulated time."""
+		return self.now
+
+	def advance(self, seconds: float) -> None:
+		"""Moves the clock forward.
+
+		Args:
+			seconds: How far to move the clock.
+		"""
+		self.now += datetime.timedelta(seconds=seconds)
+
+
+class SimulatedTypist:
+	"""Types sentences with human-like speed, mistakes and pauses."""
+
+	def __init__(
+		self,
+		user_name: str,
+		wpm: float = 40,
+		error_rate: float = 0.02,
+		pause_mean: float = 1.5,
+		pause_distribution: str = "lognormal",
+		seed: int = None,
+		) -> None:
+		"""Initialize a SimulatedTypist.
+
+		Args:
+			user_name: The name stored with this typist's results.
+			wpm: Typing speed in words per minute, counting 5 characters as a word.
+			error_rate: The chance that any one character is mistyped.
+			pause_mean: The average number of seconds spent reading each sentence
+				before typing it.
+			pause_distribution: One of PAUSE_DISTRIBUTIONS.
+			seed: Seeds this typist's random numbers so runs can be repeated.
+		"""
+		if pause_distribution not in PAUSE_DISTRIBUTIONS:
+			raise ValueError(f"Unknown pause distribution {repr(pause_distribution)}.")
+		self.user_name = user_name
+		self.wpm = max(wpm, 1)
+		self.error_rate = error_rate
+		self.pause_mean = pause_mean
+		self.pause_distribution = pause_distribution
+		self.random = random.Random(seed)
+
+	def pause(self) -> float:
+		"""Returns the number of seconds spent reading before typing a sentence."""
+		if self.pause_distribution == "none" or self.pause_mean <= 0:
+			return 0.0
+		if self.pause_distribution == "exponential":
+			return self.random.expovariate(1 / self.pause_mean)
+		# Pick mu so the mean of the log-normal distribution is pause_mean.
+		sigma = 0.5
+		mu = math.log(self.pause_mean) - sigma ** 2 / 2
+		return self.random.lognormvariate(mu, sigma)
+
+	def mistype(self, sentence: str) -> str:
+		"""Returns sentence with mistakes typed at this typist's error rate.
+
+		Mistakes are substituted, dropped, doubled or swapped characters.
+		"""
+		typed = []
+		characters = list(sentence)
+		index = 0
+		while index < len(characters):
+			character = characters[index]
+			if self.random.random() >= self.error_rate:
+				typed.append(character)
+			else:
+				mistake = self.random.randrange(4)
+				if mistake == 0:
+					typed.append(self.random.choice(string.ascii_lowercase))
+				elif mistake == 1:
+					pass
+				elif mistake == 2:
+					typed.append(character * 2)
+				elif index + 1 < len(characters):
+					typed.append(characters[index + 1] + character)
+					index += 1
+				else:
+					typed.append(character)
+			index += 1
+		return "".join(typed)
+
+	def typingTime(self, text: str) -> float:
+		"""Returns the number of seconds it takes to type text."""
+		characters_per_second = self.wpm * 5 / 60
+		# Speed varies a little from one sentence to the next.
+		return len(text) / characters_per_second * self.random.uniform(0.85, 1.15)
+
+	def takeTest(
+		self,
+		sentence_source,
+		word_count: int = 10,
+		clock: SimulatedClock = None,
+		) -> dict:
+		"""Takes a whole typing test.
+
+		Args:
+			sentence_source: Where the TypingSession gets its sentences from.
+			word_count: The word count setting of the test.
+			clock: The simulated clock, which is advanced as the test is typed.
+
+		Returns:
+			dict: The results dictionary calculated by the TypingSession.
+		"""
+		clock = clock or SimulatedClock()
+		session = TypingSession(
+			self.user_name,
+			sentence_source=sentence_source,
+			word_count=word_count,
+			clock=clock,
+			)
+		sentence = session.start()
+		while sentence is not None:
+			clock.advance(self.pause())
+			typed = self.mistype(sentence)
+			for character in typed:
+				session.keyPressed(ord(character))
+			clock.advance(self.typingTime(typed))
+			sentence = session.enter(typed)
+		return session.calculateResults()
+
+
+def runStation(
+	station: int,
+	tests: int,
+	typists: int = 5,
+	wpm: float = 40,
+	wpm_spread: float = 10,
+	error_rate: float = 0.02,
+	pause_mean: float = 1.5,
+	pause_distribution: str = "lognormal",
+	word_count: int = 10,
+	database: str = None,
+	seed: int = None,
+	) -> dict:
+	"""Runs simulated tests on one station and stores their results.
+
+	Results are written with Results.storeResults, just like the ResultsWriter
+	used by TypingDialog.storeResults, and the time spent writing each one is
+	measured.
+
+	Args:
+		station: The number of the station, used in the typists' names.
+		tests: How many tests to run.
+		typists: How many different typists take turns at this station.
+		wpm: The average typing speed of the typists.
+		wpm_spread: The standard deviation of the typists' speeds.
+		error_rate: The average chance of mistyping a character.
+		pause_mean: The average pause before typing each sentence.
+		pause_distribution: One of PAUSE_DISTRIBUTIONS.
+		word_count: The word count setting of the tests.
+		database: The database file to write to.
+		seed: Seeds the random numbers so runs can be repeated.
+
+	Returns:
+		dict: The number of tests stored and failed and the seconds taken by each
+		write.
+	"""
+	if database is not None:
+		connect(database)
+	chooser = random.Random(seed)
+	people = [
+		SimulatedTypist(
+			f"Station {station} Typist {number}",
+			wpm=chooser.gauss(wpm, wpm_spread),
+			error_rate=max(0.0, chooser.gauss(error_rate, error_rate / 2)),
+			pause_mean=pause_mean,
+			pause_distribution=pause_distribution,
+			seed=chooser.randrange(2 ** 32),
+			)
+		for number in range(typists)
+		]
+	clock = SimulatedClock()
+	write_times = []
+	failed = 0
+	for test in range(tests):
+		typist = people[test % len(people)]
+		results_dict = typist.takeTest(Sentences.unusedSentence, word_count, clock)
+		if not results_dict:
+			continue
+		results_dict["station"] = f"Station {station}"
+		began = time.perf_counter()
+		try:
+			Results.storeResults([results_dict])
+		except Exception:
+			logging.exception("Station %d failed to store a result.", station)
+			failed += 1
+			continue
+		write_times.append(time.perf_counter() - began)
+	return {"stored": len(write_times), "failed": failed, "write_times": write_times}
+
+
+def percentile(values: list, fraction: float) -> float:
+	"""Returns the value below which fraction of the sorted values fall."""
+	if not values:
+		return 0.0
+	index = min(len(values) - 1, int(fraction * len(values)))
+	return values[index]
+
+
+def runStations(stations: int, database: str, seed: int = None, **options) -> dict:
+	"""Runs many simulated stations at once against one database file.
+
+	Each station runs in its own process with its own database connection, as
+	separate lab computers would. Simulated time does not wait, so every station
+	writes as fast as it can, which is the worst case for lock contention.
+
+	Args:
+		stations: How many stations to simulate.
+		database: The database file shared by all stations.
+		seed: Seeds the random numbers so runs can be repeated.
+		**options: Passed on to runStation.
+
+	Returns:
+		dict: Throughput in tests per second and write latencies in seconds.
+	"""
+	connect(database)
+	if not Sentences.randomSentence():
+		Sentences.fillSentences()
+	chooser = random.Random(seed)
+	began = time.perf_counter()
+	with ProcessPoolExecutor(max_workers=stations) as executor:
+		futures = [
+			executor.submit(
+				runStation,
+				station,
+				database=database,
+				seed=chooser.randrange(2 ** 32),
+				**options
+				)
+			for station in range(1, stations + 1)
+			]
+		outcomes = [future.result() for future in futures]
+	elapsed = time.perf_counter() - began
+	write_times = sorted(t for outcome in outcomes for t in outcome["write_times"])
+	stored = sum(outcome["stored"] for outcome in outcomes)
+	return {
+		"stations": stations,
+		"stored": stored,
+		"failed": sum(outcome["failed"] for outcome in outcomes),
+		"seconds": elapsed,
+		"tests_per_second": stored / elapsed if elapsed else 0.0,
+		"write_mean": sum(write_times) / len(write_times) if write_times else 0.0,
+		"write_p50": percentile(write_times, 0.50),
+		"write_p95": percentile(write_times, 0.95),
+		"write_p99": percentile(write_times, 0.99),
+		"write_max": write_times[-1] if write_times else 0.0,
+		}
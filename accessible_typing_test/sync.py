@@ -0,0 +1,264 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Copies the results a station stores to a collector in the background.
+
+A station which keeps its own database can still send everything to a
+collector. A SyncClient runs an asyncio event loop in its own thread, next to
+the wx main loop, and sends results which have not been synced in batches over
+one connection which is kept open between batches. Each batch carries an
+idempotency key made from the results in it, so a batch sent again after a
+lost reply is answered from the collector's memory. When the collector cannot
+be reached the client waits longer after each failure, up to a limit.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+import urllib.parse
+from sqlalchemy.exc import SQLAlchemyError
+from .database import Results
+from .metrics import record
+from .writer import encodeResults
+
+
+class CollectorError(OSError):
+	"""The collector replied, but did not store the results.
+
+	Unlike a ConnectionError this is not a closed connection, so the batch is
+	not sent again straight away.
+	"""
+
+	def __init__(self, status: int, message: str) -> None:
+		super().__init__(f"The collector replied {status}: {message}")
+		self.status = status
+
+
+def idempotencyKey(results_dicts: list) -> str:
+	"""Makes a key which is the same whenever the same results are sent."""
+	digest = hashlib.sha256()
+	for results_dict in results_dicts:
+		digest.update(
+			repr((
+				results_dict.get("station"),
+				results_dict.get("user_name"),
+				results_dict.get("start_time"),
+				)).encode("utf-8")
+			)
+	return digest.hexdigest()
+
+
+class SyncClient(threading.Thread):
+	"""A background thread which sends unsynced results to a collector."""
+
+	def __init__(
+		self,
+		url: str,
+		station: str = None,
+		batch_size: int = 100,
+		interval: float = 60,
+		timeout: float = 30,
+		max_delay: float = 300,
+		) -> None:
+		"""Initialize a SyncClient.
+
+		Args:
+			url: The address of the collector, such as http://proctor:8470.
+			station: The station name given to results stored without one.
+			batch_size: The most results to send in one request.
+			interval: How many seconds to wait between looks for results when the
+				client is not woken.
+			timeout: How many seconds to wait for the collector.
+			max_delay: The most seconds to wait before trying a collector which
+				could not be reached again.
+		"""
+		super().__init__(name="SyncClient", daemon=True)
+		parts = urllib.parse.urlsplit(url)
+		if parts.scheme != "http" or not parts.hostname:
+			raise ValueError(f"{url} is not an http address.")
+		self.host = parts.hostname
+		self.port = parts.port or 80
+		self.path = parts.path.rstrip("/") + "/results"
+		self.station = station
+		self.batch_size = batch_size
+		self.interval = interval
+		self.timeout = timeout
+		self.max_delay = max_delay
+		self._loop = None
+		self._wake = None
+		self._ready = threading.Event()
+		self._stopping = False
+		self._reader = None
+		self._writer = None
+
+	def wake(self) -> None:
+		"""Asks the client to look for results to send now. Safe from any thread."""
+		if self._ready.is_set():
+			self._loop.call_soon_threadsafe(self._wake.set)
+
+	def stop(self, timeout: float = None) -> None:
+		"""Sends every unsynced result it can and then stops the thread.
+
+		Args:
+			timeout: The most seconds to wait. Results not sent by then are sent
+				the next time a client runs.
+		"""
+		self._stopping = True
+		if not self.is_alive():
+			return
+		self._ready.wait(timeout)
+		self.wake()
+		self.join(timeout)
+
+	def run(self) -> None:
+		asyncio.run(self._main())
+
+	async def _main(self) -> None:
+		"""Sends batches until stopped, backing off while the collector is away."""
+		self._loop = asyncio.get_running_loop()
+		self._wake = asyncio.Event()
+		self._ready.set()
+		delay = 0
+		try:
+			while True:
+				try:
+					sent = await self.syncBatch()
+				except (OSError, EOFError, asyncio.TimeoutError, ValueError, SQLAlchemyError) as error:
+					await self._close()
+					if self._stopping:
+						break
+					delay = min(max(delay * 2, 1), self.max_delay)
+					logging.warning(
+						"Could not sync results with the collector: %s. "
+						"Trying again in %.0f seconds.",
+						error,
+						delay,
+						)
+					# Jitter keeps a room of stations from retrying in step.
+					await self._sleep(delay * random.uniform(0.5, 1))
+					continue
+				delay = 0
+				if sent < self.batch_size:
+					if self._stopping:
+						break
+					await self._sleep(self.interval)
+		finally:
+			await self._close()
+
+	async def _sleep(self, seconds: float) -> None:
+		"""Waits for a number of seconds or until the client is woken."""
+		try:
+			await asyncio.wait_for(self._wake.wait(), seconds)
+		except asyncio.TimeoutError:
+			pass
+		self._wake.clear()
+
+	async def syncBatch(self) -> int:
+		"""Sends the oldest unsynced results and marks them synced.
+
+		Returns:
+			int: How many results were sent.
+		"""
+		loop = asyncio.get_running_loop()
+		# The database is used from the executor, as asyncio.to_thread needs Python 3.9.
+		batch = await loop.run_in_executor(None, Results.unsyncedResults, self.batch_size)
+		if not batch:
+			return 0
+		ids = [id for id, results_dict in batch]
+		results_dicts = [results_dict for id, results_dict in batch]
+		for results_dict in results_dicts:
+			if results_dict.get("station") is None:
+				results_dict["station"] = self.station
+		began = time.perf_counter()
+		await self._post(
+			encodeResults({"results": results_dicts}).encode("utf-8"),
+			idempotencyKey(results_dicts),
+			)
+		record("SyncClient.batch", time.perf_counter() - began)
+		await loop.run_in_executor(None, Results.markSynced, ids)
+		logging.debug("Synced %d results with the collector.", len(ids))
+		return len(ids)
+
+	async def _post(self, body: bytes, key: str) -> dict:
+		"""Sends a batch, opening the connection again if the old one was closed.
+
+		Only a connection which was closed or reset is tried again here. Any
+		other failure is left to the backoff in _main.
+		"""
+		reused = self._writer is not None
+		try:
+			return await asyncio.wait_for(self._exchange(body, key), self.timeout)
+		except (ConnectionError, EOFError):
+			if not reused:
+				raise
+		# The collector closed the connection while it was idle.
+		await self._close()
+		return await asyncio.wait_for(self._exchange(body, key), self.timeout)
+
+	async def _exchange(self, body: bytes, key: str) -> dict:
+		"""Sends one HTTP request and reads the reply.
+
+		Raises:
+			ConnectionError: The collector closed the connection.
+			CollectorError: The collector replied with a status other than 200.
+		"""
+		if self._writer is None:
+			self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+		self._writer.write(
+			(
+				f"POST {self.path} HTTP/1.1\r\n"
+				f"Host: {self.host}:{self.port}\r\n"
+				"Content-Type: application/json\r\n"
+				f"Content-Length: {len(body)}\r\n"
+				f"Idempotency-Key: {key}\r\n"
+				"\r\n"
+				).encode("ascii") + body
+			)
+		await self._writer.drain()
+		status_line = await self._reader.readline()
+		parts = status_line.split(None, 2)
+		if len(parts) < 2:
+			raise ConnectionError("The collector closed the connection.")
+		headers = {}
+		while True:
+			line = await self._reader.readline()
+			if line in (b"\r\n", b"\n", b""):
+				break
+			name, separator, value = line.decode("latin-1").partition(":")
+			headers[name.strip().lower()] = value.strip()
+		body = await self._reader.readexactly(int(headers.get("content-length", 0)))
+		if headers.get("connection", "").lower() == "close":
+			await self._close()
+		status = int(parts[1])
+		if status != 200:
+			# Error pages need not be JSON, so the body is only shown, not decoded.
+			await self._close()
+			raise CollectorError(status, body[:200].decode("utf-8", "replace"))
+		return json.loads(body)
+
+	async def _close(self) -> None:
+		"""Closes the connection to the collector if it is open."""
+		writer, self._reader, self._writer = self._writer, None, None
+		if writer is not None:
+			writer.close()
+			try:
+				await writer.wait_closed()
+			except OSError:
+				pass
@@ -14,11 +14,398 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import datetime
+import os
+import tempfile
 from unittest import TestCase
 import accessible_typing_test
+from accessible_typing_test.collector import storeUploads
+from accessible_typing_test.database import (
+	archiveYears,
+	CharacterConfusions,
+	connect,
+	decodeIds,
+	disconnect,
+	rolloverResults,
+	MetricBins,
+	session_scope,
+	Results,
+	Sentences,
+	SentenceFeatures,
+	SentenceResults,
+	SentenceStatistics,
+	UserBests,
+	UserWeaknesses,
+	)
+from accessible_typing_test.merge import mergeDatabases
+
+
+def resultsDict(user_name="tester", distances=(0, 4), start=None):
+	"""Makes a results dictionary for two sentences typed in 10 seconds each."""
+	start = start or datetime.datetime(2019, 4, 7, 9, 0, 0)
+	return {
+		"user_name": user_name,
+		"start_time": start,
+		"end_time": start + datetime.timedelta(seconds=20),
+		"duration": 20,
+		"accuracy": 90,
+		"edit_distance": sum(distances),
+		"speed": 30,
+		"words": 10,
+		"timestamp": start.strftime("%m/%d/%y %I:%M %p"),
+		"given_text": "One two three four five.\nSix seven eight nine ten.",
+		"typed_text": "One two three four five.\nSix seven eight nine ten.",
+		"sentences": [
+			{
+				"position": position,
+				"sentence_id": position + 1,
+				"typed_text": "One two three four five.",
+				"edit_distance": distance,
+				"characters": 20,
+				"seconds": 10.0,
+				}
+			for position, distance in enumerate(distances)
+			],
+		}
+
 
 class TestResultsDatabase(TestCase):
-	"""Runs tests on the ResultsDatabase class."""
-	
-	pass
-	
\ No newline at end of file
+	"""Runs tests on the database in a scratch file."""
+
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		connect(os.path.join(self.directory.name, "test_results.dat"))
+		with session_scope() as session:
+			session.add(Sentences(id=1, sentence="One two three four five."))
+			session.add(Sentences(id=2, sentence="Six seven eight nine ten."))
+
+	def tearDown(self):
+		disconnect()
+		self.directory.cleanup()
+
+	def test_store_sentences(self):
+		"""Each typed sentence is stored with its result."""
+		ids = Results.storeResults([resultsDict()])
+		with session_scope() as session:
+			results = session.get(Results, ids[0])
+			self.assertEqual(
+				[sentence.edit_distance for sentence in results.sentence_results],
+				[0, 4],
+				)
+
+	def test_store_once(self):
+		"""A result from a station is only stored once."""
+		results_dict = dict(resultsDict(), station="Station 1")
+		first = Results.storeResults([results_dict, results_dict])
+		second = Results.storeResults([results_dict])
+		self.assertEqual(first, second * 2)
+		with session_scope() as session:
+			self.assertEqual(session.query(Results).count(), 1)
+
+	def test_station_sentences(self):
+		"""Sentences uploaded by a station are found by their text, not its ids."""
+		results_dict = dict(resultsDict(), station="Station 1")
+		for sentence in results_dict["sentences"]:
+			sentence["sentence_id"] += 40
+		results_dict["sentences"].append(dict(results_dict["sentences"][0], position=5))
+		ids = storeUploads([results_dict])
+		with session_scope() as session:
+			results = session.get(Results, ids[0])
+			self.assertEqual(
+				[sentence.sentence_id for sentence in results.sentence_results],
+				[1, 2, None],
+				)
+			self.assertEqual(results.given_text, resultsDict()["given_text"])
+
+	def test_query_cache(self):
+		"""Read queries are kept in memory until a commit changes their tables."""
+		Results.storeResults([resultsDict()])
+		listed = Results.listResults()
+		self.assertIs(Results.listResults(), listed)
+		sentences = Sentences.activeSentences()
+		Results.storeResults([resultsDict("learner")])
+		self.assertEqual(len(Results.listResults()), 2)
+		self.assertEqual(Results.userNames(), ["learner", "tester"])
+		self.assertEqual(Results.userStatistics("learner")[0], 1)
+		self.assertIs(Sentences.activeSentences(), sentences)
+		with session_scope() as session:
+			Sentences.retireSentence(session, session.get(Sentences, 2))
+		self.assertEqual([row.id for row in Sentences.activeSentences()], [1])
+
+	def test_all_user_statistics(self):
+		"""Every user's statistics are found in one query."""
+		start = datetime.datetime(2019, 4, 7, 9, 0, 0)
+		results_dicts = [resultsDict("learner", start=start)]
+		for minutes, (accuracy, speed) in enumerate([(80, 20), (90, 40), (95, 30), (70, 50)]):
+			results_dict = resultsDict(start=start + datetime.timedelta(minutes=minutes))
+			results_dict.update(accuracy=accuracy, speed=speed)
+			results_dicts.append(results_dict)
+		Results.storeResults(results_dicts)
+		learner, tester = Results.allUserStatistics()
+		self.assertEqual((learner.user_name, learner.tests, learner.median_speed), ("learner", 1, 30))
+		self.assertEqual(tester.tests, 4)
+		self.assertAlmostEqual(tester.mean_accuracy, 83.75)
+		self.assertAlmostEqual(tester.median_accuracy, 85)
+		self.assertAlmostEqual(tester.median_speed, 35)
+		self.assertEqual((tester.best_accuracy, tester.best_speed), (95, 50))
+		self.assertEqual(tester.last_test, start + datetime.timedelta(minutes=3))
+		self.assertEqual(tuple(tester[1:3]), tuple(Results.userStatistics("tester")[:2]))
+
+	def test_percentile_ranks(self):
+		"""Percentile ranks follow results as they are stored and removed."""
+		start = datetime.datetime(2019, 4, 7, 9, 0, 0)
+		results_dicts = []
+		for minutes, speed in enumerate([20, 40, 30, 50]):
+			results_dict = resultsDict(
+				f"user {speed}",
+				start=start + datetime.timedelta(minutes=minutes),
+				)
+			results_dict["speed"] = speed
+			results_dicts.append(results_dict)
+		ids = Results.storeResults(results_dicts)
+		self.assertEqual(MetricBins.percentileRank("speed", 40), 50)
+		self.assertEqual(MetricBins.percentileRank("speed", 40, "2019"), 50)
+		self.assertIsNone(MetricBins.percentileRank("speed", 40, "2020"))
+		self.assertEqual(Results.leaders("speed", 2), [("user 50", 50), ("user 40", 40)])
+		with session_scope() as session:
+			Results.removeResults(session, session.get(Results, ids[0]))
+		self.assertAlmostEqual(MetricBins.percentileRank("speed", 40), 100 / 3)
+		columns = (MetricBins.metric, MetricBins.cohort, MetricBins.bin, MetricBins.count)
+		with session_scope() as session:
+			counts = session.query(*columns).filter(MetricBins.count != 0).order_by(*columns).all()
+			MetricBins.rebuild(session)
+		with session_scope() as session:
+			self.assertEqual(session.query(*columns).order_by(*columns).all(), counts)
+
+	def test_leaders(self):
+		"""Leaders are read from bests which follow results as they are stored and removed."""
+		start = datetime.datetime(2019, 4, 7, 9, 0, 0)
+		results_dicts = [resultsDict("old", start=datetime.datetime(2017, 6, 1))]
+		results_dicts[0]["speed"] = 90
+		for minutes, (user_name, speed) in enumerate([("slow", 20), ("fast", 50), ("fast", 40), ("steady", 40)]):
+			results_dict = resultsDict(user_name, start=start + datetime.timedelta(minutes=minutes))
+			results_dict["speed"] = speed
+			results_dicts.append(results_dict)
+		ids = Results.storeResults(results_dicts)
+		self.assertEqual(Results.leaders("speed", 2), [("old", 90), ("fast", 50)])
+		rolloverResults(datetime.datetime(2019, 1, 1))
+		self.assertEqual(Results.leaders("speed", 2), [("fast", 50), ("steady", 40)])
+		self.assertEqual(Results.leaders("speed", year=2017), [("old", 90)])
+		with session_scope() as session:
+			Results.removeResults(session, session.get(Results, ids[2]))
+		# Ties are listed in order of user name.
+		self.assertEqual(Results.leaders("speed"), [("fast", 40), ("steady", 40), ("slow", 20)])
+		self.assertEqual(Results.leaders("accuracy", 1), [("fast", 90)])
+		columns = (UserBests.user_name, UserBests.best_accuracy, UserBests.best_speed)
+		with session_scope() as session:
+			bests = session.query(*columns).order_by(UserBests.user_name).all()
+			UserBests.rebuild(session)
+		with session_scope() as session:
+			self.assertEqual(session.query(*columns).order_by(UserBests.user_name).all(), bests)
+
+	def test_user_trend(self):
+		"""Rolling averages and weekly progress are worked out in SQL."""
+		# A Saturday, so the tests fall in two weeks.
+		start = datetime.datetime(2019, 4, 6, 9, 0, 0)
+		results_dicts = []
+		for days, speed in enumerate([20, 40, 30, 50]):
+			results_dict = resultsDict(start=start + datetime.timedelta(days=days))
+			results_dict["speed"] = speed
+			results_dicts.append(results_dict)
+		Results.storeResults(results_dicts + [resultsDict("learner")])
+		trend = Results.userTrend("tester", window=2)
+		self.assertEqual([row.speed for row in trend], [20, 40, 30, 50])
+		self.assertEqual([row.rolling_speed for row in trend], [20, 30, 35, 40])
+		weeks = Results.userWeeks("tester")
+		self.assertEqual([(row.week, row.tests) for row in weeks], [("2019-04-01", 2), ("2019-04-08", 2)])
+		self.assertEqual([row.mean_speed for row in weeks], [30, 40])
+
+	def test_character_confusions(self):
+		"""Confusions follow results as they are stored and can be counted again."""
+		results_dict = resultsDict()
+		results_dict["typed_text"] = "One two three four five.\nSix sevem eight nine ten."
+		ids = Results.storeResults([results_dict, resultsDict("learner")])
+		self.assertEqual(CharacterConfusions.matrix("tester").confusions(), [("n", "m", 1)])
+		self.assertEqual(CharacterConfusions.matrix().count("O", "O"), 2)
+		with session_scope() as session:
+			self.assertEqual(CharacterConfusions.rebuild(session), 2)
+		self.assertEqual(CharacterConfusions.matrix("tester").confusions(), [("n", "m", 1)])
+		with session_scope() as session:
+			Results.removeResults(session, session.get(Results, ids[0]))
+		self.assertEqual(CharacterConfusions.matrix("tester").confusions(), [])
+		self.assertEqual(CharacterConfusions.matrix().count("O", "O"), 1)
+
+	def test_sentence_statistics(self):
+		"""Statistics follow results as they are stored and removed."""
+		ids = Results.storeResults([resultsDict(), resultsDict(distances=(2, 0))])
+		with session_scope() as session:
+			statistics = session.get(SentenceStatistics, 1)
+			self.assertEqual(statistics.attempts, 2)
+			self.assertAlmostEqual(statistics.mean_error_rate, 0.05)
+			self.assertAlmostEqual(statistics.mean_wpm, 30)
+		hardest = SentenceStatistics.hardestSentences()
+		self.assertEqual([row.id for row in hardest], [2, 1])
+		with session_scope() as session:
+			Results.removeResults(session, session.get(Results, ids[1]))
+		with session_scope() as session:
+			self.assertEqual(session.get(SentenceStatistics, 1).attempts, 1)
+			self.assertAlmostEqual(session.get(SentenceStatistics, 1).mean_error_rate, 0)
+			self.assertEqual(session.query(SentenceResults).count(), 2)
+
+	def test_sentence_features(self):
+		"""Imported sentences are indexed and can be drawn by level."""
+		count = Sentences.fillSentences()
+		with session_scope() as session:
+			self.assertEqual(SentenceFeatures.indexSentences(session), 2)
+			self.assertEqual(session.query(SentenceFeatures).count(), count)
+		index = SentenceFeatures.loadIndex()
+		self.assertEqual(len(index), count)
+		self.assertEqual(sorted(index.levels), [1, 2, 3, 4, 5])
+		entry = index.draw(set(), level=1)
+		self.assertEqual(entry.level, 1)
+
+	def test_user_weaknesses(self):
+		"""A loaded profile keeps up with results as they are stored and removed."""
+		profile = UserWeaknesses.profile("tester")
+		self.assertEqual(profile.weakest()[0], [])
+		results_dict = resultsDict(distances=(0, 1))
+		results_dict["sentences"][1]["typed_text"] = "Six seven eight nine tan."
+		results_dict["typed_text"] = "One two three four five.\nSix seven eight nine tan."
+		ids = Results.storeResults([results_dict])
+		self.assertEqual(profile.counts["e"][1], 1)
+		self.assertIn("e", profile.weakest()[0])
+		with session_scope() as session:
+			errors = session.get(UserWeaknesses, ("tester", "en")).errors
+			self.assertEqual(errors, 1)
+			Results.removeResults(session, session.get(Results, ids[0]))
+		self.assertEqual(profile.counts["e"], [0, 0])
+
+	def test_profile_during_change(self):
+		"""A profile read while its counts are being changed is not kept stale."""
+		with session_scope() as session:
+			UserWeaknesses.addCounts(session, "tester", {"e": [1, 1]})
+			self.assertEqual(UserWeaknesses.profile("tester").counts, {})
+		profile = UserWeaknesses.profile("tester")
+		self.assertEqual(profile.counts["e"], [1, 1])
+		self.assertIs(UserWeaknesses.profile("tester"), profile)
+		with session_scope() as session:
+			UserWeaknesses.addCounts(session, "tester", {"e": [1, 0]})
+		self.assertEqual(profile.counts["e"], [2, 1])
+
+	def test_compact_texts(self):
+		"""Given text is kept as sentence ids and typed text is compressed."""
+		ids = Results.storeResults([resultsDict()])
+		with session_scope() as session:
+			results = session.get(Results, ids[0])
+			self.assertEqual(results.given_ids, "1,2")
+			self.assertIsNone(results.stored_given_text)
+			self.assertIsInstance(results.typed_data, bytes)
+			self.assertEqual(results.given_text, resultsDict()["given_text"])
+			self.assertEqual(results.typed_text, resultsDict()["typed_text"])
+			# Changing a sentence which has been given leaves the result as it was.
+			changed = Sentences.changeSentence(session, session.get(Sentences, 2), "Changed.")
+			self.assertNotEqual(changed.id, 2)
+			self.assertTrue(session.get(Sentences, 2).retired)
+			self.assertEqual(results.given_text, resultsDict()["given_text"])
+
+	def test_compact_old_results(self):
+		"""Results stored as plain text are moved to the compact form."""
+		legacy = resultsDict()
+		del legacy["sentences"]
+		legacy["given_text"] = "One two three four five.\nA sentence since removed."
+		with session_scope() as session:
+			session.execute(Results.__table__.insert(), [legacy])
+		self.assertEqual(Results.compactResults(), 1)
+		self.assertEqual(Results.compactResults(), 0)
+		with session_scope() as session:
+			results = session.query(Results).one()
+			self.assertEqual(results.given_text, legacy["given_text"])
+			self.assertEqual(results.typed_text, legacy["typed_text"])
+			self.assertIsNone(results.stored_typed_text)
+			removed = session.get(Sentences, decodeIds(results.given_ids)[1])
+			self.assertTrue(removed.retired)
+
+	def test_rollover(self):
+		"""Old results move to yearly archives which are read for older ranges."""
+		Results.storeResults([
+			resultsDict(start=datetime.datetime(year, 6, 1))
+			for year in (2017, 2017, 2018, 2019)
+			])
+		self.assertEqual(rolloverResults(datetime.datetime(2019, 1, 1)), {2017: 2, 2018: 1})
+		self.assertEqual(archiveYears(), [2017, 2018])
+		self.assertEqual(len(Results.listResults()), 1)
+		self.assertEqual(len(Results.listResults(since=datetime.datetime(2018, 1, 1))), 2)
+		self.assertEqual(Results.userStatistics("tester", since=datetime.datetime(2017, 1, 1))[0], 4)
+		with session_scope() as session:
+			self.assertEqual(session.query(SentenceResults).count(), 2)
+			# The counts kept from results only count the one left.
+			self.assertEqual(session.get(SentenceStatistics, 1).attempts, 1)
+			self.assertEqual(MetricBins.sketch("speed").total, 1)
+			self.assertEqual(
+				{row.key: row.attempts for row in session.query(UserWeaknesses)}["O"],
+				1,
+				)
+			self.assertEqual(CharacterConfusions.matrix("tester").count("O", "O"), 1)
+
+	def test_rollover_unsynced(self):
+		"""Results a syncing station has not sent to the collector yet are not archived."""
+		ids = Results.storeResults([
+			resultsDict(start=datetime.datetime(2017, 6, day)) for day in (1, 2, 3)
+			])
+		Results.markSynced(ids[:1])
+		self.assertEqual(rolloverResults(datetime.datetime(2019, 1, 1), keep_unsynced=True), {2017: 1})
+		self.assertEqual([id for id, results_dict in Results.unsyncedResults(10)], ids[1:])
+
+	def test_merge(self):
+		"""Merging station databases adds each result once, with its sentences."""
+		station = os.path.join(self.directory.name, "station-1.dat")
+		connect(station)
+		with session_scope() as session:
+			session.add(Sentences(id=1, sentence="Six seven eight nine ten."))
+			session.add(Sentences(id=2, sentence="One two three four five."))
+		Results.storeResults([resultsDict(start=datetime.datetime(2019, 4, day)) for day in (1, 2)])
+		target = os.path.join(self.directory.name, "test_results.dat")
+		counts = mergeDatabases(target, [station, station])
+		self.assertEqual([(count.inserted, count.duplicates) for count in counts], [(2, 0), (0, 2)])
+		with session_scope() as session:
+			results = session.query(Results).order_by(Results.id).all()
+			self.assertEqual([results.station for results in results], ["station-1", "station-1"])
+			self.assertEqual(results[0].given_ids, "2,1")
+			self.assertEqual(results[0].given_text, "Six seven eight nine ten.\nOne two three four five.")
+			self.assertEqual(len(results[1].sentence_results), 2)
+			self.assertEqual(session.get(SentenceStatistics, 2).attempts, 2)
+			self.assertTrue(session.query(UserWeaknesses).count())
+		self.assertEqual(Results.leaders("speed"), [("tester", 30)])
+
+	def test_merge_again(self):
+		"""A merge which fails partway can be run again without counting anything twice."""
+		station = os.path.join(self.directory.name, "station-1.dat")
+		connect(station)
+		with session_scope() as session:
+			session.add(Sentences(id=1, sentence="One two three four five."))
+			session.add(Sentences(id=2, sentence="Six seven eight nine ten."))
+		Results.storeResults([resultsDict(start=datetime.datetime(2019, 4, day)) for day in (1, 2)])
+		with session_scope() as session:
+			weaknesses = {tuple(row) for row in session.query(
+				UserWeaknesses.key, UserWeaknesses.attempts, UserWeaknesses.errors
+				)}
+			confusions = {tuple(row) for row in session.query(
+				CharacterConfusions.expected, CharacterConfusions.typed, CharacterConfusions.count
+				)}
+			# The second result names a sentence which the station does not have.
+			session.query(Results).filter(Results.id == 2).update({"given_ids": "1,99"})
+		target = os.path.join(self.directory.name, "test_results.dat")
+		with self.assertRaises(KeyError):
+			mergeDatabases(target, [station], batch_size=1)
+		connect(station)
+		with session_scope() as session:
+			session.query(Results).filter(Results.id == 2).update({"given_ids": "1,2"})
+		counts = mergeDatabases(target, [station], batch_size=1)
+		self.assertEqual(counts[0].inserted, 2)
+		with session_scope() as session:
+			self.assertEqual({tuple(row) for row in session.query(
+				UserWeaknesses.key, UserWeaknesses.attempts, UserWeaknesses.errors
+				)}, weaknesses)
+			self.assertEqual({tuple(row) for row in session.query(
+				CharacterConfusions.expected, CharacterConfusions.typed, CharacterConfusions.count
+				)}, confusions)
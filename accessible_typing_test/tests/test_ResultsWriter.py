@@ -0,0 +1,155 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import os
+import tempfile
+import threading
+from unittest import TestCase
+import accessible_typing_test
+
+RESULTS = {
+	"user_name": "tester",
+	"start_time": datetime.datetime(2019, 4, 7, 9, 0, 0),
+	"end_time": datetime.datetime(2019, 4, 7, 9, 1, 0),
+	"accuracy": 98,
+	}
+
+
+class TestResultsWriter(TestCase):
+	"""Results must reach the store exactly once, even after a crash."""
+
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.stored = []
+		self.notified = []
+
+	def tearDown(self):
+		self.directory.cleanup()
+
+	def store(self, batch):
+		self.stored.extend(batch)
+		return list(range(len(self.stored) - len(batch), len(self.stored)))
+
+	def writer(self):
+		return accessible_typing_test.writer.ResultsWriter(
+			self.directory.name,
+			store=self.store,
+			notify=lambda callback, *args: callback(*args),
+			batch_delay=0.01,
+			)
+
+	def test_round_trip(self):
+		"""Dates and times survive being spooled."""
+		encoded = accessible_typing_test.writer.encodeResults(RESULTS)
+		self.assertEqual(accessible_typing_test.writer.decodeResults(encoded), RESULTS)
+
+	def test_submit(self):
+		"""Submitted results are stored, notified and removed from the spool."""
+		writer = self.writer()
+		writer.start()
+		writer.submit(RESULTS, callback=self.notified.append)
+		writer.stop(timeout=5)
+		self.assertEqual(self.stored, [RESULTS])
+		self.assertEqual(self.notified, [[0]])
+		self.assertEqual(os.listdir(self.directory.name), [])
+
+	def test_replay(self):
+		"""Results spooled but never stored are stored by the next writer."""
+		self.writer().spool(RESULTS)
+		writer = self.writer()
+		self.assertEqual(writer.replaySpool(), 1)
+		writer.start()
+		writer.stop(timeout=5)
+		self.assertEqual(self.stored, [RESULTS])
+		self.assertEqual(os.listdir(self.directory.name), [])
+
+	def test_poison_result(self):
+		"""A result which cannot be stored is quarantined without holding up the rest."""
+		def store(batch):
+			if any(results_dict["accuracy"] is None for results_dict in batch):
+				raise ValueError("No accuracy.")
+			return self.store(batch)
+		writer = accessible_typing_test.writer.ResultsWriter(
+			self.directory.name,
+			store=store,
+			notify=lambda callback, *args: callback(*args),
+			batch_delay=0.01,
+			)
+		writer.submit(RESULTS, callback=self.notified.append)
+		poison = writer.submit(dict(RESULTS, accuracy=None), callback=self.notified.append)
+		writer.submit(RESULTS, callback=self.notified.append)
+		writer.start()
+		writer.stop(timeout=5)
+		self.assertEqual(self.stored, [RESULTS, RESULTS])
+		self.assertEqual(self.notified, [[0, 1]])
+		self.assertEqual(os.listdir(self.directory.name), ["quarantine"])
+		self.assertEqual(os.listdir(writer.quarantine_directory), [os.path.basename(poison)])
+
+	def test_corrupt_spool(self):
+		"""A spool file which cannot be read is quarantined and the rest replayed."""
+		self.writer().spool(RESULTS)
+		with open(os.path.join(self.directory.name, "0-truncated.json"), "w") as spool_file:
+			spool_file.write('{"user_name": "tes')
+		writer = self.writer()
+		self.assertEqual(writer.replaySpool(), 1)
+		writer.start()
+		writer.stop(timeout=5)
+		self.assertEqual(self.stored, [RESULTS])
+		self.assertEqual(os.listdir(writer.quarantine_directory), ["0-truncated.json"])
+
+	def test_outage(self):
+		"""Results wait in the spool for as long as the store cannot be reached."""
+		failures = []
+		stored = threading.Event()
+		def store(batch):
+			if len(failures) < 12:
+				failures.append(batch)
+				raise OSError("The collector cannot be reached.")
+			stored.set()
+			return self.store(batch)
+		writer = accessible_typing_test.writer.ResultsWriter(
+			self.directory.name,
+			store=store,
+			notify=lambda callback, *args: callback(*args),
+			batch_delay=0.01,
+			retry_delay=0.001,
+			max_retry_delay=0.01,
+			)
+		writer.submit(RESULTS, callback=self.notified.append)
+		writer.submit(RESULTS, callback=self.notified.append)
+		writer.start()
+		self.assertTrue(stored.wait(5))
+		writer.stop(timeout=5)
+		self.assertEqual(len(failures), 12)
+		self.assertEqual(self.stored, [RESULTS, RESULTS])
+		self.assertEqual(self.notified, [[0, 1]])
+		self.assertEqual(os.listdir(self.directory.name), [])
+
+	def test_stop_during_outage(self):
+		"""Results which cannot be stored when the writer stops stay in the spool."""
+		def store(batch):
+			raise OSError("The collector cannot be reached.")
+		writer = accessible_typing_test.writer.ResultsWriter(
+			self.directory.name,
+			store=store,
+			batch_delay=0.01,
+			)
+		path = writer.submit(RESULTS)
+		writer.start()
+		writer.stop(timeout=5)
+		self.assertFalse(writer.is_alive())
+		self.assertEqual(os.listdir(self.directory.name), [os.path.basename(path)])
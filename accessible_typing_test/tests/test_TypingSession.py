@@ -0,0 +1,152 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import namedtuple
+import datetime
+import threading
+from unittest import TestCase
+import accessible_typing_test
+
+Sentence = namedtuple("Sentence", ["id", "sentence"])
+
+SENTENCES = [
+	Sentence(1, "The quick red fox jumped over the lazy brown dog."),
+	Sentence(2, "Pack my box with five dozen liquor jugs."),
+	Sentence(3, "How vexingly quick daft zebras jump."),
+	]
+
+
+def source(used: set) -> Sentence:
+	"""Returns the first sentence which has not been used."""
+	for sentence in SENTENCES:
+		if sentence.id not in used:
+			return sentence
+	return None
+
+
+class FakeClock:
+	"""A clock which moves forward 10 seconds each time it is read."""
+
+	def __init__(self):
+		self.now = datetime.datetime(2019, 4, 7, 9, 0, 0)
+
+	def __call__(self):
+		self.now += datetime.timedelta(seconds=10)
+		return self.now
+
+
+class TestTypingSession(TestCase):
+	"""Drive typing tests without any user interface."""
+
+	def typeSentence(self, session, text):
+		"""Press a key for every character in text then press enter."""
+		for character in text:
+			session.keyPressed(ord(character))
+		return session.enter(text)
+
+	def test_sentences_are_not_repeated(self):
+		"""Each sentence is given at most once in a test."""
+		session = accessible_typing_test.session.TypingSession(
+			"tester", source, word_count=100, clock=FakeClock()
+			)
+		sentence = session.start()
+		while sentence is not None:
+			sentence = self.typeSentence(session, sentence)
+		self.assertTrue(session.finished)
+		self.assertEqual(session.given_list, [s.sentence for s in SENTENCES])
+
+	def test_word_count_ends_test(self):
+		"""The test ends once more than word_count words are typed."""
+		session = accessible_typing_test.session.TypingSession(
+			"tester", source, word_count=5, clock=FakeClock()
+			)
+		self.assertIsNone(self.typeSentence(session, session.start()))
+		self.assertTrue(session.finished)
+
+	def test_accurate_results(self):
+		"""Typing a sentence exactly scores 100% accuracy."""
+		session = accessible_typing_test.session.TypingSession(
+			"tester", source, word_count=5, clock=FakeClock()
+			)
+		sentence = session.start()
+		while sentence is not None:
+			sentence = self.typeSentence(session, sentence)
+		results = session.calculateResults()
+		self.assertEqual(results["user_name"], "tester")
+		self.assertEqual(results["edit_distance"], 0)
+		self.assertEqual(results["accuracy"], 100)
+		self.assertEqual(results["duration"], 10)
+		self.assertEqual(results["speed"], 60)
+
+	def test_sentences_scored_separately(self):
+		"""A dropped word in one sentence does not count against the next."""
+		session = accessible_typing_test.session.TypingSession(
+			"tester", source, word_count=10, clock=FakeClock()
+			)
+		first = session.start()
+		self.typeSentence(session, first.replace("quick ", ""))
+		second = session.sentence
+		self.assertIsNone(self.typeSentence(session, second))
+		results = session.calculateResults()
+		self.assertEqual([score.edit_distance for score in session.scores], [6, 0])
+		self.assertEqual([score.seconds for score in session.scores], [10, 10])
+		self.assertEqual(session.scores[1].sentence_id, 2)
+		self.assertEqual(results["edit_distance"], 6)
+		characters = len(first) + len(second)
+		self.assertEqual(results["accuracy"], int((characters - 6) / characters * 100))
+
+	def test_nothing_typed(self):
+		"""There are no results when nothing was typed."""
+		session = accessible_typing_test.session.TypingSession(
+			"tester", source, clock=FakeClock()
+			)
+		session.start()
+		session.finish()
+		self.assertEqual(session.calculateResults(), {})
+
+	def test_prefetched_sentences(self):
+		"""Sentences drawn in the background come out in order, then run out."""
+		prefetcher = accessible_typing_test.session.SentencePrefetcher(source, size=2)
+		session = accessible_typing_test.session.TypingSession(
+			"tester", prefetcher, word_count=100, clock=FakeClock()
+			)
+		sentence = session.start()
+		while sentence is not None:
+			sentence = self.typeSentence(session, sentence)
+		self.assertEqual(session.given_list, [s.sentence for s in SENTENCES])
+		self.assertIsNone(prefetcher(set()))
+		prefetcher.join(1)
+		self.assertFalse(prefetcher.is_alive())
+
+	def test_stopped_prefetcher(self):
+		"""A stopped prefetcher ends even with a full queue and gives out no more sentences."""
+		prefetcher = accessible_typing_test.session.SentencePrefetcher(source, size=1)
+		self.assertEqual(prefetcher(set()), SENTENCES[0])
+		prefetcher.stop()
+		prefetcher.join(1)
+		self.assertFalse(prefetcher.is_alive())
+		self.assertIsNone(prefetcher(set()))
+
+	def test_waiting_prefetcher(self):
+		"""Stopping a prefetcher wakes a call which is waiting for a sentence."""
+		drawing = threading.Event()
+		def slowSource(used):
+			drawing.set()
+			threading.Event().wait(5)
+			return None
+		prefetcher = accessible_typing_test.session.SentencePrefetcher(slowSource)
+		threading.Thread(target=lambda: drawing.wait(5) and prefetcher.stop()).start()
+		self.assertIsNone(prefetcher(set()))
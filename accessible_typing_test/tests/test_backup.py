@@ -0,0 +1,59 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sqlite3
+import tempfile
+from unittest import TestCase
+from accessible_typing_test.backup import backupDatabase, listBackups, rotateBackups
+
+
+class TestBackup(TestCase):
+	"""Backups are complete copies and only the newest are kept."""
+
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self.directory.name, "test_results.dat")
+		self.backups = os.path.join(self.directory.name, "backups")
+		with sqlite3.connect(self.path) as connection:
+			connection.execute("CREATE TABLE results (id INTEGER PRIMARY KEY, user_name TEXT)")
+			connection.executemany(
+				"INSERT INTO results (user_name) VALUES (?)",
+				[(f"User {number}",) for number in range(5000)],
+				)
+
+	def tearDown(self):
+		self.directory.cleanup()
+
+	def test_backup(self):
+		"""The backup holds everything in the database."""
+		backup = backupDatabase(self.path, self.backups, pages=4)
+		self.assertEqual(listBackups(self.path, self.backups), [backup])
+		connection = sqlite3.connect(backup)
+		self.assertEqual(connection.execute("SELECT COUNT(*) FROM results").fetchone()[0], 5000)
+		connection.close()
+
+	def test_rotate(self):
+		"""Only the newest backups are kept."""
+		os.makedirs(self.backups)
+		for day in range(1, 5):
+			open(os.path.join(self.backups, f"test_results-2019040{day}-090000.bak"), "w").close()
+		removed = rotateBackups(self.path, self.backups, keep=2)
+		self.assertEqual([os.path.basename(path) for path in removed], [
+			"test_results-20190401-090000.bak",
+			"test_results-20190402-090000.bak",
+			])
+		self.assertEqual(len(listBackups(self.path, self.backups)), 2)
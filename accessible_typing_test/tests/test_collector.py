@@ -0,0 +1,96 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import http.client
+import json
+import threading
+from unittest import TestCase
+from urllib.parse import urlsplit
+from accessible_typing_test.collector import CollectorSink, ResultsCollector, UploadQueue
+from accessible_typing_test.writer import encodeResults
+
+RESULTS = {
+	"user_name": "tester",
+	"station": "Station 1",
+	"start_time": datetime.datetime(2019, 4, 7, 9, 0, 0),
+	"accuracy": 98,
+	}
+
+
+class TestCollector(TestCase):
+	"""Stations send results to a collector which stores them in batches."""
+
+	def setUp(self):
+		self.stored = []
+		self.collector = ResultsCollector(port=0, store=self.store)
+		self.thread = threading.Thread(target=self.collector.serve_forever, daemon=True)
+		self.thread.start()
+
+	def tearDown(self):
+		self.collector.shutdown()
+		self.collector.server_close()
+
+	def store(self, batch):
+		self.stored.extend(batch)
+		return list(range(len(self.stored) - len(batch), len(self.stored)))
+
+	def test_upload(self):
+		"""Uploads are stored with their dates and given back their own ids."""
+		sink = CollectorSink(self.collector.url, timeout=5)
+		self.assertEqual(sink([RESULTS, RESULTS]), [0, 1])
+		self.assertEqual(sink([RESULTS]), [2])
+		self.assertEqual(self.stored, [RESULTS] * 3)
+
+	def test_repeated_upload(self):
+		"""A repeated upload on a kept alive connection is answered without storing it again."""
+		address = urlsplit(self.collector.url)
+		connection = http.client.HTTPConnection(address.hostname, address.port, timeout=5)
+		body = encodeResults({"results": [RESULTS]}).encode("utf-8")
+		try:
+			for i in range(3):
+				connection.request(
+					"POST", "/results", body,
+					{"Content-Type": "application/json", "Idempotency-Key": "upload-1"},
+					)
+				response = connection.getresponse()
+				self.assertEqual(response.status, 200)
+				self.assertEqual(json.loads(response.read()), {"ids": [0]})
+		finally:
+			connection.close()
+		self.assertEqual(self.stored, [RESULTS])
+
+	def test_bad_upload(self):
+		"""An upload which cannot be stored does not fail the others in its batch."""
+		def store(batch):
+			if any(results_dict.get("accuracy") is None for results_dict in batch):
+				raise ValueError("No accuracy.")
+			return self.store(batch)
+		uploads = UploadQueue(store=store)
+		good = uploads.submit([RESULTS])
+		bad = uploads.submit([dict(RESULTS, accuracy=None)])
+		uploads.start()
+		uploads.stop(5)
+		self.assertEqual(good.result(0), [0])
+		with self.assertRaises(ValueError):
+			bad.result(0)
+		self.assertEqual(self.stored, [RESULTS])
+
+	def test_failed_store(self):
+		"""A station is told when its results could not be stored."""
+		self.collector.uploads._store = lambda batch: 1 / 0
+		with self.assertRaises(OSError):
+			CollectorSink(self.collector.url, timeout=5)([RESULTS])
@@ -0,0 +1,50 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from unittest import TestCase
+from accessible_typing_test.confusion import confusionCounts, textConfusions, ConfusionMatrix, GAP
+
+
+class TestConfusion(TestCase):
+	"""Make sure mistakes are counted against the characters they were made in."""
+
+	def test_confusion_counts(self):
+		"""Substitutions, drops and insertions are each counted."""
+		counts = confusionCounts("the cat", "teh caat")
+		self.assertEqual(counts[("t", "t")], 2)
+		self.assertEqual(sum(counts.values()), 8)
+		self.assertEqual(
+			textConfusions("ab\ncd", "ab\ncx"),
+			{("a", "a"): 1, ("b", "b"): 1, ("c", "c"): 1, ("d", "x"): 1},
+			)
+
+	def test_matrix(self):
+		"""The matrix reports the commonest mistakes, drops and insertions."""
+		matrix = ConfusionMatrix({
+			("a", "a"): 6,
+			("a", "s"): 3,
+			("e", GAP): 2,
+			(GAP, "x"): 1,
+			})
+		self.assertEqual(matrix.count("a", "s"), 3)
+		self.assertEqual(matrix.count("q", "a"), 0)
+		self.assertAlmostEqual(matrix.errorRate("a"), 1 / 3)
+		self.assertEqual(
+			matrix.confusions(),
+			[("a", "s", 3), ("e", GAP, 2), (GAP, "x", 1)],
+			)
+		self.assertEqual(matrix.drops(), {"e": 2})
+		self.assertEqual(matrix.insertions(), {"x": 1})
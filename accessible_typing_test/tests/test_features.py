@@ -0,0 +1,109 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+from unittest import TestCase
+from accessible_typing_test.features import (
+	difficultyLevels,
+	sentenceFeatures,
+	splitBigrams,
+	IndexedSentence,
+	SentenceIndex,
+	)
+
+
+class TestSentenceFeatures(TestCase):
+	"""Make sure sentences are described and drawn by difficulty."""
+
+	def test_features(self):
+		"""Densities and bigrams are worked out from the sentence."""
+		features = sentenceFeatures("Ab, 12.")
+		self.assertEqual(features.length, 7)
+		self.assertEqual(features.words, 2)
+		self.assertAlmostEqual(features.punctuation, 2 / 7)
+		self.assertAlmostEqual(features.capitals, 1 / 7)
+		self.assertAlmostEqual(features.digits, 2 / 7)
+		self.assertEqual(splitBigrams(features.bigrams), [" 1", ", ", "12", "2.", "Ab", "b,"])
+		self.assertGreater(features.difficulty, sentenceFeatures("ab cd").difficulty)
+
+	def test_levels(self):
+		"""Levels hold about as many sentences each, easiest first."""
+		self.assertEqual(difficultyLevels([5, 1, 4, 2, 3], levels=5), [5, 1, 4, 2, 3])
+		self.assertEqual(difficultyLevels([3.0, 1.0, 2.0, 0.5], levels=2), [2, 1, 2, 1])
+
+	def test_draw(self):
+		"""Draws keep to the level and never repeat a used sentence."""
+		index = SentenceIndex(
+			[
+				IndexedSentence(id, f"Sentence {id}.", 2, id % 2 + 1, "")
+				for id in range(10)
+				],
+			random.Random(0),
+			)
+		source = index.source(2)
+		used = set()
+		for draw in range(5):
+			entry = source(used)
+			self.assertEqual(entry.level, 2)
+			self.assertNotIn(entry.id, used)
+			used.add(entry.id)
+		self.assertIsNone(source(used))
+		self.assertIsNotNone(index.draw(used))
+
+	def test_plan(self):
+		"""Planned tests add up to the word count without repeating sentences."""
+		chooser = random.Random(0)
+		index = SentenceIndex(
+			[
+				IndexedSentence(id, f"Sentence {id}.", chooser.randint(5, 12), 1, "")
+				for id in range(200)
+				],
+			chooser,
+			)
+		for word_count in (5, 17, 40, 123):
+			plan = index.planTest(word_count, used={0, 1})
+			self.assertEqual(plan.words, word_count)
+			ids = [entry.id for entry in plan.entries]
+			self.assertEqual(len(ids), len(set(ids)))
+			self.assertNotIn(0, ids)
+		plan = index.planTest(3, tolerance=1)
+		self.assertEqual(plan.words, 5)
+		used = set()
+		for entry in plan.entries:
+			self.assertEqual(plan(used), entry)
+			used.add(entry.id)
+		self.assertIsNone(plan(used))
+
+	def test_plan_prefers_draw(self):
+		"""A test too short for drawing sentences is still made of drawn sentences."""
+		chooser = random.Random(0)
+		entries = [
+			IndexedSentence(id, f"Sentence {id}.", chooser.randint(3, 7), 1, "")
+			for id in range(200)
+			]
+		index = SentenceIndex(entries, chooser)
+		favourites = [entry for entry in entries if entry.id % 10 == 0]
+		drawn = []
+		def draw(used):
+			unused = [entry for entry in favourites if entry.id not in used]
+			entry = chooser.choice(unused) if unused else None
+			drawn.append(entry)
+			return entry
+		for attempt in range(5):
+			plan = index.planTest(10, draw=draw)
+			self.assertEqual(plan.words, 10)
+			self.assertTrue(all(entry in favourites for entry in plan.entries))
+		self.assertTrue(drawn)
@@ -40,3 +40,10 @@ class TestLevenshteinDistance(TestCase):
 		"""What happens when the arguments are integers?"""
 		with self.assertRaises(TypeError):
 			distance = accessible_typing_test.lev.levenshteinDistance(0, 1)
+
+	def test_alignment(self):
+		"""Aligned characters show where the edits were made."""
+		pairs = accessible_typing_test.lev.alignStrings("the cat", "teh caat")
+		self.assertEqual(sum(given != typed for given, typed in pairs), 3)
+		self.assertEqual("".join(given for given, typed in pairs), "the cat")
+		self.assertEqual("".join(typed for given, typed in pairs), "teh caat")
@@ -0,0 +1,71 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sqlite3
+import tempfile
+from unittest import TestCase
+from accessible_typing_test.database import connect, disconnect
+from accessible_typing_test.maintenance import runMaintenance
+
+
+class TestMaintenance(TestCase):
+	"""Maintenance gives free space back and only vacuums in full when asked."""
+
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self.directory.name, "test_results.dat")
+		connection = sqlite3.connect(self.path)
+		connection.execute("CREATE TABLE results (id INTEGER PRIMARY KEY, typed_text TEXT)")
+		connection.executemany(
+			"INSERT INTO results (typed_text) VALUES (?)",
+			[("x" * 500,) for number in range(2000)],
+			)
+		connection.execute("DELETE FROM results WHERE id > 100")
+		connection.commit()
+		connection.close()
+
+	def tearDown(self):
+		self.directory.cleanup()
+
+	def test_maintenance(self):
+		"""Free pages are given back and later vacuums are incremental."""
+		before = os.path.getsize(self.path)
+		tasks = runMaintenance(self.path)
+		self.assertEqual([task.name for task in tasks], ["quick_check", "vacuum", "analyze"])
+		self.assertEqual(tasks[0].detail, "ok")
+		# A full vacuum locks out every station, so it is never done unasked.
+		self.assertEqual(os.path.getsize(self.path), before)
+		runMaintenance(self.path, full=True)
+		self.assertLess(os.path.getsize(self.path), before / 2)
+		connection = sqlite3.connect(self.path)
+		self.assertEqual(connection.execute("PRAGMA auto_vacuum").fetchone()[0], 2)
+		connection.execute("DELETE FROM results")
+		connection.commit()
+		connection.close()
+		runMaintenance(self.path)
+		connection = sqlite3.connect(self.path)
+		self.assertEqual(connection.execute("PRAGMA freelist_count").fetchone()[0], 0)
+		connection.close()
+
+	def test_new_database(self):
+		"""A database made by connect vacuums incrementally from the start."""
+		path = os.path.join(self.directory.name, "new_results.dat")
+		connect(path)
+		disconnect()
+		connection = sqlite3.connect(path)
+		self.assertEqual(connection.execute("PRAGMA auto_vacuum").fetchone()[0], 2)
+		connection.close()
@@ -0,0 +1,52 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from unittest import TestCase
+import accessible_typing_test
+
+
+class TestHistogram(TestCase):
+	"""Make sure timings are counted and summarized sensibly."""
+
+	def test_empty(self):
+		"""An empty histogram summarizes to zeros."""
+		histogram = accessible_typing_test.metrics.Histogram()
+		self.assertEqual(histogram.summary()["count"], 0)
+		self.assertEqual(histogram.percentile(0.5), 0.0)
+
+	def test_percentiles(self):
+		"""Percentiles are within one bucket of the true value."""
+		histogram = accessible_typing_test.metrics.Histogram()
+		for milliseconds in range(1, 1001):
+			histogram.record(milliseconds / 1000)
+		summary = histogram.summary()
+		self.assertEqual(summary["count"], 1000)
+		self.assertAlmostEqual(summary["mean"], 0.5005)
+		self.assertEqual(summary["max"], 1.0)
+		self.assertGreaterEqual(summary["p50"], 0.5)
+		self.assertLess(summary["p50"], 0.5 * 1.25)
+		self.assertGreaterEqual(summary["p99"], 0.99)
+		self.assertLessEqual(summary["p99"], 1.0)
+
+	def test_timed(self):
+		"""Decorated functions are counted each time they are called."""
+		@accessible_typing_test.metrics.timed("test_timed")
+		def function(value):
+			return value * 2
+
+		self.assertEqual(function(2), 4)
+		function(3)
+		self.assertEqual(accessible_typing_test.metrics.histogram("test_timed").count, 2)
@@ -0,0 +1,50 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import random
+from unittest import TestCase
+from accessible_typing_test.percentiles import binCounts, binNumber, QuantileSketch
+
+
+class TestPercentiles(TestCase):
+	"""Make sure percentile ranks read from bins match sorting every value."""
+
+	def test_rank(self):
+		"""Whole numbers are ranked exactly against the values below them."""
+		chooser = random.Random(0)
+		speeds = [chooser.randrange(10, 90) for count in range(1000)]
+		counts = {}
+		for speed in speeds:
+			counts[binNumber("speed", speed)] = counts.get(binNumber("speed", speed), 0) + 1
+		sketch = QuantileSketch("speed", counts)
+		self.assertEqual(sketch.total, 1000)
+		for speed in (5, 10, 42, 89, 200):
+			self.assertAlmostEqual(
+				sketch.rank(speed),
+				100 * sum(other < speed for other in speeds) / len(speeds),
+				)
+		self.assertLessEqual(abs(sketch.quantile(50) - sorted(speeds)[500]), 1)
+		self.assertIsNone(QuantileSketch("speed").rank(40))
+
+	def test_bin_counts(self):
+		"""A result is counted for every result and for its year, and can be taken away."""
+		start = datetime.datetime(2019, 4, 7)
+		counts = binCounts([(90, 30, start), (250, 400, start)])
+		self.assertEqual(counts[("accuracy", "all", 90)], 1)
+		self.assertEqual(counts[("accuracy", "2019", 100)], 1)
+		self.assertEqual(counts[("speed", "all", 300)], 1)
+		self.assertEqual(binCounts([(90, 30, None)], sign=-1)[("speed", "all", 30)], -1)
@@ -0,0 +1,93 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import os
+import tempfile
+from unittest import TestCase
+import openpyxl
+from accessible_typing_test.database import connect, disconnect, session_scope, Results, Sentences
+from accessible_typing_test.reports import reportFileName, writeReports
+from accessible_typing_test.tests.test_ResultsDatabase import resultsDict
+
+
+class TestReports(TestCase):
+	"""A workbook is written for every user, in this process or in a pool."""
+
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		connect(os.path.join(self.directory.name, "test_results.dat"))
+		with session_scope() as session:
+			session.add(Sentences(id=1, sentence="One two three four five."))
+			session.add(Sentences(id=2, sentence="Six seven eight nine ten."))
+		results_dict = resultsDict()
+		results_dict["typed_text"] = "One two three four five.\nSix sevem eight nine ten."
+		Results.storeResults([results_dict, resultsDict("a/b")])
+
+	def tearDown(self):
+		disconnect()
+		self.directory.cleanup()
+
+	def test_reports(self):
+		"""Each user's workbook lists their results, progress and mistakes."""
+		for processes in (1, 2):
+			output = os.path.join(self.directory.name, f"reports {processes}")
+			written = writeReports(output, processes=processes)
+			self.assertEqual(
+				written,
+				[
+					("a/b", reportFileName(output, "a/b"), 1),
+					("tester", reportFileName(output, "tester"), 1),
+					],
+				)
+			self.assertEqual(os.path.basename(written[0][1]), "a_b - Typing Test Results.xlsx")
+			workbook = openpyxl.load_workbook(written[1][1], read_only=True)
+			self.assertEqual(
+				workbook.sheetnames,
+				["Summary", "Results", "Weekly Progress", "Mistakes"],
+				)
+			summary = dict(workbook["Summary"].iter_rows(min_row=2, values_only=True))
+			self.assertEqual(summary["Tests"], 1)
+			self.assertEqual(len(list(workbook["Results"].iter_rows())), 2)
+			self.assertEqual(
+				list(workbook["Mistakes"].iter_rows(min_row=2, values_only=True)),
+				[("n", "m", 1)],
+				)
+			workbook.close()
+
+	def test_date_range(self):
+		"""Reports limited to a date range only list the results in it."""
+		Results.storeResults([resultsDict(start=datetime.datetime(2018, 6, 1, 9, 0, 0))])
+		output = os.path.join(self.directory.name, "reports")
+		written = writeReports(
+			output,
+			since=datetime.datetime(2019, 1, 1),
+			until=datetime.datetime(2020, 1, 1),
+			processes=1,
+			)
+		self.assertEqual([(user, count) for user, path, count in written], [("a/b", 1), ("tester", 1)])
+		workbook = openpyxl.load_workbook(written[1][1], read_only=True)
+		self.assertEqual(len(list(workbook["Results"].iter_rows())), 2)
+		self.assertIn("Mistakes (All Time)", workbook.sheetnames)
+		workbook.close()
+
+	def test_file_names(self):
+		"""Users whose names make the same file name are given different workbooks."""
+		Results.storeResults([resultsDict("a_b"), resultsDict("A_B")])
+		written = writeReports(os.path.join(self.directory.name, "reports"), processes=1)
+		paths = [path for user, path, count in written]
+		self.assertEqual(len(set(path.lower() for path in paths)), 4)
+		self.assertTrue(all(os.path.exists(path) for path in paths))
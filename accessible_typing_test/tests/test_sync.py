@@ -0,0 +1,90 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import datetime
+import os
+import tempfile
+import threading
+from unittest import TestCase
+from accessible_typing_test.collector import ResultsCollector
+from accessible_typing_test.database import connect, disconnect, session_scope, Results, Sentences
+from accessible_typing_test.sync import CollectorError, SyncClient
+from accessible_typing_test.tests.test_ResultsDatabase import resultsDict
+
+
+class TestSyncClient(TestCase):
+	"""A station's results reach the collector once each."""
+
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		connect(os.path.join(self.directory.name, "station.dat"))
+		with session_scope() as session:
+			session.add(Sentences(id=1, sentence="One two three four five."))
+			session.add(Sentences(id=2, sentence="Six seven eight nine ten."))
+		self.uploads = []
+		self.failing = False
+		self.collector = ResultsCollector(port=0, store=self.store)
+		threading.Thread(target=self.collector.serve_forever, daemon=True).start()
+
+	def tearDown(self):
+		self.collector.shutdown()
+		self.collector.server_close()
+		disconnect()
+		self.directory.cleanup()
+
+	def store(self, batch):
+		self.uploads.append(batch)
+		if self.failing:
+			raise OSError("The database is locked.")
+		return list(range(len(batch)))
+
+	def test_sync(self):
+		"""Unsynced results are sent in batches with the station's name."""
+		Results.storeResults([
+			resultsDict(start=datetime.datetime(2019, 4, day)) for day in range(1, 6)
+			])
+		client = SyncClient(self.collector.url, station="Station 1", batch_size=2, interval=5)
+		client.start()
+		client.stop(timeout=5)
+		self.assertEqual([len(batch) for batch in self.uploads], [2, 2, 1])
+		sent = self.uploads[0][0]
+		self.assertEqual(sent["station"], "Station 1")
+		self.assertEqual(sent["given_text"], resultsDict()["given_text"])
+		self.assertEqual(sent["sentences"][1]["sentence_id"], 2)
+		self.assertEqual(Results.unsyncedResults(10), [])
+
+	def test_error_reply(self):
+		"""A batch the collector could not store is left for the backoff, not sent again."""
+		Results.storeResults([
+			resultsDict(start=datetime.datetime(2019, 4, day)) for day in range(1, 3)
+			])
+		client = SyncClient(self.collector.url, batch_size=1)
+
+		async def syncTwice():
+			await client.syncBatch()
+			self.failing = True
+			try:
+				with self.assertRaises(CollectorError) as raised:
+					await client.syncBatch()
+			finally:
+				await client._close()
+			return raised.exception
+
+		error = asyncio.run(syncTwice())
+		self.assertEqual(error.status, 503)
+		self.assertEqual(len(self.uploads), 2)
+		self.assertEqual(len(Results.unsyncedResults(10)), 1)
@@ -0,0 +1,61 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+from unittest import TestCase
+from accessible_typing_test.features import sentenceBigrams, IndexedSentence, SentenceIndex
+from accessible_typing_test.weakness import errorCounts, AdaptiveSelector, WeaknessProfile
+
+
+class TestWeakness(TestCase):
+	"""Make sure weak characters are found and practised."""
+
+	def test_error_counts(self):
+		"""Wrong characters and the bigrams around them are counted as errors."""
+		counts = errorCounts("abca", "abxa")
+		self.assertEqual(counts["a"], [2, 0])
+		self.assertEqual(counts["c"], [1, 1])
+		self.assertEqual(counts["ab"], [1, 0])
+		self.assertEqual(counts["bc"], [1, 1])
+		self.assertEqual(counts["ca"], [1, 1])
+
+	def test_profile(self):
+		"""The weakest keys come first and follow new counts."""
+		profile = WeaknessProfile({"q": [10, 5], "z": [10, 1], "e": [10, 0]})
+		keys, cumulative = profile.weakest()
+		self.assertEqual(keys, ["q", "z"])
+		self.assertEqual(len(cumulative), 2)
+		profile.add({"z": [0, 9]})
+		self.assertEqual(profile.weakest()[0], ["z", "q"])
+
+	def test_selector(self):
+		"""Sentences with a weak bigram are preferred."""
+		sentences = ["the cat sat", "a dog ran", "quiz quip", "the hen"]
+		index = SentenceIndex(
+			[
+				IndexedSentence(id, sentence, 2, 1, sentenceBigrams(sentence))
+				for id, sentence in enumerate(sentences)
+				],
+			random.Random(0),
+			)
+		selector = AdaptiveSelector(
+			index,
+			WeaknessProfile({"qu": [10, 8]}),
+			exploration=0,
+			chooser=random.Random(0),
+			)
+		self.assertEqual(selector(set()).id, 2)
+		self.assertNotEqual(selector({2}).id, 2)
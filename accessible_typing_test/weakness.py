@@ -0,0 +1,192 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The characters and bigrams each user gets wrong, and practising them.
+
+A WeaknessProfile counts how often a user has typed each character and bigram
+and how often they got it wrong. An AdaptiveSelector uses the profile to prefer
+sentences which contain the user's weakest characters and bigrams.
+"""
+
+import random
+import threading
+from .lev import alignStrings
+
+# Attempts added to every count so that characters seen only once or twice do
+# not look weaker than characters which are often wrong.
+SMOOTHING = 5
+# How many of the weakest characters and bigrams sentences are chosen for.
+WEAK_KEYS = 20
+# The share of sentences drawn at random so that a user is not only tested on
+# what they already get wrong.
+EXPLORATION = 0.25
+
+
+def errorCounts(given: str, typed: str) -> dict:
+	"""Counts the attempts at and errors in each character and bigram of a sentence.
+
+	An extra typed character counts as an error in the given character before it.
+	A bigram is wrong if either of its characters is wrong.
+
+	Args:
+		given: The sentence which should have been typed.
+		typed: What was typed.
+
+	Returns:
+		dict: [attempts, errors] keyed by character or bigram.
+	"""
+	missed = []
+	for given_character, typed_character in alignStrings(given, typed):
+		if not given_character:
+			if missed:
+				missed[-1] = True
+			continue
+		missed.append(given_character != typed_character)
+	counts = {}
+	for position, character in enumerate(given):
+		count = counts.setdefault(character, [0, 0])
+		count[0] += 1
+		count[1] += missed[position]
+	for position in range(len(given) - 1):
+		count = counts.setdefault(given[position:position + 2], [0, 0])
+		count[0] += 1
+		count[1] += missed[position] or missed[position + 1]
+	return counts
+
+
+def mergeCounts(total: dict, counts: dict, sign: int = 1) -> dict:
+	"""Adds counts made by errorCounts to a running total.
+
+	Args:
+		total: The counts to add to, which are changed in place.
+		counts: The counts to add.
+		sign: 1 to add the counts or -1 to take them away.
+
+	Returns:
+		dict: The total.
+	"""
+	for key, (attempts, errors) in counts.items():
+		count = total.setdefault(key, [0, 0])
+		count[0] += sign * attempts
+		count[1] += sign * errors
+	return total
+
+
+class WeaknessProfile:
+	"""How often one user gets each character and bigram wrong."""
+
+	def __init__(self, counts: dict = None) -> None:
+		"""Initialize a WeaknessProfile.
+
+		Args:
+			counts: [attempts, errors] keyed by character or bigram.
+		"""
+		self.counts = {}
+		self._weakest = None
+		self._lock = threading.Lock()
+		if counts:
+			self.add(counts)
+
+	def add(self, counts: dict, sign: int = 1) -> None:
+		"""Adds the counts from another test to the profile."""
+		with self._lock:
+			mergeCounts(self.counts, counts, sign)
+			self._weakest = None
+
+	def score(self, key: str) -> float:
+		"""Returns how weak a user is at a character or bigram, from 0 to 1."""
+		attempts, errors = self.counts.get(key, (0, 0))
+		return max(errors, 0) / (max(attempts, 0) + SMOOTHING)
+
+	def weakest(self, limit: int = WEAK_KEYS) -> tuple:
+		"""Returns the weakest characters and bigrams for weighted choices.
+
+		The list is worked out again only after the profile changes.
+
+		Returns:
+			tuple: The keys, weakest first, and their cumulative scores.
+		"""
+		with self._lock:
+			if self._weakest is None:
+				scores = sorted(
+					(
+						(self.score(key), key)
+						for key, (attempts, errors) in self.counts.items()
+						if errors > 0
+						),
+					reverse=True,
+					)[:limit]
+				keys = [key for score, key in scores]
+				cumulative = []
+				total = 0.0
+				for score, key in scores:
+					total += score
+					cumulative.append(total)
+				self._weakest = (keys, cumulative)
+			return self._weakest
+
+
+class AdaptiveSelector:
+	"""A sentence source which prefers sentences practising a user's weaknesses."""
+
+	def __init__(
+		self,
+		index,
+		profile: WeaknessProfile,
+		level: int = 0,
+		exploration: float = EXPLORATION,
+		chooser: random.Random = None,
+		) -> None:
+		"""Initialize an AdaptiveSelector.
+
+		Args:
+			index (accessible_typing_test.features.SentenceIndex): The sentences to
+				choose from.
+			profile: The weaknesses of the user taking the test.
+			level: The difficulty level to keep to, or 0 for any level.
+			exploration: The share of sentences to draw without regard to weakness.
+			chooser: The source of random numbers.
+		"""
+		self.index = index
+		self.profile = profile
+		self.level = level
+		self.exploration = exploration
+		self.random = chooser or random.Random()
+
+	def __call__(self, used: set):
+		"""Draws the next sentence for a TypingSession."""
+		return self.draw(used)
+
+	def draw(self, used: set):
+		"""Draws an unused sentence, most likely one containing a weak key.
+
+		Args:
+			used: The ids of sentences which should not be chosen.
+
+		Returns:
+			IndexedSentence: The sentence, or None if every sentence is used.
+		"""
+		keys, cumulative = self.profile.weakest()
+		if keys and self.random.random() >= self.exploration:
+			for attempt in range(8):
+				key = self.random.choices(keys, cum_weights=cumulative)[0]
+				candidates = self.index.containing.get(key)
+				if not candidates:
+					continue
+				entry = candidates[self.random.randrange(len(candidates))]
+				if entry.id not in used and (not self.level or entry.level == self.level):
+					return entry
+		return self.index.draw(used, self.level)
@@ -0,0 +1,314 @@
+# accessible_typing_test
+# Copyright (C) 2019 Thomas Stivers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Stores test results in the background so the user interface never waits.
+
+Each result is first written to its own file in a spool directory, which only
+takes a moment, and then handed to a writer thread. The thread stores results
+in batches and deletes their spool files once they are committed. Anything left
+in the spool when the program stops, even because it crashed, is stored the
+next time a ResultsWriter starts. While the database or collector cannot be
+reached, results stay in the spool and are tried again until they are stored.
+A result which can never be stored, or a spool file which cannot be read, is
+moved to the quarantine directory inside the spool so it does not hold up
+everything behind it.
+"""
+
+import datetime
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import urllib.error
+import uuid
+from sqlalchemy.exc import OperationalError
+import wx
+from .database import Results
+from .metrics import timer
+
+# Marks the end of the queue when the writer is stopped.
+_STOP = object()
+# Where results which could not be stored are kept, inside the spool directory.
+QUARANTINE_DIRECTORY = "quarantine"
+# Errors which may go away if the same results are stored again later, such as
+# a database which is locked by another station or a collector which cannot be
+# reached.
+_TRANSIENT_ERRORS = (OperationalError, OSError)
+
+
+def _transient(error: Exception) -> bool:
+	"""Returns whether storing the same results again later might succeed."""
+	if isinstance(error, urllib.error.HTTPError):
+		# The collector could not read the results, which sending them again will
+		# not change. It replies 503 when it could not store them for now.
+		return not 400 <= error.code < 500
+	return isinstance(error, _TRANSIENT_ERRORS)
+
+
+def encodeResults(results_dict: dict) -> str:
+	"""Converts a results dictionary to JSON, keeping its dates and times."""
+	def default(value):
+		if isinstance(value, datetime.datetime):
+			return {"__datetime__": value.isoformat()}
+		raise TypeError(f"Cannot store {repr(value)} in the spool.")
+	return json.dumps(results_dict, default=default)
+
+
+def decodeResults(text: str) -> dict:
+	"""Converts JSON made by encodeResults back to a results dictionary."""
+	def objectHook(value):
+		if "__datetime__" in value:
+			return datetime.datetime.fromisoformat(value["__datetime__"])
+		return value
+	return json.loads(text, object_hook=objectHook)
+
+
+class ResultsWriter(threading.Thread):
+	"""A background thread which stores spooled results in batches."""
+
+	def __init__(
+		self,
+		spool_directory: str,
+		store=Results.storeResults,
+		notify=wx.CallAfter,
+		batch_size: int = 50,
+		batch_delay: float = 0.5,
+		retry_delay: float = 1,
+		max_retry_delay: float = 60,
+		) -> None:
+		"""Initialize a ResultsWriter.
+
+		Args:
+			spool_directory: Where results wait until they are stored.
+			store: Stores a list of results dictionaries and returns their ids.
+			notify: Runs a callback on the user interface thread.
+			batch_size: The most results to store in one transaction.
+			batch_delay: How many seconds to wait for more results to store along
+				with the first one.
+			retry_delay: How many seconds to wait before storing results again after
+				an error which may go away. The wait doubles after each try.
+			max_retry_delay: The longest wait between tries.
+		"""
+		super().__init__(name="ResultsWriter", daemon=True)
+		self.spool_directory = spool_directory
+		self._store = store
+		self._notify = notify
+		self.batch_size = batch_size
+		self.batch_delay = batch_delay
+		self.retry_delay = retry_delay
+		self.max_retry_delay = max_retry_delay
+		self._queue = queue.Queue()
+		self._stopping = threading.Event()
+		os.makedirs(spool_directory, exist_ok=True)
+
+	@property
+	def quarantine_directory(self) -> str:
+		"""Where spool files which could not be stored or read are moved."""
+		return os.path.join(self.spool_directory, QUARANTINE_DIRECTORY)
+
+	def quarantine(self, path: str) -> None:
+		"""Moves a spool file out of the way so it is not tried again."""
+		os.makedirs(self.quarantine_directory, exist_ok=True)
+		destination = os.path.join(self.quarantine_directory, os.path.basename(path))
+		try:
+			os.replace(path, destination)
+		except FileNotFoundError:
+			return
+		logging.error("Moved %s to %s.", path, destination)
+
+	def spool(self, results_dict: dict) -> str:
+		"""Writes a results dictionary safely to its own spool file.
+
+		Returns:
+			str: The path of the spool file.
+		"""
+		name = f"{time.time_ns()}-{uuid.uuid4().hex}.json"
+		path = os.path.join(self.spool_directory, name)
+		temporary = path + ".tmp"
+		with open(temporary, "w", encoding="utf-8") as spool_file:
+			spool_file.write(encodeResults(results_dict))
+			spool_file.flush()
+			os.fsync(spool_file.fileno())
+		os.replace(temporary, path)
+		return path
+
+	def submit(self, results_dict: dict, callback=None) -> str:
+		"""Spools a results dictionary and queues it to be stored.
+
+		Args:
+			results_dict: The results to store.
+			callback: Called on the user interface thread with the list of ids
+				stored in the same batch once the results are committed.
+
+		Returns:
+			str: The path of the spool file.
+		"""
+		path = self.spool(results_dict)
+		self._queue.put((path, results_dict, callback))
+		return path
+
+	def replaySpool(self, callback=None) -> int:
+		"""Queues every result left in the spool by an earlier run.
+
+		A file which cannot be read is quarantined.
+
+		Args:
+			callback: Called as for submit once the results are stored.
+
+		Returns:
+			int: The number of results queued.
+		"""
+		count = 0
+		for name in sorted(os.listdir(self.spool_directory)):
+			path = os.path.join(self.spool_directory, name)
+			if name.endswith(".tmp"):
+				# The program stopped before this file was completely written.
+				os.remove(path)
+				continue
+			if not name.endswith(".json"):
+				continue
+			try:
+				with open(path, encoding="utf-8") as spool_file:
+					results_dict = decodeResults(spool_file.read())
+			except (OSError, ValueError):
+				logging.exception("Could not read the spool file %s.", path)
+				self.quarantine(path)
+				continue
+			self._queue.put((path, results_dict, callback))
+			count += 1
+		if count:
+			logging.info("Storing %d results left in the spool.", count)
+		return count
+
+	def stop(self, timeout: float = None) -> None:
+		"""Stores everything already queued and then stops the thread.
+
+		Results which fail with an error which may go away are not tried again
+		once the writer is stopping.
+
+		Args:
+			timeout: The most seconds to wait. Anything not stored by then stays in
+				the spool.
+		"""
+		self._stopping.set()
+		self._queue.put(_STOP)
+		self.join(timeout)
+
+	def _nextBatch(self) -> tuple:
+		"""Waits for results and gathers as many as possible into one batch.
+
+		Returns:
+			tuple: The batch, and True if the writer has been asked to stop.
+		"""
+		item = self._queue.get()
+		if item is _STOP:
+			return [], True
+		batch = [item]
+		deadline = time.monotonic() + self.batch_delay
+		while len(batch) < self.batch_size:
+			try:
+				item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+			except queue.Empty:
+				break
+			if item is _STOP:
+				return batch, True
+			batch.append(item)
+		return batch, False
+
+	def _attempt(self, batch: list) -> list:
+		"""Stores a batch, trying again for as long as the error may go away.
+
+		Returns:
+			list: The ids of the stored results, or None if the writer stopped
+			before they could be stored.
+
+		Raises:
+			Exception: The error from a store which trying again will not fix.
+		"""
+		delay = self.retry_delay
+		while True:
+			try:
+				with timer("ResultsWriter.store"):
+					return self._store([results_dict for path, results_dict, callback in batch])
+			except Exception as error:
+				if not _transient(error):
+					raise
+				if self._stopping.is_set():
+					logging.warning(
+						"Could not store %d results: %s. They stay in the spool.",
+						len(batch),
+						error,
+						)
+					return None
+				logging.warning(
+					"Could not store %d results: %s. Trying again in %.0f seconds.",
+					len(batch),
+					error,
+					delay,
+					)
+			if self._stopping.wait(delay):
+				return None
+			delay = min(delay * 2, self.max_retry_delay)
+
+	def _write(self, batch: list) -> None:
+		"""Stores a batch, then clears its spool files.
+
+		Results stay in the spool for as long as they fail with errors which may go
+		away. If the batch fails with any other error, each result is stored by
+		itself and those which fail with such an error again are quarantined.
+		Moving a quarantined file back into the spool stores it the next time the
+		program starts.
+		"""
+		stored = []
+		ids = []
+		try:
+			ids = self._attempt(batch)
+			if ids is None:
+				return
+			stored = batch
+		except Exception:
+			logging.exception("Could not store %d results.", len(batch))
+			if len(batch) == 1:
+				self.quarantine(batch[0][0])
+				return
+			for item in batch:
+				try:
+					item_ids = self._attempt([item])
+				except Exception:
+					logging.exception("Could not store the results in %s.", item[0])
+					self.quarantine(item[0])
+					continue
+				if item_ids is None:
+					break
+				stored.append(item)
+				ids.extend(item_ids)
+		for path, results_dict, callback in stored:
+			try:
+				os.remove(path)
+			except FileNotFoundError:
+				pass
+		for callback in {callback for path, results_dict, callback in stored if callback}:
+			self._notify(callback, ids)
+
+	def run(self) -> None:
+		"""Stores batches of results until the writer is stopped."""
+		stopping = False
+		while not stopping:
+			batch, stopping = self._nextBatch()
+			if batch:
+				self._write(batch)
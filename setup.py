@@ -32,15 +32,16 @@ setup(name="accessible_typing_test",
 	packages=["accessible_typing_test"],
 	entry_points={
 		"console_scripts": [
-			"accessible_typing_test = accessible_typing_test.main:main"
+			"accessible_typing_test = accessible_typing_test.main:main",
+			"accessible_typing_test_admin = accessible_typing_test.admin:main",
 			],
 		},
 	install_requires=[
 		"openpyxl",
 		"pyttsx3",
-		"pywin32",
+		"pywin32; sys_platform == 'win32'",
 		"sphinx",
-		"sqlalchemy",
+		"sqlalchemy>=2.0",
 		"wxpython",
 		],
 		tests_require=["nose"],